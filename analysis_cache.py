@@ -0,0 +1,110 @@
+"""
+Потокобезопасный кэш результатов в памяти процесса
+
+- LRU: при переполнении вытесняются давно не использованные записи;
+- TTL: запись живёт не дольше ttl секунд;
+- лимит памяти: суммарный размер записей (по функции sizeof) не больше max_bytes;
+- single-flight: пока значение для ключа вычисляется, остальные запросы
+  того же ключа ждут результата, а не считают его повторно; ожидающие
+  получают этот результат (или исключение), даже если он не сохраняется в кэш.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class ResultCache:
+    """LRU/TTL-кэш с ограничением по числу записей и по памяти"""
+
+    def __init__(self, max_entries=64, ttl=6 * 3600, max_bytes=512 * 1024 * 1024, sizeof=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or sys.getsizeof
+        self._entries = OrderedDict()     # key -> (value, created_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}    # key -> Future вычисляемого значения
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key)
+        return default if entry is None else entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return   # не помещается даже в пустой кэш
+            self._entries[key] = (value, time.monotonic(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, key=None):
+        """Удаляет запись (или весь кэш, если key не задан)"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._drop(key)
+
+    def get_or_compute(self, key, compute, should_cache=None):
+        """
+        Значение из кэша или результат compute(); одновременные запросы
+        одного ключа выполняют compute один раз и получают один и тот же результат.
+        should_cache(value) — сохранять ли результат (например, не кэшировать пустые);
+        несохранённый результат получают только те, кто уже ждал вычисления.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry[0]
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = Future()
+
+        if not leader:
+            return flight.result()
+        try:
+            value = compute()
+            if should_cache is None or should_cache(value):
+                self.put(key, value)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(value)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        return value
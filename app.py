@@ -4,38 +4,28 @@ import numpy as np
 import matplotlib.pyplot as plt
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
 import warnings
 warnings.filterwarnings('ignore')
 
 # Импорт наших модулей
-from import_ru import download_by_tnved, mark_friendly
-from calc_import_metrics import calc_import_metrics
-from draw_image import summarize_trends, pie_friendly_unfriendly_with_china
-from calc_man_metrics import calculate_man_metrics, get_summary_metrics
-from llm.llm_answer import get_llm_answer
+from calc_import_metrics import SEGMENTS, records_table
+from countries import SEGMENT_LABELS
+from jobs import CANCELLED, DONE, get_job_manager
+from pipeline import stored_import_table
+from calc_man_metrics import calculate_man_metrics, get_summary_metrics, production_codes
+from production_io import load_production
+from rules_engine import MEASURES, evaluate as evaluate_rules
+from llm.llm_answer import stream_llm_answer
+from llm.prompt_builder import build_prompt, prompt_from_text
 
 # Функции для создания графиков
-def create_pie_chart(df_year, year):
+def create_pie_chart(segments, year):
     """Создает круговую диаграмму для конкретного года"""
-    CHINA = 'China'
-    
-    # Подготовка данных
-    d = df_year.copy()
-    d['primaryValue'] = pd.to_numeric(d['primaryValue'], errors="coerce").fillna(0)
-    
-    # Маски
-    mask_china = d['reporterDesc'].str.contains(CHINA, na=False)
-    mask_friend = d['isFriendly'] == 1
-    
-    # Суммы по категориям
-    val_china = float(d.loc[mask_china, 'primaryValue'].sum())
-    val_friend_other = float(d.loc[mask_friend & ~mask_china, 'primaryValue'].sum())
-    val_unfriendly = float(d.loc[~mask_friend, 'primaryValue'].sum())
+    # Суммы по сегментам (Китай, прочие дружественные, недружественные) — из готовой таблицы
+    values = segments.loc[year, SEGMENTS].tolist()
     
     # Создание графика
-    labels = ["Китай", "Другие дружественные", "Недружественные"]
-    values = [val_china, val_friend_other, val_unfriendly]
+    labels = SEGMENT_LABELS
     colors = ['#FF6B6B', '#4ECDC4', '#45B7D1']
     
     fig = go.Figure(data=[go.Pie(
@@ -69,26 +59,13 @@ def create_pie_chart(df_year, year):
     
     return fig
 
-def create_total_pie_chart(df1, df2, df3):
+def create_total_pie_chart(segments):
     """Создает общую круговую диаграмму за все годы"""
-    CHINA = 'China'
-    
-    # Объединяем все данные
-    df_total = pd.concat([df1, df2, df3], ignore_index=True)
-    df_total['primaryValue'] = pd.to_numeric(df_total['primaryValue'], errors="coerce").fillna(0)
-    
-    # Маски
-    mask_china = df_total['reporterDesc'].str.contains(CHINA, na=False)
-    mask_friend = df_total['isFriendly'] == 1
-    
-    # Суммы по категориям
-    val_china = float(df_total.loc[mask_china, 'primaryValue'].sum())
-    val_friend_other = float(df_total.loc[mask_friend & ~mask_china, 'primaryValue'].sum())
-    val_unfriendly = float(df_total.loc[~mask_friend, 'primaryValue'].sum())
+    # Суммы по сегментам за все годы — из готовой таблицы
+    values = segments[SEGMENTS].sum().tolist()
     
     # Создание графика
-    labels = ["Китай", "Другие дружественные", "Недружественные"]
-    values = [val_china, val_friend_other, val_unfriendly]
+    labels = SEGMENT_LABELS
     colors = ['#FF6B6B', '#4ECDC4', '#45B7D1']
     
     fig = go.Figure(data=[go.Pie(
@@ -406,88 +383,55 @@ def create_metrics_radar_chart(metrics_data, category):
     
     return fig
 
+def measure_rules():
+    """Проверка критериев мер №1–6 по текущему коду (локально, без LLM); None — нет данных"""
+    if 'trends' not in st.session_state:
+        return None
+    code = str(st.session_state.tnved_code)
+    rules = evaluate_rules(records_table({code: st.session_state.records}),
+                           st.session_state.get('production_df'), year=st.session_state.years[-1])
+    return rules if code in rules.measures.index else None
+
 def format_metrics_for_llm():
-    """Форматирует все метрики для передачи в LLM промпт"""
+    """Собирает запрос к LLM по всем метрикам (с учётом бюджета токенов)"""
     if 'trends' not in st.session_state:
-        return "Данные не загружены"
+        return prompt_from_text("Данные не загружены")
     
-    latest_record = st.session_state.records[-1]
-    trends = st.session_state.trends
-    latest_year = st.session_state.years[-1]
-    tnved_code = st.session_state.tnved_code
-    
-    # Формируем строку с метриками
-    metrics_text = f"""
-Данные:
-Код ТН ВЭД: {tnved_code}
-Период: {latest_year} год
-
-Объём импорта (import_total): {latest_record['import_total']:,.0f}
-Тренд импорта (import_total_trend): {trends['trends']['import_total']['label']}
+    rules = measure_rules()
+    return build_prompt(
+        st.session_state.tnved_code,
+        st.session_state.years[-1],
+        st.session_state.records[-1],
+        st.session_state.trends,
+        st.session_state.get('production_metrics'),
+        rules=rules.explain(str(st.session_state.tnved_code)) if rules is not None else None,
+    )
 
-Доля импорта из недружественных стран (share_unfriendly): {latest_record['share_unfriendly']:.3f}
-Тренд доли НС (share_unfriendly_trend): {trends['trends']['share_unfriendly']['label']}
+# Подписи этапов фоновой задачи анализа
+JOB_STAGES = {
+    "": "⏳ Анализ в очереди...",
+    "download": "🔄 Загружаем данные из UN Comtrade...",
+    "prepare": "🔄 Подготавливаем данные...",
+    "metrics": "🔄 Рассчитываем метрики импорта...",
+    "trends": "🔄 Рассчитываем тренды...",
+    "done": "✅ Анализ завершён",
+}
 
-Доля импорта из Китая (share_china): {latest_record['share_china']:.3f}
-Тренд доли Китая (share_china_trend): {trends['trends']['share_china']['label']}
-"""
-    
-    # Добавляем ценовые метрики
-    if not np.isnan(latest_record['price_china']):
-        metrics_text += f"Средняя цена из Китая (price_china): {latest_record['price_china']:.2f}\n"
-    else:
-        metrics_text += "Средняя цена из Китая (price_china): N/A\n"
-    
-    if not np.isnan(latest_record['price_others']):
-        metrics_text += f"Средняя цена из прочих стран (price_others): {latest_record['price_others']:.2f}\n"
-    else:
-        metrics_text += "Средняя цена из прочих стран (price_others): N/A\n"
-    
-    if not np.isnan(latest_record['price_diff_ratio']):
-        metrics_text += f"Отношение цен (price_diff_ratio): {latest_record['price_diff_ratio']:.3f}\n"
-        metrics_text += f"Флаг демпинга (dumping_flag): {latest_record['price_diff_ratio'] < 1.0}\n"
-    else:
-        metrics_text += "Отношение цен (price_diff_ratio): N/A\n"
-        metrics_text += "Флаг демпинга (dumping_flag): N/A\n"
-    
-    # Добавляем флаги для мер ТТР
-    metrics_text += "\nФлаги для мер ТТР:\n"
-    for flag_key, flag_value in trends['flags'].items():
-        metrics_text += f"{flag_key}: {flag_value}\n"
-    
-    # Добавляем метрики производства и потребления, если они доступны
-    if 'production_metrics' in st.session_state:
-        metrics_text += "\n=== МЕТРИКИ ПРОИЗВОДСТВА И ПОТРЕБЛЕНИЯ ===\n"
-        
-        for category, category_metrics in st.session_state.production_metrics.items():
-            latest_year_prod = max(category_metrics.keys())
-            latest_metrics = category_metrics[latest_year_prod]
-            
-            metrics_text += f"\nКатегория: {category}\n"
-            metrics_text += f"Производство в России (production_total): {latest_metrics['manufacture']:,.0f} млн $\n"
-            metrics_text += f"Потребление в России (consumption_total): {latest_metrics['consumption']:,.0f} млн $\n"
-            metrics_text += f"Производство покрывает потребление: {latest_metrics['self_sufficiency'] >= 1.0}\n"
-            
-            if latest_metrics['growth_rate'] is not None:
-                metrics_text += f"Тренд производства (production_trend): {'Положительный' if latest_metrics['growth_rate'] > 0.02 else 'Отрицательный' if latest_metrics['growth_rate'] < -0.02 else 'Стабильный'}\n"
-            else:
-                metrics_text += "Тренд производства (production_trend): N/A\n"
-            
-            if latest_metrics['consumption_growth_rate'] is not None:
-                metrics_text += f"Тренд потребления (consumption_trend): {'Положительный' if latest_metrics['consumption_growth_rate'] > 0.02 else 'Отрицательный' if latest_metrics['consumption_growth_rate'] < -0.02 else 'Стабильный'}\n"
-            else:
-                metrics_text += "Тренд потребления (consumption_trend): N/A\n"
-            
-            metrics_text += f"Самообеспеченность: {latest_metrics['self_sufficiency']:.3f}\n"
-            metrics_text += f"Зависимость от импорта: {latest_metrics['import_dependency']:.3f}\n"
-            metrics_text += f"Доля производства: {latest_metrics['production_share']:.3f}\n"
-            
-            if latest_metrics['competitiveness_index'] is not None:
-                metrics_text += f"Индекс конкурентоспособности: {latest_metrics['competitiveness_index']:.3f}\n"
-            else:
-                metrics_text += "Индекс конкурентоспособности: N/A\n"
+@st.fragment(run_every=1.0)
+def show_job_progress():
+    """Опрашивает фоновую задачу анализа; после её завершения перерисовывает страницу"""
+    manager = get_job_manager()
+    job = manager.get(st.session_state.job_id)
+    if job is not None and not job.finished:
+        st.progress(job.progress, text=JOB_STAGES.get(job.stage, JOB_STAGES[""]))
+        if st.button("⛔ Отменить анализ"):
+            manager.cancel(job.id)
+        return
     
-    return metrics_text
+    # Итог показывается при полной перерисовке страницы
+    del st.session_state.job_id
+    st.session_state.job_outcome = job
+    st.rerun()
 
 # Настройка страницы
 st.set_page_config(
@@ -564,49 +508,36 @@ if analyze_button:
     if not tnved_code or not tnved_code.isdigit():
         st.error("❌ Пожалуйста, введите корректный код ТН ВЭД (только цифры)")
     else:
-        with st.spinner("🔄 Загружаем данные и выполняем анализ..."):
-            try:
-                # Загрузка данных
-                df = download_by_tnved(tnved_code)
-                df = mark_friendly(df)
-                
-                if df.empty:
-                    st.error("❌ Данные по указанному коду ТН ВЭД не найдены")
-                else:
-                    # Подготовка данных
-                    col = ['refYear', 'reporterDesc', 'isFriendly', 'primaryValue', 'qty', 'qtyUnitCode', 'netWgt','partnerDesc']
-                    df_proc = df[col].copy()
-                    
-                    now = datetime.now()
-                    years = [now.year - 3, now.year - 2, now.year - 1]  # [2021, 2022, 2023] - от старых к новым
-                    
-                    df_proc_year_1 = df_proc[df_proc['refYear'] == years[0]].sort_values(by='primaryValue', ascending=False).copy()  # 2021
-                    df_proc_year_2 = df_proc[df_proc['refYear'] == years[1]].sort_values(by='primaryValue', ascending=False).copy()  # 2022
-                    df_proc_year_3 = df_proc[df_proc['refYear'] == years[2]].sort_values(by='primaryValue', ascending=False).copy()  # 2023
-                    
-                    # Расчет метрик в правильном порядке (от старых к новым)
-                    records = []
-                    records.append(calc_import_metrics(df_proc_year_1))  # 2021
-                    records.append(calc_import_metrics(df_proc_year_2))  # 2022
-                    records.append(calc_import_metrics(df_proc_year_3))  # 2023
-                    
-                    # Анализ трендов
-                    res = summarize_trends(records, plot=False)
-                    
-                    # Сохранение данных в session state
-                    st.session_state.df_proc_year_1 = df_proc_year_1
-                    st.session_state.df_proc_year_2 = df_proc_year_2
-                    st.session_state.df_proc_year_3 = df_proc_year_3
-                    st.session_state.records = records
-                    st.session_state.trends = res
-                    st.session_state.tnved_code = tnved_code
-                    st.session_state.years = years  # Сохраняем годы для отображения
-                    
-                    st.success(f"✅ Анализ успешно выполнен для кода ТН ВЭД: {tnved_code}")
-                    st.info(f"📅 Анализируемые годы: {years[0]}, {years[1]}, {years[2]}")
-                    
-            except Exception as e:
-                st.error(f"❌ Ошибка при выполнении анализа: {str(e)}")
+        # Анализ идёт в фоновом пуле процессов; одинаковые задачи разных сессий объединяются
+        st.session_state.job_id = get_job_manager().submit(tnved_code)
+
+if 'job_id' in st.session_state:
+    show_job_progress()
+
+if 'job_outcome' in st.session_state:
+    job = st.session_state.pop('job_outcome')
+    if job is None:
+        st.error("❌ Задача анализа не найдена, запустите анализ ещё раз")
+    elif job.status == DONE:
+        result = job.result
+        if result.empty:
+            st.error("❌ Данные по указанному коду ТН ВЭД не найдены")
+        else:
+            years = result.years  # от старых к новым
+            
+            # В session state — только ссылки на общий результат, без копий таблиц
+            st.session_state.analysis = result
+            st.session_state.records = result.records
+            st.session_state.trends = result.trends
+            st.session_state.tnved_code = result.tnved_code
+            st.session_state.years = years  # Сохраняем годы для отображения
+            
+            st.success(f"✅ Анализ успешно выполнен для кода ТН ВЭД: {result.tnved_code}")
+            st.info(f"📅 Анализируемые годы: {years[0]}, {years[1]}, {years[2]}")
+    elif job.status == CANCELLED:
+        st.warning("⛔ Анализ отменён")
+    else:
+        st.error(f"❌ Ошибка при выполнении анализа: {job.error}")
 
 # Отображение результатов
 if 'trends' in st.session_state:
@@ -692,26 +623,26 @@ if 'trends' in st.session_state:
         
         with col1:
             # График для первого года (2021)
-            if not st.session_state.df_proc_year_1.empty:
-                fig1 = create_pie_chart(st.session_state.df_proc_year_1, st.session_state.years[0])
+            if st.session_state.analysis.segments.loc[st.session_state.years[0], 'rows'] > 0:
+                fig1 = create_pie_chart(st.session_state.analysis.segments, st.session_state.years[0])
                 st.plotly_chart(fig1, use_container_width=True)
         
         with col2:
             # График для второго года (2022)
-            if not st.session_state.df_proc_year_2.empty:
-                fig2 = create_pie_chart(st.session_state.df_proc_year_2, st.session_state.years[1])
+            if st.session_state.analysis.segments.loc[st.session_state.years[1], 'rows'] > 0:
+                fig2 = create_pie_chart(st.session_state.analysis.segments, st.session_state.years[1])
                 st.plotly_chart(fig2, use_container_width=True)
         
         # График для третьего года (2023)
-        if not st.session_state.df_proc_year_3.empty:
-            fig3 = create_pie_chart(st.session_state.df_proc_year_3, st.session_state.years[2])
+        if st.session_state.analysis.segments.loc[st.session_state.years[2], 'rows'] > 0:
+            fig3 = create_pie_chart(st.session_state.analysis.segments, st.session_state.years[2])
             st.plotly_chart(fig3, use_container_width=True)
         
         # Общий график за все годы
         st.header("📊 Общая структура импорта за 3 года")
         st.caption("Сводная диаграмма показывает общую структуру импорта за весь анализируемый период")
         st.divider()
-        fig_total = create_total_pie_chart(st.session_state.df_proc_year_1, st.session_state.df_proc_year_2, st.session_state.df_proc_year_3)
+        fig_total = create_total_pie_chart(st.session_state.analysis.segments)
         st.plotly_chart(fig_total, use_container_width=True)
         
         # Графики трендов
@@ -760,8 +691,8 @@ if 'trends' in st.session_state:
         
         if uploaded_file is not None:
             try:
-                # Чтение CSV файла
-                df_production = pd.read_csv(uploaded_file)
+                # Чтение CSV файла частями с приведением типов; повторно один и тот же файл не разбирается
+                df_production = load_production(uploaded_file.getvalue())
                 
                 # Проверка наличия необходимых колонок
                 required_columns = ['category', 'year', 'manufacture', 'consumption', 'code']
@@ -791,7 +722,12 @@ if 'trends' in st.session_state:
                                 
                                 # Получаем код ТН ВЭД из session state
                                 tnved_code = st.session_state.get('tnved_code', None)
-                                production_metrics = calculate_man_metrics(df_production, import_metrics_by_year, tnved_code)
+                                
+                                # Импорт по остальным кодам файла — из локального хранилища, одним запросом
+                                import_table = stored_import_table(production_codes(df_production),
+                                                                   df_production['year'].dropna().unique())
+                                production_metrics = calculate_man_metrics(df_production, import_metrics_by_year, tnved_code,
+                                                                           import_table=import_table)
                                 summary_metrics = get_summary_metrics(production_metrics)
                                 
                                 # Сохранение в session state
@@ -911,10 +847,8 @@ if 'trends' in st.session_state:
                             metrics_table_data = []
                             for year in years:
                                 year_metrics = category_metrics[year]
-                                # Получаем данные импорта для данного года
-                                import_val = 0
-                                if 'import_metrics_by_year' in st.session_state and year in st.session_state.import_metrics_by_year:
-                                    import_val = st.session_state.import_metrics_by_year[year].get('import_total', 0)
+                                # Импорт по коду категории за данный год
+                                import_val = year_metrics.get('import_total', 0)
                                 
                                 metrics_table_data.append({
                                     'Год': year,
@@ -986,6 +920,23 @@ if 'trends' in st.session_state:
         st.info(f"📊 **Информация**: В данной таблице представлены все рассчитанные метрики за {latest_year} год с их описаниями для анализа целесообразности применения мер таможенно-тарифного регулирования. Тренды рассчитаны за 3-летний период.")
         st.divider()
         
+        # Проверка формальных критериев мер (локально, без LLM)
+        rules = measure_rules()
+        if rules is not None:
+            code = str(st.session_state.tnved_code)
+            passed = [measure for measure in MEASURES if rules.measures.at[code, measure]]
+            st.subheader("📐 Проверка критериев мер ТТР")
+            if passed:
+                st.success("✅ Критерии выполнены для мер: " + ", ".join(f"№{measure}" for measure in passed))
+            else:
+                st.info("ℹ️ По формальным критериям ни одна мера не выдаётся")
+            if 'production_df' not in st.session_state:
+                st.caption("Данные производства не загружены (вкладка «Производство и потребление») — часть критериев не проверена")
+            with st.expander("🔍 Критерии по каждой мере"):
+                st.markdown("\n".join(line if line.startswith("  - ") else f"\n**{line}**\n"
+                                      for line in rules.explain(code)))
+            st.divider()
+        
         # Кнопка для получения рекомендаций от LLM
         col1, col2 = st.columns([1, 1])
         
@@ -995,59 +946,64 @@ if 'trends' in st.session_state:
         with col2:
             show_metrics_table = st.checkbox("📋 Показать таблицу метрик", value=True, key="show_metrics_table")
         
-        # Получение рекомендаций от LLM
+        # Получение рекомендаций от LLM: текст выводится по мере генерации
+        streamed = False
         if get_recommendations:
-            with st.spinner("🤖 Анализируем данные и формируем рекомендации..."):
-                try:
-                    # Форматируем метрики для LLM
-                    metrics_text = format_metrics_for_llm()
+            st.session_state.pop('llm_recommendations', None)
+            try:
+                # Собираем запрос к LLM
+                prompt = format_metrics_for_llm()
+                
+                st.subheader("🤖 Рекомендации от ИИ")
+                st.caption(f"Запрос: ~{prompt.tokens:,} токенов; категорий производства подробно: "
+                           f"{prompt.detailed} из {prompt.categories}".replace(",", " "))
+                st.markdown("---")
+                
+                # Получаем рекомендации от LLM; полный ответ сохраняем в session state
+                st.session_state.llm_recommendations = st.write_stream(stream_llm_answer(prompt))
+                streamed = True
+                
+                st.success("✅ Рекомендации успешно получены!")
+                
+            except Exception as e:
+                st.error(f"❌ Ошибка при получении рекомендаций: {str(e)}")
+                st.info("💡 **Подсказка**: Убедитесь, что настроен API ключ для GigaChat в файле .env")
+                
+                # Показываем инструкцию по настройке API ключа
+                with st.expander("🔧 Инструкция по настройке API ключа GigaChat"):
+                    st.markdown("""
+                    **Для получения рекомендаций от ИИ необходимо настроить API ключ GigaChat:**
                     
-                    # Получаем рекомендации от LLM
-                    llm_recommendations = get_llm_answer(metrics_text)
+                    1. **Получите API ключ:**
+                       - Перейдите на https://developers.sber.ru/portal/products/gigachat
+                       - Зарегистрируйтесь или войдите в аккаунт
+                       - Создайте новый проект и получите API ключ
                     
-                    # Сохраняем рекомендации в session state
-                    st.session_state.llm_recommendations = llm_recommendations
+                    2. **Создайте файл `.env`:**
+                       - В корневой папке проекта создайте файл `.env`
+                       - Добавьте в него строку: `GIGACHAT_API_KEY=ваш_api_ключ`
                     
-                    st.success("✅ Рекомендации успешно получены!")
+                    3. **Пример файла `.env`:**
+                       ```
+                       GIGACHAT_API_KEY=your_actual_api_key_here
+                       ```
                     
-                except Exception as e:
-                    st.error(f"❌ Ошибка при получении рекомендаций: {str(e)}")
-                    st.info("💡 **Подсказка**: Убедитесь, что настроен API ключ для GigaChat в файле .env")
+                    4. **Перезапустите приложение** после создания файла `.env`
                     
-                    # Показываем инструкцию по настройке API ключа
-                    with st.expander("🔧 Инструкция по настройке API ключа GigaChat"):
-                        st.markdown("""
-                        **Для получения рекомендаций от ИИ необходимо настроить API ключ GigaChat:**
-                        
-                        1. **Получите API ключ:**
-                           - Перейдите на https://developers.sber.ru/portal/products/gigachat
-                           - Зарегистрируйтесь или войдите в аккаунт
-                           - Создайте новый проект и получите API ключ
-                        
-                        2. **Создайте файл `.env`:**
-                           - В корневой папке проекта создайте файл `.env`
-                           - Добавьте в него строку: `GIGACHAT_API_KEY=ваш_api_ключ`
-                        
-                        3. **Пример файла `.env`:**
-                           ```
-                           GIGACHAT_API_KEY=your_actual_api_key_here
-                           ```
-                        
-                        4. **Перезапустите приложение** после создания файла `.env`
-                        
-                        **Важно:** 
-                        - Не добавляйте пробелы вокруг знака `=`
-                        - Не коммитьте файл `.env` в git (он уже в .gitignore)
-                        - Убедитесь, что API ключ активен и имеет права доступа к GigaChat API
-                        """)
+                    **Важно:** 
+                    - Не добавляйте пробелы вокруг знака `=`
+                    - Не коммитьте файл `.env` в git (он уже в .gitignore)
+                    - Убедитесь, что API ключ активен и имеет права доступа к GigaChat API
+                    """)
         
         # Отображение рекомендаций от LLM
         if 'llm_recommendations' in st.session_state:
-            st.subheader("🤖 Рекомендации от ИИ")
-            st.markdown("---")
-            
-            # Отображаем рекомендации в красивом формате
-            st.markdown(st.session_state.llm_recommendations)
+            if not streamed:
+                st.subheader("🤖 Рекомендации от ИИ")
+                st.markdown("---")
+                
+                # Отображаем рекомендации в красивом формате
+                st.markdown(st.session_state.llm_recommendations)
             
             st.markdown("---")
             
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Пакетная загрузка импорта РФ по списку кодов ТН ВЭД
+
+Коды объединяются в запросы Comtrade через запятую (cmdCode=8528,8517,...),
+каждый запрос сразу охватывает все периоды (period=2023,2024,2025).
+Если ответ упирается в maxRecords, пакет делится и дозагружается частями.
+Результат записывается в локальное хранилище trade_store (Parquet, refYear/cmdCode),
+а ответы по отдельным кодам попадают в кэш comtrade_cache — приложение
+открывает их без обращения к API.
+
+Запуск:
+    python batch_ingest.py codes.txt --years 3 --out data/trade
+    python batch_ingest.py 8528,8517,8471
+"""
+
+import argparse
+import logging
+import os
+import re
+import time
+
+import pandas as pd
+
+import trade_store
+from comtrade_cache import evict, write_cached
+from comtrade_fetch import FetchEngine, build_request, MAX_RECORDS, MAX_WORKERS
+from import_ru import last_years
+
+CODES_PER_REQUEST = 50    # ~250 стран-поставщиков на код-год → запас до maxRecords
+OUTPUT_DIR = trade_store.STORE_DIR
+FLOW_CODE, PARTNER_CODE = 'X', '643'
+
+
+def read_codes(source):
+    """
+    Список кодов из файла или строки (разделители — пробелы, запятые, переводы строк;
+    всё после # считается комментарием) либо из готового списка. Дубликаты убираются.
+    """
+    if isinstance(source, (str, os.PathLike)) and os.path.isfile(source):
+        with open(source, encoding="utf-8") as f:
+            items = re.split(r"[\s,;]+", "\n".join(line.split("#", 1)[0] for line in f))
+    elif isinstance(source, str):
+        items = re.split(r"[\s,;]+", source)
+    else:
+        items = [str(c) for c in source]
+
+    codes = []
+    for code in (c.strip() for c in items):
+        if not code:
+            continue
+        if not code.isdigit():
+            raise ValueError(f"Некорректный код ТН ВЭД: {code}")
+        if code not in codes:
+            codes.append(code)
+    return codes
+
+
+def plan_batches(codes, periods, codes_per_request=CODES_PER_REQUEST):
+    """Пакеты (коды, периоды): один пакет — один запрос за все периоды"""
+    periods = [int(p) for p in periods]
+    return [(list(codes[i:i + codes_per_request]), periods)
+            for i in range(0, len(codes), codes_per_request)]
+
+
+def _batch_request(batch, max_records):
+    codes, periods = batch
+    return build_request(",".join(codes), ",".join(str(p) for p in periods),
+                         flow_code=FLOW_CODE, partner_code=PARTNER_CODE,
+                         max_records=max_records)
+
+
+def fetch_batches(batches, *, engine=None, max_records=MAX_RECORDS):
+    """
+    Загружает пакеты параллельно; обрезанные по max_records ответы
+    дозагружаются частями (FetchEngine.fetch_complete).
+
+    Returns:
+        tuple: (список (пакет, DataFrame), список пакетов, которые не удалось загрузить)
+    """
+    engine = engine or FetchEngine()
+    results = engine.fetch_complete([_batch_request(b, max_records) for b in batches])
+    done = [(b, data) for b, data in zip(batches, results) if data is not None]
+    failed = [b for b, data in zip(batches, results) if data is None]
+    return done, failed
+
+
+def _owner_codes(data, codes):
+    """
+    Запрошенный код для каждой строки: после деления по подсубпозициям
+    в ответе приходят 6-значные коды, их относим к самому длинному префиксу из пакета
+    """
+    row_codes = data["cmdCode"].astype(str)
+    mapping = {}
+    for code in row_codes.unique():
+        owners = [c for c in codes if code.startswith(c)]
+        mapping[code] = max(owners, key=len) if owners else code
+    return row_codes.map(mapping)
+
+
+def warm_cache(batch, data):
+    """Раскладывает ответ пакета по ключам кэша (код, год) — как их запрашивает download_by_tnved"""
+    codes, periods = batch
+    groups = {}
+    if not data.empty:
+        owner = _owner_codes(data, codes)
+        groups = {(code, int(year)): part
+                  for (code, year), part in data.groupby([owner, data["refYear"]], sort=False)}
+    empty = data.iloc[0:0]
+    for code in codes:
+        for period in periods:
+            part = groups.get((code, period), empty)
+            write_cached(part.reset_index(drop=True), code, period, FLOW_CODE, PARTNER_CODE,
+                         auto_evict=False)
+
+
+def write_dataset(df, out_dir=OUTPUT_DIR):
+    """Пишет датасет с разбиением refYear/cmdCode (trade_store); затронутые разделы перезаписываются"""
+    trade_store.write(df, out_dir)
+
+
+def ingest(codes, years=None, *, out_dir=OUTPUT_DIR, codes_per_request=CODES_PER_REQUEST,
+           engine=None, use_cache=True):
+    """
+    Загружает импорт РФ по всем кодам за годы years (по умолчанию — последние 3)
+    и записывает результат в out_dir.
+
+    Returns:
+        tuple: (DataFrame со всеми записями, список кодов, которые не удалось загрузить)
+    """
+    codes = read_codes(codes)
+    years = years or last_years(3)
+    batches = plan_batches(codes, years, codes_per_request)
+    done, failed = fetch_batches(batches, engine=engine)
+
+    if use_cache:
+        for batch, data in done:
+            warm_cache(batch, data)
+        evict()
+
+    frames = [data.assign(requestCode=_owner_codes(data, batch[0]).to_numpy())
+              for batch, data in done if not data.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if out_dir:
+        write_dataset(df, out_dir)
+
+    failed_codes = sorted({code for codes_, _ in failed for code in codes_})
+    return df, failed_codes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная загрузка импорта РФ по кодам ТН ВЭД")
+    parser.add_argument("codes", help="файл со списком кодов или коды через запятую")
+    parser.add_argument("--years", type=int, default=3, help="сколько последних лет загружать")
+    parser.add_argument("--out", default=OUTPUT_DIR, help="каталог Parquet-датасета")
+    parser.add_argument("--codes-per-request", type=int, default=CODES_PER_REQUEST)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--no-cache", action="store_true", help="не заполнять кэш comtrade_cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    started = time.perf_counter()
+    df, failed = ingest(
+        args.codes, last_years(args.years), out_dir=args.out,
+        codes_per_request=args.codes_per_request,
+        engine=FetchEngine(max_workers=args.workers),
+        use_cache=not args.no_cache,
+    )
+    print(f"Загружено записей: {len(df)} за {time.perf_counter() - started:.1f} с → {args.out}")
+    if failed:
+        print(f"Не удалось загрузить коды: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,110 +1,444 @@
+import logging
+from collections.abc import Mapping
+from dataclasses import dataclass, field, fields
+
 import numpy as np
 import pandas as pd
 
-CHINA = 'China'
+from countries import (SEGMENT_CHINA, SEGMENT_FRIENDLY, SEGMENT_UNFRIENDLY, SEGMENT_LABELS,
+                       segment_of)
 
-def calc_import_metrics(
-    df_year: pd.DataFrame,
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+SEGMENTS = [SEGMENT_CHINA, SEGMENT_FRIENDLY, SEGMENT_UNFRIENDLY]
+
+# Числовые метрики записи calc_import_metrics (в порядке _metrics_from_aggregates)
+IMPORT_METRICS = ["import_total", "import_friendly", "import_unfriendly", "import_china",
+                  "share_unfriendly", "share_china", "price_china", "price_others",
+                  "price_diff_ratio"]
+
+
+def segment_values(df: pd.DataFrame, value_col: str = "primaryValue") -> np.ndarray:
+    """Суммы value_col по сегментам: [Китай, прочие дружественные, недружественные]"""
+    values = pd.to_numeric(df[value_col], errors="coerce").fillna(0).to_numpy(dtype=float)
+    return np.bincount(segment_of(df), weights=values, minlength=3)[:3]
+
+
+def segment_summary(df: pd.DataFrame, value_col: str = "primaryValue") -> pd.DataFrame:
+    """
+    Структура импорта по сегментам: segment (подпись), value, share.
+    Если импорта нет, возвращается пустая таблица с теми же колонками.
+    """
+    values = segment_values(df, value_col)
+    total = values.sum()
+    if total <= 0:
+        return pd.DataFrame(columns=["segment", "value", "share"])
+    return pd.DataFrame({"segment": SEGMENT_LABELS, "value": values, "share": values / total})
+
+
+def segment_aggregates(
+    df: pd.DataFrame,
+    by="refYear",
     *,
     value_col: str = "primaryValue",
     qty_col: str = "qty",
-    friendly_col: str = "isFriendly",
-    country_col: str = "partnerDesc",
-    china_mask_col: str = "partnerISO",  # 'partnerISO' или 'reporterDesc'
-    china_value: str = "CHN",            # 'CHN' или 'China'
-):
-    d = df_year.copy()
-
-    # Приводим типы
-    d[value_col] = pd.to_numeric(d[value_col], errors="coerce").fillna(0)
-    d[qty_col] = pd.to_numeric(d[qty_col], errors="coerce")
-
-    # Маска Китая
-    mask_china = df_year['reporterDesc'].str.contains(CHINA)
-
-    # Маска дружественных
-    mask_friend = d[friendly_col] == 1
-
-    # БАЗОВЫЕ МЕТРИКИ
-    total_import = d[value_col].sum()
-    import_from_is_friend = d.loc[mask_friend, value_col].sum()
-    import_from_is_not_friend = d.loc[~mask_friend, value_col].sum()
-    import_from_china = d.loc[mask_china, value_col].sum()
-
-    share_unfriendly = float(import_from_is_not_friend / total_import) if total_import else 0.0
-    share_china = float(import_from_china / total_import) if total_import else 0.0
-
-    # КОНТРАКТНАЯ ЦЕНА: primaryValue / qty (если qty > 0 и qty != -1)
-    valid_qty_mask = d[qty_col].notna() & (d[qty_col] > 0) & (d[qty_col] != -1)
-
-    # Страны, где qty == -1
-    countries_no_qty = (
-        d.loc[d[qty_col] == -1, country_col]
-        .astype(str)
-        .dropna()
-        .unique()
-        .tolist()
-        if qty_col in d.columns
-        else []
-    )
+    segment_col: str = "segment",
+) -> pd.DataFrame:
+    """
+    Агрегаты по (by, сегмент) за один groupby.
 
-    # Цена для Китая
-    val_china = d.loc[mask_china & valid_qty_mask, value_col].sum()
-    qty_china = d.loc[mask_china & valid_qty_mask, qty_col].sum()
-    price_china = float(val_china / qty_china) if qty_china and qty_china > 0 else float("nan")
+    Колонки — MultiIndex (показатель, сегмент):
+      value       — стоимость импорта;
+      price_value — стоимость по строкам с валидным qty (qty > 0, не -1);
+      price_qty   — количество по тем же строкам.
+    by — имя колонки, список имён колонок или массив ключей длины len(df).
+    """
+    value = pd.to_numeric(df[value_col], errors="coerce").fillna(0).to_numpy(dtype=float)
+    qty = pd.to_numeric(df[qty_col], errors="coerce").to_numpy(dtype=float)
+    valid_qty = qty > 0   # NaN и -1 не проходят
 
-    # Цена для прочих
-    val_others = d.loc[~mask_china & valid_qty_mask, value_col].sum()
-    qty_others = d.loc[~mask_china & valid_qty_mask, qty_col].sum()
-    price_others = float(val_others / qty_others) if qty_others and qty_others > 0 else float("nan")
+    if isinstance(by, (str, list)):
+        names = [by] if isinstance(by, str) else list(by)
+        keys = {name: df[name].to_numpy() for name in names}
+    else:
+        names = ["key"]
+        keys = {"key": np.asarray(by)}
+    frame = pd.DataFrame({
+        **keys,
+        "segment": segment_of(df, segment_col),
+        "value": value,
+        "price_value": np.where(valid_qty, value, 0.0),
+        "price_qty": np.where(valid_qty, qty, 0.0),
+    })
+    agg = frame.groupby(names + ["segment"]).sum().unstack("segment", fill_value=0.0)
+    columns = pd.MultiIndex.from_product([["value", "price_value", "price_qty"], SEGMENTS])
+    return agg.reindex(columns=columns, fill_value=0.0)
 
-    price_diff_ratio = (
-        float(price_china / price_others) if (price_china and price_others) else float("nan")
-    )
 
-    # # Вывод результатов
-    # print(f"Всего импорт: {total_import}")
-    # print(f"ДС импорт: {import_from_is_friend}")
-    # print(f"НС импорт: {import_from_is_not_friend}")
-    # print(f"Китай импорт: {import_from_china}")
-    # print(f"Доля импорта из НС: {share_unfriendly}")
-    # print(f"Доля импорта из Китая: {share_china}")
-
-    # Контрактные цены
-    if not np.isnan(price_china):
-        print(f"Контрактная цена Китая (primaryValue/qty): {price_china}")
-    else:
-        print("Контрактная цена Китая не рассчитана (нет валидного qty для Китая).")
+def segment_table(
+    df: pd.DataFrame,
+    years=None,
+    *,
+    year_col: str = "refYear",
+    value_col: str = "primaryValue",
+    qty_col: str = "qty",
+    segment_col: str = "segment",
+    agg: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """
+    Стоимость импорта по годам и сегментам — маленькая таблица для диаграмм.
 
-    if not np.isnan(price_others):
-        print(f"Контрактная цена прочих стран (primaryValue/qty): {price_others}")
-    else:
-        print("Контрактная цена прочих стран не рассчитана (нет валидного qty у прочих стран).")
+    Строки — годы (years или все годы из таблицы), колонки — сегменты
+    SEGMENT_CHINA / SEGMENT_FRIENDLY / SEGMENT_UNFRIENDLY и rows (число строк за год).
+    agg — уже посчитанная segment_aggregates(df, year_col), чтобы не группировать повторно.
+    """
+    if agg is None:
+        agg = segment_aggregates(df, year_col, value_col=value_col, qty_col=qty_col,
+                                 segment_col=segment_col)
+    years = sorted(agg.index.tolist()) if years is None else [int(y) for y in years]
+    table = agg["value"].reindex(years, fill_value=0.0)
+    table["rows"] = df[year_col].value_counts().reindex(years, fill_value=0).to_numpy()
+    table.index.name = year_col
+    table.columns.name = None
+    return table
 
-    if not np.isnan(price_diff_ratio):
-        print(f"Отношение цен (Китай / прочие): {price_diff_ratio}")
-    else:
-        print("Отношение цен не рассчитано.")
 
-    # Уведомление о странах без qty
-    if countries_no_qty:
-        preview = countries_no_qty[:10]
-        more = len(countries_no_qty) - len(preview)
-        msg = f"Страны с qty = -1 (исключены из расчёта цены): {', '.join(preview)}"
-        if more > 0:
-            msg += f" и ещё {more}…"
-        print(msg)
+def _metrics_from_aggregates(agg: pd.DataFrame) -> dict:
+    """Метрики импорта по строкам таблицы агрегатов — векторно, массивы по ключам"""
+    value = agg["value"].to_numpy()
+    price_value = agg["price_value"].to_numpy()
+    price_qty = agg["price_qty"].to_numpy()
+
+    total = value.sum(axis=1)
+    china = value[:, SEGMENT_CHINA]
+    unfriendly = value[:, SEGMENT_UNFRIENDLY]
+
+    qty_china = price_qty[:, SEGMENT_CHINA]
+    val_china = price_value[:, SEGMENT_CHINA]
+    qty_others = price_qty[:, SEGMENT_FRIENDLY] + price_qty[:, SEGMENT_UNFRIENDLY]
+    val_others = price_value[:, SEGMENT_FRIENDLY] + price_value[:, SEGMENT_UNFRIENDLY]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share_unfriendly = np.where(total != 0, unfriendly / total, 0.0)
+        share_china = np.where(total != 0, china / total, 0.0)
+        price_china = np.where(qty_china > 0, val_china / qty_china, np.nan)
+        price_others = np.where(qty_others > 0, val_others / qty_others, np.nan)
+        # нулевая цена (как и отсутствующая) не даёт отношения
+        price_diff_ratio = np.where((price_china != 0) & (price_others != 0),
+                                    price_china / price_others, np.nan)
 
     return {
-        "import_total": float(total_import),
-        "import_friendly": float(import_from_is_friend),
-        "import_unfriendly": float(import_from_is_not_friend),
-        "import_china": float(import_from_china),
+        "import_total": total,
+        "import_friendly": total - unfriendly,
+        "import_unfriendly": unfriendly,
+        "import_china": china,
         "share_unfriendly": share_unfriendly,
         "share_china": share_china,
         "price_china": price_china,
         "price_others": price_others,
         "price_diff_ratio": price_diff_ratio,
-        "countries_no_qty": countries_no_qty,
-        "year" : df_year['refYear'].unique()
     }
+
+
+def import_metrics_table(
+    df: pd.DataFrame,
+    *,
+    code_col: str = "cmdCode",
+    year_col: str = "refYear",
+    value_col: str = "primaryValue",
+    qty_col: str = "qty",
+    segment_col: str = "segment",
+) -> pd.DataFrame:
+    """
+    Метрики импорта по парам (код, год) за один groupby — таблица для соединения
+    с данными производства (calc_man_metrics).
+
+    Returns:
+        pd.DataFrame: индекс (code — строка, year — int), колонки — метрики
+                      calc_import_metrics (import_total, share_china, ...)
+    """
+    frame = pd.DataFrame({
+        "code": df[code_col].astype(str).to_numpy(),
+        "year": df[year_col].astype(int).to_numpy(),
+        value_col: df[value_col].to_numpy(),
+        qty_col: df[qty_col].to_numpy(),
+        segment_col: segment_of(df, segment_col),
+    })
+    agg = segment_aggregates(frame, ["code", "year"], value_col=value_col, qty_col=qty_col,
+                             segment_col=segment_col)
+    return pd.DataFrame(_metrics_from_aggregates(agg), index=agg.index)
+
+
+def records_table(records_by_code) -> pd.DataFrame:
+    """Та же таблица (code, year) из готовых записей: {код: [записи по годам]}"""
+    rows = {(str(code), int(np.ravel(record["year"])[0])): record
+            for code, records in records_by_code.items() for record in records}
+    index = pd.MultiIndex.from_tuples(list(rows), names=["code", "year"])
+    return pd.DataFrame([[record[m] for m in IMPORT_METRICS] for record in rows.values()],
+                        index=index, columns=IMPORT_METRICS)
+
+
+def _countries_no_qty(df, keys, *, value_col, qty_col, country_col):
+    """Страны с qty = -1 по ключам (в порядке убывания стоимости, как в таблицах приложения)"""
+    if qty_col not in df.columns:
+        return {}
+    qty = pd.to_numeric(df[qty_col], errors="coerce").to_numpy(dtype=float)
+    mask = qty == -1
+    if not mask.any():
+        return {}
+    sub = pd.DataFrame({
+        "key": np.asarray(keys)[mask],
+        "value": pd.to_numeric(df.loc[mask, value_col], errors="coerce").to_numpy(dtype=float),
+        "country": df.loc[mask, country_col].astype(str).to_numpy(),
+    })
+    sub = sub.sort_values("value", ascending=False).drop_duplicates(["key", "country"])
+    return {key: part["country"].tolist() for key, part in sub.groupby("key", sort=False)}
+
+
+@dataclass(frozen=True)
+class DataQuality:
+    """Замечания к качеству данных за год: какие цены не рассчитаны и у каких стран нет qty"""
+    year: int | None
+    price_china_available: bool
+    price_others_available: bool
+    price_ratio_available: bool
+    countries_no_qty: tuple = ()
+
+    @property
+    def ok(self) -> bool:
+        return (self.price_china_available and self.price_others_available
+                and self.price_ratio_available and not self.countries_no_qty)
+
+    @classmethod
+    def from_record(cls, record, year=None):
+        return cls(
+            year=year,
+            price_china_available=not np.isnan(record["price_china"]),
+            price_others_available=not np.isnan(record["price_others"]),
+            price_ratio_available=not np.isnan(record["price_diff_ratio"]),
+            countries_no_qty=tuple(record["countries_no_qty"]),
+        )
+
+    def messages(self) -> list:
+        """Текстовые сообщения (те же, что раньше печатались в консоль)"""
+        messages = []
+        if not self.price_china_available:
+            messages.append("Контрактная цена Китая не рассчитана (нет валидного qty для Китая).")
+        if not self.price_others_available:
+            messages.append("Контрактная цена прочих стран не рассчитана (нет валидного qty у прочих стран).")
+        if not self.price_ratio_available:
+            messages.append("Отношение цен не рассчитано.")
+        if self.countries_no_qty:
+            preview = self.countries_no_qty[:10]
+            more = len(self.countries_no_qty) - len(preview)
+            msg = f"Страны с qty = -1 (исключены из расчёта цены): {', '.join(preview)}"
+            if more > 0:
+                msg += f" и ещё {more}…"
+            messages.append(msg)
+        return messages
+
+
+def _quality(values, year=None) -> DataQuality:
+    """
+    Замечания к данным за год; диагностика пишется в лог.
+    Уровень DEBUG: по умолчанию сообщения не формируются и никуда не выводятся.
+    """
+    quality = DataQuality.from_record(values, year)
+    if logger.isEnabledFor(logging.DEBUG):
+        prefix = f"[{year}] " if year is not None else ""
+        logger.debug("%sЦены: Китай=%s, прочие=%s, отношение=%s", prefix,
+                     values["price_china"], values["price_others"], values["price_diff_ratio"])
+        for message in quality.messages():
+            logger.debug("%s%s", prefix, message)
+    return quality
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class ImportYearMetrics(Mapping):
+    """
+    Метрики импорта за год — запись calc_import_metrics.
+
+    Неизменяемый объект со слотами: компактен, хэшируется (NaN считается равным NaN)
+    и дёшево передаётся между процессами. Читается и как словарь —
+    record["import_total"], record.get("year"), record.items().
+    """
+    year: int | None
+    import_total: float
+    import_friendly: float
+    import_unfriendly: float
+    import_china: float
+    share_unfriendly: float
+    share_china: float
+    price_china: float
+    price_others: float
+    price_diff_ratio: float
+    countries_no_qty: tuple = ()
+    quality: DataQuality | None = field(default=None, repr=False)   # в сравнении и хэше не участвует
+
+    def __getitem__(self, key):
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(RECORD_FIELDS)
+
+    def __len__(self):
+        return len(RECORD_FIELDS)
+
+    def _key(self):
+        return (self.year,
+                *(None if value != value else value
+                  for value in (getattr(self, name) for name in IMPORT_METRICS)),
+                self.countries_no_qty)
+
+    def __eq__(self, other):
+        if not isinstance(other, ImportYearMetrics):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+RECORD_FIELDS = tuple(f.name for f in fields(ImportYearMetrics))
+
+
+@dataclass(frozen=True, slots=True)
+class ImportMetricsBatch:
+    """
+    Метрики импорта за много лет столбцами (struct-of-arrays): по массиву NumPy
+    на метрику. Для массовых расчётов и передачи между процессами без объектов на каждый год.
+    """
+    year: np.ndarray
+    import_total: np.ndarray
+    import_friendly: np.ndarray
+    import_unfriendly: np.ndarray
+    import_china: np.ndarray
+    share_unfriendly: np.ndarray
+    share_china: np.ndarray
+    price_china: np.ndarray
+    price_others: np.ndarray
+    price_diff_ratio: np.ndarray
+    countries_no_qty: tuple = ()   # по кортежу стран на год
+
+    def __len__(self):
+        return len(self.year)
+
+    @classmethod
+    def from_records(cls, records):
+        records = list(records)
+        return cls(
+            year=np.array([record["year"] for record in records], dtype=np.int64),
+            **{name: np.array([record[name] for record in records], dtype=float)
+               for name in IMPORT_METRICS},
+            countries_no_qty=tuple(tuple(record["countries_no_qty"]) for record in records),
+        )
+
+    def records(self) -> list:
+        """Записи ImportYearMetrics по годам (с замечаниями к данным в quality)"""
+        columns = [getattr(self, name).tolist() for name in IMPORT_METRICS]
+        countries = self.countries_no_qty or ((),) * len(self)
+        records = []
+        for year, no_qty, *values in zip(self.year.tolist(), countries, *columns):
+            values = dict(zip(IMPORT_METRICS, values), countries_no_qty=tuple(no_qty))
+            records.append(ImportYearMetrics(year=year, **values, quality=_quality(values, year)))
+        return records
+
+    def to_frame(self) -> pd.DataFrame:
+        """Таблица: строка на год, колонки — метрики"""
+        return pd.DataFrame({name: getattr(self, name) for name in IMPORT_METRICS},
+                            index=pd.Index(self.year, name="year"))
+
+
+def calc_import_metrics(
+    df_year: pd.DataFrame,
+    *,
+    value_col: str = "primaryValue",
+    qty_col: str = "qty",
+    segment_col: str = "segment",
+    country_col: str = "partnerDesc",
+    china_mask_col: str = "partnerISO",  # 'partnerISO' или 'reporterDesc'
+    china_value: str = "CHN",            # 'CHN' или 'China'
+) -> ImportYearMetrics:
+    """
+    Метрики импорта по таблице за один год.
+    year — год таблицы; если в ней несколько лет — первый встреченный
+    (как раньше читался массив refYear.unique()), если таблица пуста — None.
+    Замечания к данным (нет цен, страны с qty = -1) возвращаются в quality (DataQuality)
+    и пишутся в лог на уровне DEBUG вместо печати в консоль.
+    """
+    keys = np.zeros(len(df_year), dtype=np.int8)
+    agg = segment_aggregates(df_year, keys, value_col=value_col, qty_col=qty_col,
+                             segment_col=segment_col).reindex([0], fill_value=0.0)
+    metrics = _metrics_from_aggregates(agg)
+    no_qty = _countries_no_qty(df_year, keys, value_col=value_col, qty_col=qty_col,
+                               country_col=country_col)
+
+    years = df_year['refYear'].unique()
+    year = int(years[0]) if len(years) else None
+    values = {key: float(values[0]) for key, values in metrics.items()}
+    values["countries_no_qty"] = tuple(no_qty.get(0, []))
+    return ImportYearMetrics(year=year, **values, quality=_quality(values, year))
+
+
+def calc_import_metrics_batch(
+    df: pd.DataFrame,
+    years=None,
+    *,
+    value_col: str = "primaryValue",
+    qty_col: str = "qty",
+    segment_col: str = "segment",
+    country_col: str = "partnerDesc",
+    year_col: str = "refYear",
+    agg: pd.DataFrame | None = None,
+) -> ImportMetricsBatch:
+    """
+    Метрики импорта сразу за все годы столбцами: один groupby по (год, сегмент)
+    и векторный расчёт. Аргументы — как у calc_import_metrics_by_year.
+    """
+    if agg is None:
+        agg = segment_aggregates(df, year_col, value_col=value_col, qty_col=qty_col,
+                                 segment_col=segment_col)
+    years = sorted(agg.index.tolist()) if years is None else [int(y) for y in years]
+    agg = agg.reindex(years, fill_value=0.0)
+    metrics = _metrics_from_aggregates(agg)
+    no_qty = _countries_no_qty(df, df[year_col].to_numpy(), value_col=value_col,
+                               qty_col=qty_col, country_col=country_col)
+    return ImportMetricsBatch(
+        year=np.array(years, dtype=np.int64),
+        **metrics,
+        countries_no_qty=tuple(tuple(no_qty.get(year, [])) for year in years),
+    )
+
+
+def calc_import_metrics_by_year(
+    df: pd.DataFrame,
+    years=None,
+    *,
+    value_col: str = "primaryValue",
+    qty_col: str = "qty",
+    segment_col: str = "segment",
+    country_col: str = "partnerDesc",
+    year_col: str = "refYear",
+    agg: pd.DataFrame | None = None,
+):
+    """
+    Метрики импорта сразу за все годы: один groupby по (год, сегмент) и векторный расчёт.
+
+    Args:
+        df: таблица Comtrade за несколько лет (после mark_friendly)
+        years: годы, для которых нужны записи, в нужном порядке
+               (по умолчанию — все годы из таблицы по возрастанию);
+               годы без данных получают нулевой импорт
+        agg: уже посчитанная segment_aggregates(df, year_col) (если есть)
+
+    Returns:
+        list: записи ImportYearMetrics с целым годом в year;
+              замечания к данным — в quality (DataQuality)
+    """
+    return calc_import_metrics_batch(
+        df, years, value_col=value_col, qty_col=qty_col, segment_col=segment_col,
+        country_col=country_col, year_col=year_col, agg=agg,
+    ).records()
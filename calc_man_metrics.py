@@ -8,19 +8,35 @@
 - В результатах метрик исходные данные сохраняются в миллионах долларов для удобства отображения
 """
 
+import logging
+
 import pandas as pd
 import numpy as np
 
-def calculate_man_metrics(df_production, import_metrics_by_year, tnved_code=None):
+logger = logging.getLogger(__name__)
+
+def calculate_man_metrics(df_production, import_metrics_by_year=None, tnved_code=None, *,
+                          import_table=None):
     """
     Рассчитывает метрики производства и потребления товаров РФ
     
+    Импорт для строки берётся по паре (код строки, год); у строк без кода — по tnved_code.
+    Если кода строки нет среди кодов импорта, он сопоставляется по префиксу: 6-значная
+    строка получает импорт самой длинной товарной позиции, в которую входит (8428 для
+    842810), а 4-значная — сумму импорта входящих в неё подсубпозиций. Строки без
+    совпадения получают нулевой импорт, import_matched = False и предупреждение в лог.
+    Если не заданы ни tnved_code, ни import_table, import_metrics_by_year применяется
+    ко всем строкам с кодом (прежнее поведение для одного кода).
+    
     Args:
         df_production (pd.DataFrame): DataFrame с колонками ['category', 'year', 'manufacture', 'consumption', 'code']
                                     ВАЖНО: manufacture и consumption должны быть в миллионах долларов
         import_metrics_by_year (dict): Словарь с метриками импорта по годам из calc_import_metrics
+                                    для кода tnved_code
                                     ВАЖНО: import_total уже в долларах (не в миллионах)
-        tnved_code (str): Код ТН ВЭД для фильтрации данных импорта
+        tnved_code (str): Код ТН ВЭД, к которому относится import_metrics_by_year
+        import_table (pd.DataFrame): Метрики импорта по многим кодам с индексом (code, year)
+                                    (calc_import_metrics.import_metrics_table / records_table)
         
     Returns:
         dict: Словарь с метриками по категориям и годам
@@ -34,119 +50,186 @@ def calculate_man_metrics(df_production, import_metrics_by_year, tnved_code=None
     if missing_columns:
         raise ValueError(f"Отсутствуют необходимые колонки: {missing_columns}")
     
-    metrics_dict = {}
-    df_sorted = df_production.sort_values(['category', 'year']).copy()
+    df = df_production.sort_values(['category', 'year'], kind='stable')
+    df = df[df['category'].notna()]
+    categories = df['category'].to_numpy()
+    years = df['year'].to_numpy()
+    
+    # Данные производства и потребления в миллионах долларов (пропуски — 0)
+    manufacture_millions = pd.to_numeric(df['manufacture']).fillna(0).to_numpy(dtype=float)
+    consumption_millions = pd.to_numeric(df['consumption']).fillna(0).to_numpy(dtype=float)
+    
+    # Конвертируем в доллары для корректного сравнения с импортом
+    manufacture = manufacture_millions * 1_000_000  # млн $ -> $
+    consumption = consumption_millions * 1_000_000  # млн $ -> $
+    
+    # Импорт за год и за предыдущий год (import_total уже в долларах)
+    import_metrics_by_year = import_metrics_by_year or {}
+    codes = _code_keys(df['code']) if 'code' in df.columns else pd.Series(np.nan, index=df.index)
+    if tnved_code is None and import_table is None:
+        # Один набор метрик импорта для всех строк, у которых есть код
+        has_code = codes.notna().to_numpy()
+        import_val = np.where(has_code, _import_by_year(years, import_metrics_by_year), 0.0)
+        prev_import = _import_by_year(years - 1, import_metrics_by_year)
+        import_matched = has_code
+    else:
+        # Соединение с таблицей (code, year) -> import_total, коды — по префиксу
+        row_codes = codes.fillna(str(tnved_code) if tnved_code else np.nan)
+        totals, matched = _match_totals(
+            _import_totals(import_metrics_by_year, tnved_code, import_table), row_codes)
+        import_val = _lookup(totals, row_codes.to_numpy(), years)
+        prev_import = _lookup(totals, row_codes.to_numpy(), years - 1)
+        import_matched = row_codes.isin(matched).to_numpy()
+        unmatched = sorted(set(row_codes.dropna()) - matched)
+        if unmatched:
+            logger.warning("Нет данных импорта для кодов производства %s: импорт принят равным 0",
+                           ", ".join(unmatched))
+    
+    # Данные предыдущего года той же категории: первая строка пары (категория, год - 1)
+    first = df.drop_duplicates(['category', 'year'], keep='first').set_index(['category', 'year'])
+    prev = first[['manufacture', 'consumption']].reindex(
+        pd.MultiIndex.from_arrays([categories, years - 1]))
+    has_prev = prev.index.isin(first.index)
+    prev_manufacture = pd.to_numeric(prev['manufacture']).fillna(0).to_numpy(dtype=float) * 1_000_000
+    prev_consumption = pd.to_numeric(prev['consumption']).fillna(0).to_numpy(dtype=float) * 1_000_000
     
-    for category in df_production['category'].unique():
-        category_data = df_sorted[df_sorted['category'] == category].copy()
-        category_metrics = {}
+    total_supply = manufacture + import_val
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Основные метрики
+        self_sufficiency = np.where(consumption > 0, manufacture / consumption, 0.0)
+        balance = manufacture - consumption
         
-        # Сортировка по году для категорий
-        category_data = category_data.sort_values('year')
+        # Зависимость от импорта = доля импорта в общем предложении (производство + импорт)
+        import_dependency = np.where(total_supply > 0, import_val / total_supply, 0.0)
         
-        for idx, row in category_data.iterrows():
-            year = row['year']
-            # Данные производства и потребления в миллионах долларов
-            manufacture_millions = float(row['manufacture']) if pd.notna(row['manufacture']) else 0
-            consumption_millions = float(row['consumption']) if pd.notna(row['consumption']) else 0
-            
-            # Конвертируем в доллары для корректного сравнения с импортом
-            manufacture = manufacture_millions * 1_000_000  # млн $ -> $
-            consumption = consumption_millions * 1_000_000  # млн $ -> $
-            
-            # Получаем код ТН ВЭД для данной категории
-            category_tnved_code = None
-            if 'code' in row and pd.notna(row['code']):
-                category_tnved_code = str(row['code'])
-            elif tnved_code:
-                category_tnved_code = str(tnved_code)
-            
-            # Получаем данные импорта для данного года и кода ТН ВЭД
-            # import_total уже в долларах (не в миллионах)
-            import_val = 0
-            if year in import_metrics_by_year and category_tnved_code:
-                # Используем данные импорта для конкретного кода ТН ВЭД
-                import_val = import_metrics_by_year[year].get('import_total', 0)
-            
-            # Основные метрики
-            self_sufficiency = manufacture / consumption if consumption > 0 else 0
-            balance = manufacture - consumption
-            
-            # Общее предложение (производство + импорт)
-            total_supply = manufacture + import_val
-            
-            # Зависимость от импорта = доля импорта в общем предложении
-            # Это показывает, какая часть общего предложения приходится на импорт
-            import_dependency = import_val / total_supply if total_supply > 0 else 0
-            
-            # Доля производства в общем предложении
-            production_share = manufacture / total_supply if total_supply > 0 else 0
-            
-            # Дополнительные метрики
-            consumption_coverage = min(manufacture / consumption, 1.0) if consumption > 0 else 0
-            import_penetration = import_val / (manufacture + import_val) if (manufacture + import_val) > 0 else 0
-            production_efficiency = manufacture / (manufacture + import_val) if (manufacture + import_val) > 0 else 0
-            
-            # Темп роста производства
-            growth_rate = None
-            prev_year_data = category_data[category_data['year'] == year - 1]
-            if not prev_year_data.empty:
-                prev_manufacture_millions = float(prev_year_data['manufacture'].iloc[0]) if pd.notna(prev_year_data['manufacture'].iloc[0]) else 0
-                prev_manufacture = prev_manufacture_millions * 1_000_000  # млн $ -> $
-                if prev_manufacture > 0:
-                    growth_rate = (manufacture - prev_manufacture) / prev_manufacture
-            
-            # Темп роста потребления
-            consumption_growth_rate = None
-            if not prev_year_data.empty:
-                prev_consumption_millions = float(prev_year_data['consumption'].iloc[0]) if pd.notna(prev_year_data['consumption'].iloc[0]) else 0
-                prev_consumption = prev_consumption_millions * 1_000_000  # млн $ -> $
-                if prev_consumption > 0:
-                    consumption_growth_rate = (consumption - prev_consumption) / prev_consumption
-            
-            # Темп роста импорта
-            import_growth_rate = None
-            if not prev_year_data.empty:
-                # Получаем данные импорта для предыдущего года
-                prev_year = year - 1
-                prev_import = 0
-                if prev_year in import_metrics_by_year:
-                    prev_import = import_metrics_by_year[prev_year].get('import_total', 0)
-                if prev_import > 0:
-                    import_growth_rate = (import_val - prev_import) / prev_import
-            
-            # Индекс конкурентоспособности (производство vs импорт)
-            competitiveness_index = manufacture / import_val if import_val > 0 else float('inf')
-            
-            # Индекс самообеспеченности (0-1, где 1 = полная самообеспеченность)
-            self_sufficiency_index = min(manufacture / consumption, 1.0) if consumption > 0 else 0
-            
-            category_metrics[year] = {
-                # Основные метрики
-                'self_sufficiency': round(self_sufficiency, 4),
-                'balance': round(balance, 2),
-                'growth_rate': round(growth_rate, 4) if growth_rate is not None else None,
-                'import_dependency': round(import_dependency, 4),
-                'production_share': round(production_share, 4),
-                
-                # Дополнительные метрики
-                'consumption_coverage': round(consumption_coverage, 4),
-                'import_penetration': round(import_penetration, 4),
-                'production_efficiency': round(production_efficiency, 4),
-                'consumption_growth_rate': round(consumption_growth_rate, 4) if consumption_growth_rate is not None else None,
-                'import_growth_rate': round(import_growth_rate, 4) if import_growth_rate is not None else None,
-                'competitiveness_index': round(competitiveness_index, 4) if competitiveness_index != float('inf') else None,
-                'self_sufficiency_index': round(self_sufficiency_index, 4),
-                
-                # Исходные данные (в миллионах долларов для отображения)
-                'manufacture': manufacture_millions,
-                'consumption': consumption_millions
-            }
+        # Доля производства в общем предложении
+        production_share = np.where(total_supply > 0, manufacture / total_supply, 0.0)
         
-        metrics_dict[category] = category_metrics
+        # Дополнительные метрики
+        consumption_coverage = np.where(consumption > 0, np.minimum(manufacture / consumption, 1.0), 0.0)
+        
+        # Темпы роста (только если есть строка за предыдущий год)
+        growth_rate = np.where(has_prev & (prev_manufacture > 0),
+                               (manufacture - prev_manufacture) / prev_manufacture, np.nan)
+        consumption_growth_rate = np.where(has_prev & (prev_consumption > 0),
+                                           (consumption - prev_consumption) / prev_consumption, np.nan)
+        import_growth_rate = np.where(has_prev & (prev_import > 0),
+                                      (import_val - prev_import) / prev_import, np.nan)
+        
+        # Индекс конкурентоспособности (производство vs импорт)
+        competitiveness_index = np.where(import_val > 0, manufacture / import_val, np.nan)
+    
+    columns = {
+        # Основные метрики
+        'self_sufficiency': _rounded(self_sufficiency, 4),
+        'balance': _rounded(balance, 2),
+        'growth_rate': _rounded(growth_rate, 4),
+        'import_dependency': _rounded(import_dependency, 4),
+        'production_share': _rounded(production_share, 4),
+        
+        # Дополнительные метрики
+        'consumption_coverage': _rounded(consumption_coverage, 4),
+        'import_penetration': _rounded(import_dependency, 4),
+        'production_efficiency': _rounded(production_share, 4),
+        'consumption_growth_rate': _rounded(consumption_growth_rate, 4),
+        'import_growth_rate': _rounded(import_growth_rate, 4),
+        'competitiveness_index': _rounded(competitiveness_index, 4),
+        # Индекс самообеспеченности (0-1, где 1 = полная самообеспеченность)
+        'self_sufficiency_index': _rounded(consumption_coverage, 4),
+        
+        # Исходные данные (в миллионах долларов для отображения)
+        'manufacture': manufacture_millions.tolist(),
+        'consumption': consumption_millions.tolist(),
+        # Импорт по коду категории, $
+        'import_total': import_val.tolist(),
+        # Нашлись ли данные импорта для кода строки (иначе import_total = 0 — не факт, а пропуск)
+        'import_matched': import_matched.tolist(),
+    }
+    
+    # Категории — в порядке первого появления, годы — по возрастанию
+    metrics_dict = {category: {} for category in df_production['category'].unique()}
+    names = list(columns)
+    for category, year, *values in zip(categories, years.tolist(), *columns.values()):
+        metrics_dict[category][year] = dict(zip(names, values))
     
     return metrics_dict
 
+def production_codes(df_production):
+    """Коды ТН ВЭД, встречающиеся в таблице производства (строками, без повторов)"""
+    if 'code' not in df_production.columns:
+        return []
+    return _code_keys(df_production['code']).dropna().unique().tolist()
+
+def _code_keys(codes):
+    """Коды ТН ВЭД строками: 842810.0 (после чтения CSV с пропусками) -> '842810'"""
+    keys = codes.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    return keys.where(codes.notna())
+
+def _import_totals(import_metrics_by_year, tnved_code, import_table):
+    """import_total с индексом (code, year): записи по tnved_code важнее строк import_table"""
+    parts = []
+    if tnved_code and import_metrics_by_year:
+        years = [int(np.ravel(year)[0]) for year in import_metrics_by_year]
+        parts.append(pd.Series(
+            [record.get('import_total', 0) for record in import_metrics_by_year.values()],
+            index=pd.MultiIndex.from_arrays([[str(tnved_code)] * len(years), years]), dtype=float))
+    if import_table is not None and len(import_table):
+        index = pd.MultiIndex.from_arrays([
+            _code_keys(import_table.index.get_level_values(0).to_series()).to_numpy(),
+            import_table.index.get_level_values(1).astype(int)])
+        parts.append(pd.Series(import_table['import_total'].to_numpy(dtype=float), index=index))
+    if not parts:
+        return pd.Series(dtype=float, index=pd.MultiIndex.from_arrays([[], []]))
+    totals = pd.concat(parts)
+    return totals[~totals.index.duplicated(keep='first')]
+
+def _matching_codes(code, known):
+    """
+    Коды таблицы импорта для кода строки: сам код; иначе самый длинный код-префикс
+    (товарная позиция, в которую входит строка); иначе все коды, начинающиеся с кода строки
+    """
+    if code in known:
+        return [code]
+    owners = [c for c in known if code.startswith(c)]
+    if owners:
+        return [max(owners, key=len)]
+    return [c for c in known if c.startswith(code)]
+
+def _match_totals(totals, row_codes):
+    """
+    import_total с индексом (код строки, год) после сопоставления кодов по префиксу
+    и множество кодов строк, для которых нашлись данные импорта
+    """
+    known = set(totals.index.get_level_values(0))
+    pairs = [(code, match) for code in row_codes.dropna().unique()
+             for match in _matching_codes(code, known)]
+    if not pairs:
+        return totals.iloc[0:0], set()
+    mapping = pd.DataFrame(pairs, columns=['row_code', 'code'])
+    flat = pd.DataFrame({'code': totals.index.get_level_values(0),
+                         'year': totals.index.get_level_values(1),
+                         'import_total': totals.to_numpy()})
+    merged = mapping.merge(flat, on='code')
+    resolved = merged.groupby(['row_code', 'year'])['import_total'].sum()
+    return resolved, set(mapping['row_code'])
+
+def _lookup(totals, codes, years):
+    """import_total для пар (код, год); нет пары — 0"""
+    index = pd.MultiIndex.from_arrays([codes, years.astype(int)])
+    return totals.reindex(index).fillna(0).to_numpy(dtype=float)
+
+def _import_by_year(years, import_metrics_by_year):
+    """import_total по массиву лет (0, если года нет в import_metrics_by_year)"""
+    unique, inverse = np.unique(years, return_inverse=True)
+    values = np.array([import_metrics_by_year[year].get('import_total', 0)
+                       if year in import_metrics_by_year else 0 for year in unique.tolist()],
+                      dtype=float)
+    return values[inverse]
+
+def _rounded(values, digits):
+    """Округлённые значения списком Python; NaN -> None"""
+    return [None if value != value else value for value in np.round(values, digits).tolist()]
+
 def get_summary_metrics(metrics_dict):
     """
     Получает сводные метрики по всем категориям
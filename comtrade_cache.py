@@ -0,0 +1,175 @@
+"""
+Локальный дисковый кэш ответов UN Comtrade
+
+Каждый ответ previewFinalData хранится отдельным Parquet-файлом, ключ —
+(cmdCode, period, flowCode, partnerCode).
+
+Политики хранения:
+- завершённые прошлые годы меняются редко — живут долго (FINAL_TTL);
+- последний отчётный год ещё дополняется странами — живёт недолго (PROVISIONAL_TTL);
+- общий размер кэша ограничен MAX_CACHE_BYTES, лишнее вытесняется по давности обращения (LRU).
+
+Вытеснение просматривает весь каталог, поэтому после записи оно выполняется
+не чаще раза в EVICT_INTERVAL секунд; пакетные загрузки пишут с auto_evict=False
+и вызывают evict() один раз в конце.
+"""
+
+import os
+import re
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+CACHE_DIR = os.getenv("COMTRADE_CACHE_DIR", ".comtrade_cache")
+
+FINAL_TTL = 30 * 24 * 3600          # 30 дней для завершённых лет
+PROVISIONAL_TTL = 12 * 3600         # 12 часов для предварительных данных
+PROVISIONAL_YEARS = 1               # сколько последних лет считаются предварительными
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+EVICT_INTERVAL = 60                 # не чаще раза в минуту после записи
+TMP_MAX_AGE = 10 * 60               # недописанные временные файлы старше — мусор
+
+_SUFFIX = ".parquet"
+_TMP_SUFFIX = ".tmp"
+
+_last_evict = {}                    # каталог -> время последнего вытеснения
+
+
+def _cache_path(cmd_code, period, flow_code, partner_code, cache_dir=None):
+    """Путь к файлу кэша для ключа запроса"""
+    key = "_".join(str(p) for p in (cmd_code, period, flow_code, partner_code))
+    # списки через запятую и прочие символы в имени файла не нужны
+    key = re.sub(r"[^0-9A-Za-z_-]+", "+", key)
+    return os.path.join(cache_dir or CACHE_DIR, key + _SUFFIX)
+
+
+def is_provisional(period) -> bool:
+    """Данные за последние PROVISIONAL_YEARS лет ещё могут пересматриваться"""
+    years = [int(p) for p in str(period).split(",") if p.strip().isdigit()]
+    if not years:
+        return True
+    return max(years) >= datetime.now().year - PROVISIONAL_YEARS
+
+
+def ttl_for(period) -> int:
+    """Время жизни записи (сек) в зависимости от года"""
+    return PROVISIONAL_TTL if is_provisional(period) else FINAL_TTL
+
+
+def read_cached(cmd_code, period, flow_code, partner_code, *, ignore_ttl=False, cache_dir=None):
+    """
+    Возвращает DataFrame из кэша или None, если записи нет или она устарела.
+
+    ignore_ttl=True — режим «только кэш»: отдаём любую сохранённую запись.
+    """
+    path = _cache_path(cmd_code, period, flow_code, partner_code, cache_dir)
+    try:
+        written_at = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    if not ignore_ttl and time.time() - written_at > ttl_for(period):
+        return None
+
+    try:
+        df = pd.read_parquet(path)
+    except Exception:
+        # битый файл (например, прерванная запись) — считаем промахом
+        return None
+
+    # atime — время последнего обращения (для LRU), mtime — время записи (для TTL)
+    try:
+        os.utime(path, (time.time(), written_at))
+    except OSError:
+        pass
+    return df
+
+
+def write_cached(df, cmd_code, period, flow_code, partner_code, *, cache_dir=None, auto_evict=True):
+    """
+    Сохраняет ответ в кэш атомарно и при необходимости вытесняет старые записи
+    (не чаще раза в EVICT_INTERVAL; auto_evict=False — не вытеснять, вызывающий сделает это сам)
+    """
+    if df is None:
+        return
+    path = _cache_path(cmd_code, period, flow_code, partner_code, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # временный файл уникален для каждого писателя: потоки одного процесса
+    # могут сохранять один и тот же ключ одновременно
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=_TMP_SUFFIX)
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if auto_evict:
+        cache_dir = cache_dir or CACHE_DIR
+        if time.monotonic() - _last_evict.get(cache_dir, float("-inf")) >= EVICT_INTERVAL:
+            evict(cache_dir=cache_dir)
+
+
+def evict(max_bytes=None, *, cache_dir=None):
+    """
+    Удаляет просроченные записи, затем — самые давно использованные,
+    пока размер кэша не станет меньше max_bytes. Заодно удаляет временные
+    файлы, брошенные прерванной записью.
+    Возвращает количество удалённых файлов.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    _last_evict[cache_dir] = time.monotonic()
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(_TMP_SUFFIX):
+            # свежий временный файл может как раз дописываться
+            try:
+                stale = now - entry.stat().st_mtime > TMP_MAX_AGE
+            except OSError:
+                continue
+            if stale:
+                _remove(entry.path)
+                removed += 1
+            continue
+        if not entry.name.endswith(_SUFFIX):
+            continue
+        st = entry.stat()
+        period = entry.name[:-len(_SUFFIX)].split("_")[1]
+        # просроченные записи удаляем сразу — в режиме «только кэш»
+        # их держим не дольше двойного TTL
+        if now - st.st_mtime > 2 * ttl_for(period.replace("+", ",")):
+            _remove(entry.path)
+            removed += 1
+            continue
+        entries.append((st.st_atime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def clear(*, cache_dir=None):
+    """Полностью очищает кэш"""
+    return evict(max_bytes=0, cache_dir=cache_dir)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,282 @@
+"""
+Параллельная загрузка данных из UN Comtrade
+
+FetchEngine отправляет набор запросов previewFinalData через ограниченный пул потоков:
+- у каждой попытки свой таймаут;
+- неудачные попытки повторяются с экспоненциальной задержкой;
+- общий ограничитель частоты не даёт превысить квоту Comtrade.
+
+Функцию запроса можно подменить (fetch_fn), например локальной заглушкой для проверки.
+
+Ответ, в котором ровно maxRecords строк, считается обрезанным: fetch_complete делит
+такой запрос (по периодам, кодам, потокам, группам стран-репортёров или 6-значным
+подсубпозициям), загружает части параллельно и склеивает их без дублей.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import comtradeapicall
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MAX_RECORDS = 50000
+MAX_WORKERS = 4
+REQUEST_TIMEOUT = 90      # сек на одну попытку
+RETRIES = 3               # повторов после первой неудачи
+BACKOFF = 2.0             # базовая задержка между повторами, сек
+RATE_LIMIT = 1.0          # запросов в секунду к публичному API
+REPORTER_GROUPS = 4       # на сколько групп делить репортёров при обрезанном ответе
+
+# Столбцы, однозначно определяющие строку ответа Comtrade
+KEY_COLUMNS = ['typeCode', 'freqCode', 'refYear', 'reporterCode', 'flowCode',
+               'partnerCode', 'partner2Code', 'cmdCode', 'customsCode', 'motCode']
+
+
+class RateLimiter:
+    """
+    Пропускает не более rate запросов в секунду (общий для всех потоков).
+
+    Чтобы квоту делили несколько процессов, передайте общие для них lock
+    и state (multiprocessing.Manager().Lock() и .dict()).
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT, *, lock=None, state=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = lock or threading.Lock()
+        self._state = state if state is not None else {}
+        # время между процессами сравнимо только по системным часам
+        self._clock = time.monotonic if state is None else time.time
+
+    def wait(self):
+        with self._lock:
+            now = self._clock()
+            start_at = max(now, self._state.get("next_at", 0.0))
+            self._state["next_at"] = start_at + self.interval
+        delay = start_at - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Один ограничитель на процесс — квота общая для всех сессий приложения
+DEFAULT_LIMITER = RateLimiter()
+
+
+def build_request(cmd_code, period, *, flow_code='X', partner_code='643',
+                  reporter_code=None, max_records=MAX_RECORDS):
+    """Параметры previewFinalData в том виде, в каком их использует проект"""
+    return dict(
+        typeCode='C', freqCode='A', clCode='HS', period=period,
+        reporterCode=reporter_code, cmdCode=str(cmd_code), flowCode=flow_code,
+        partnerCode=partner_code, format_output='JSON', includeDesc=True,
+        partner2Code=None, customsCode=None, motCode=None, maxRecords=max_records
+    )
+
+
+_references = {}
+
+
+def _reference(category):
+    """Справочник Comtrade (загружается один раз за процесс; неудачи не запоминаются)"""
+    if category not in _references:
+        df = comtradeapicall.getReference(category)
+        if df is None or df.empty:
+            return None
+        _references[category] = df
+    return _references[category]
+
+
+def reporter_codes():
+    """Коды всех стран-репортёров (без групп стран)"""
+    df = _reference('reporter')
+    if df is None:
+        return []
+    if 'isGroup' in df.columns:
+        df = df[~df['isGroup'].astype(bool)]
+    return [str(c) for c in df['id']]
+
+
+def sub_codes(cmd_code):
+    """6-значные подсубпозиции HS, входящие в код cmd_code"""
+    df = _reference('cmd:HS')
+    if df is None:
+        return []
+    ids = df['id'].astype(str)
+    return ids[(ids.str.len() == 6) & ids.str.startswith(str(cmd_code))].tolist()
+
+
+def _items(value):
+    return [] if value is None else [v for v in str(value).split(',') if v]
+
+
+def _chunks(items, n):
+    """Делит список на n примерно равных частей"""
+    n = max(1, min(n, len(items)))
+    size = -(-len(items) // n)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def split_request(params, groups=REPORTER_GROUPS):
+    """
+    Делит запрос, ответ на который обрезан, на несколько меньших.
+    Порядок: периоды → список кодов → потоки → группы репортёров → подсубпозиции.
+    Возвращает пустой список, если делить дальше нечего.
+    """
+    def with_(key, values):
+        return [{**params, key: ','.join(v)} for v in values]
+
+    periods = _items(params.get('period'))
+    if len(periods) > 1:
+        return with_('period', [[p] for p in periods])
+
+    codes = _items(params.get('cmdCode'))
+    if len(codes) > 1:
+        return with_('cmdCode', _chunks(codes, 2))
+
+    flows = _items(params.get('flowCode'))
+    if len(flows) > 1:
+        return with_('flowCode', [[f] for f in flows])
+
+    reporters = _items(params.get('reporterCode')) or (
+        reporter_codes() if params.get('reporterCode') is None else [])
+    if len(reporters) > 1:
+        parts = _chunks(reporters, 2 if params.get('reporterCode') else groups)
+        return with_('reporterCode', parts)
+
+    if len(codes) == 1 and len(codes[0]) < 6:
+        children = sub_codes(codes[0])
+        if len(children) > 1:
+            return with_('cmdCode', _chunks(children, groups))
+
+    return []
+
+
+def is_truncated(params, data):
+    """Ответ упёрся в maxRecords — часть строк могла не поместиться"""
+    return len(data) >= int(params.get('maxRecords') or MAX_RECORDS)
+
+
+def _merge(frames):
+    """Склеивает ответы частей запроса, убирая строки, пришедшие дважды"""
+    df = pd.concat([f for f in frames if not f.empty] or frames[:1], ignore_index=True)
+    keys = [c for c in KEY_COLUMNS if c in df.columns]
+    if keys:
+        df = df.drop_duplicates(subset=keys, ignore_index=True)
+    return df
+
+
+def _call_with_timeout(fn, params, timeout):
+    """Выполняет fn(**params) в отдельном потоке и ждёт не дольше timeout"""
+    result = {}
+
+    def target():
+        try:
+            result["value"] = fn(**params)
+        except Exception as e:
+            result["error"] = e
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        # зависший запрос дорабатывает в фоне, его результат отбрасывается
+        raise TimeoutError(f"Comtrade не ответил за {timeout} с")
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+class FetchEngine:
+    """Пакетная загрузка запросов Comtrade с повторами и ограничением частоты"""
+
+    def __init__(self, fetch_fn=None, *, max_workers=MAX_WORKERS, timeout=REQUEST_TIMEOUT,
+                 retries=RETRIES, backoff=BACKOFF, limiter=None, check=None):
+        """
+        check() вызывается перед каждой попыткой запроса и может прервать загрузку
+        исключением (например, при отмене задачи); исключение выходит из fetch_*.
+        """
+        self.fetch_fn = fetch_fn
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter or DEFAULT_LIMITER
+        self.check = check
+
+    def _fn(self):
+        # берём previewFinalData в момент вызова, чтобы его можно было подменить
+        return self.fetch_fn or comtradeapicall.previewFinalData
+
+    def fetch_one(self, params):
+        """
+        Выполняет один запрос. Возвращает DataFrame или None,
+        если все попытки завершились ошибкой.
+        """
+        fn = self._fn()
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            if self.check is not None:
+                self.check()
+            try:
+                data = _call_with_timeout(fn, params, self.timeout)
+                # previewFinalData при ошибке HTTP печатает ответ и возвращает None
+                if data is not None:
+                    return data
+                error = "пустой ответ API"
+            except Exception as e:
+                error = e
+            if attempt < self.retries:
+                delay = self.backoff * 2 ** attempt
+                logger.warning("Comtrade cmdCode=%s period=%s: %s, повтор через %.1f с",
+                               params.get("cmdCode"), params.get("period"), error, delay)
+                time.sleep(delay)
+
+        logger.error("Comtrade cmdCode=%s period=%s: не удалось загрузить (%s)",
+                     params.get("cmdCode"), params.get("period"), error)
+        return None
+
+    def fetch_many(self, requests):
+        """Выполняет запросы параллельно, результаты — в порядке запросов"""
+        requests = list(requests)
+        if not requests:
+            return []
+        if len(requests) == 1:
+            return [self.fetch_one(requests[0])]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(requests))) as pool:
+            return list(pool.map(self.fetch_one, requests))
+
+    def fetch_complete(self, requests):
+        """
+        Как fetch_many, но обрезанные ответы делятся (split_request), части
+        загружаются параллельно и склеиваются без дублей.
+        Если хотя бы одна часть не загрузилась, результат запроса — None:
+        неполные итоги хуже, чем явная ошибка.
+        """
+        requests = list(requests)
+        parts = [[] for _ in requests]
+        failed = set()
+        pending = list(enumerate(requests))
+
+        while pending:
+            results = self.fetch_many([params for _, params in pending])
+            next_round = []
+            for (i, params), data in zip(pending, results):
+                if data is None:
+                    failed.add(i)
+                    continue
+                if is_truncated(params, data):
+                    sub_requests = split_request(params)
+                    if sub_requests:
+                        next_round.extend((i, sub) for sub in sub_requests)
+                        continue
+                    logger.warning("Comtrade cmdCode=%s period=%s: ответ обрезан на %d записях, "
+                                   "делить запрос дальше нечем", params.get("cmdCode"),
+                                   params.get("period"), len(data))
+                parts[i].append(data)
+            pending = [(i, sub) for i, sub in next_round if i not in failed]
+
+        return [None if i in failed else frames[0] if len(frames) == 1 else _merge(frames)
+                for i, frames in enumerate(parts)]
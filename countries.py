@@ -0,0 +1,136 @@
+"""
+Классификация стран-поставщиков по сегментам
+
+segment (int8):
+- 0 — Китай;
+- 1 — прочие дружественные страны;
+- 2 — недружественные страны (перечень распоряжения № 430-р).
+
+Статусы стран хранятся в реестре data/country_registry.csv: ключ — код репортёра
+Comtrade (M49), у каждой записи есть даты начала и окончания действия. Для каждого
+года реестр компилируется в массив «код M49 → сегмент», поэтому классификация
+строки — это одно обращение по индексу, без сравнения строк.
+"""
+
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+REGISTRY_PATH = os.getenv(
+    "COUNTRY_REGISTRY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "country_registry.csv"),
+)
+CHINA = 'China'
+
+SEGMENT_CHINA = 0
+SEGMENT_FRIENDLY = 1
+SEGMENT_UNFRIENDLY = 2
+SEGMENT_LABELS = ["Китай", "Другие дружественные", "Недружественные"]
+
+_SEGMENT_BY_NAME = {"china": SEGMENT_CHINA, "friendly": SEGMENT_FRIENDLY,
+                    "unfriendly": SEGMENT_UNFRIENDLY}
+
+M49_SIZE = 1000   # коды M49 трёхзначные; последний слот таблицы — для неизвестных кодов
+
+
+class CountryRegistry:
+    """Реестр статусов стран по кодам M49 с датами действия"""
+
+    def __init__(self, entries: pd.DataFrame):
+        self.entries = entries
+        self._tables = {}
+
+    @classmethod
+    def load(cls, path=REGISTRY_PATH):
+        """Читает реестр из CSV (строки, начинающиеся с #, — комментарии)"""
+        entries = pd.read_csv(path, comment="#", dtype={"reporterDesc": str, "segment": str},
+                              parse_dates=["effective_from", "effective_to"])
+        entries["segment"] = entries["segment"].str.strip().str.lower().map(_SEGMENT_BY_NAME)
+        if entries["segment"].isna().any():
+            raise ValueError(f"Неизвестный сегмент в реестре стран {path}")
+        bad_codes = ~entries["reporterCode"].between(0, M49_SIZE - 1)
+        if bad_codes.any():
+            raise ValueError(f"Некорректные коды M49 в реестре: {entries.loc[bad_codes, 'reporterCode'].tolist()}")
+        entries["segment"] = entries["segment"].astype(np.int8)
+        return cls(entries)
+
+    def _active(self, year):
+        # статус на конец года: так изменения в течение года учитываются в том же году
+        as_of = pd.Timestamp(year=int(year), month=12, day=31)
+        e = self.entries
+        return e[(e["effective_from"] <= as_of) & (e["effective_to"].isna() | (e["effective_to"] > as_of))]
+
+    def table(self, year) -> np.ndarray:
+        """Массив сегментов, индексированный кодом M49, на год year"""
+        year = int(year)
+        if year not in self._tables:
+            active = self._active(year)
+            table = np.full(M49_SIZE + 1, SEGMENT_FRIENDLY, dtype=np.int8)
+            table[active["reporterCode"].to_numpy()] = active["segment"].to_numpy()
+            self._tables[year] = table
+        return self._tables[year]
+
+    def classify(self, codes, years) -> np.ndarray:
+        """Сегмент для каждой пары (код M49, год) — одно обращение к таблице на строку"""
+        codes = pd.to_numeric(pd.Series(codes), errors="coerce").to_numpy(dtype=float)
+        idx = np.where((codes >= 0) & (codes < M49_SIZE), codes, M49_SIZE)
+        idx = np.nan_to_num(idx, nan=M49_SIZE).astype(np.intp)
+
+        unique_years, year_idx = np.unique(np.asarray(years, dtype=np.int64), return_inverse=True)
+        tables = np.stack([self.table(y) for y in unique_years]) if len(unique_years) else \
+            np.empty((0, M49_SIZE + 1), dtype=np.int8)
+        return tables[year_idx.ravel(), idx]
+
+    def names(self, segment, year=None) -> set:
+        """Названия стран сегмента на год year (по умолчанию — текущий)"""
+        active = self._active(year or pd.Timestamp.now().year)
+        return set(active.loc[active["segment"] == segment, "reporterDesc"])
+
+
+@lru_cache(maxsize=None)
+def get_registry(path=REGISTRY_PATH) -> CountryRegistry:
+    """Реестр загружается один раз за процесс"""
+    return CountryRegistry.load(path)
+
+
+# Текущий перечень недружественных стран (названия как в reporterDesc)
+UNFRIENDLY = get_registry().names(SEGMENT_UNFRIENDLY)
+
+
+def classify_names(names, year=None) -> np.ndarray:
+    """Сегмент для каждого названия страны (как в reporterDesc) — запасной путь без кодов M49"""
+    registry = get_registry()
+    names = pd.Index(names, dtype=object).astype(str)
+    return np.select(
+        [names.isin(registry.names(SEGMENT_UNFRIENDLY, year)),
+         names.isin(registry.names(SEGMENT_CHINA, year))],
+        [SEGMENT_UNFRIENDLY, SEGMENT_CHINA],
+        SEGMENT_FRIENDLY,
+    ).astype(np.int8)
+
+
+def segment_codes(reporters: pd.Series) -> np.ndarray:
+    """Сегмент для каждой строки по названию страны; классифицируются только уникальные страны"""
+    if not isinstance(reporters.dtype, pd.CategoricalDtype):
+        reporters = reporters.astype("category")
+    # последний элемент таблицы — для пропусков (код категории -1)
+    table = np.append(classify_names(reporters.cat.categories), np.int8(SEGMENT_FRIENDLY))
+    return table[reporters.cat.codes.to_numpy()]
+
+
+def classify_frame(df: pd.DataFrame, reporter_code_col: str = "reporterCode",
+                   year_col: str = "refYear", reporter_col: str = "reporterDesc") -> np.ndarray:
+    """Сегменты строк таблицы Comtrade: по коду M49 и году, а без них — по названию страны"""
+    if reporter_code_col in df.columns and year_col in df.columns:
+        return get_registry().classify(df[reporter_code_col], df[year_col])
+    return segment_codes(df[reporter_col])
+
+
+def segment_of(df: pd.DataFrame, segment_col: str = "segment",
+               reporter_col: str = "reporterDesc") -> np.ndarray:
+    """Готовая колонка сегмента или, если её нет, классификация на лету"""
+    if segment_col in df.columns:
+        return df[segment_col].to_numpy()
+    return classify_frame(df, reporter_col=reporter_col)
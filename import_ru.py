@@ -1,36 +1,87 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
-import comtradeapicall
-
-UNFRIENDLY = {
-    'Australia', 'Albania', 'Andorra', 'United Kingdom', 'Iceland', 'Canada',
-    'New Zealand', 'Norway', 'Rep. of Korea', 'North Macedonia', 'Singapore',
-    'USA', 'Ukraine', 'Montenegro', 'Switzerland', 'Japan',
-    'Austria', 'Belgium', 'Bulgaria', 'Hungary', 'Germany', 'Greece', 'Denmark',
-    'Ireland', 'Spain', 'Italy', 'Cyprus', 'Latvia', 'Lithuania', 'Luxembourg',
-    'Malta', 'Netherlands', 'Poland', 'Portugal', 'Romania', 'Slovakia',
-    'Slovenia', 'Finland', 'France', 'Croatia', 'Czechia', 'Sweden', 'Estonia'
-}
-CHINA = 'China'
-
-def download_by_tnved(cmd_code: str):
-    """Загружает данные по указанному коду ТН ВЭД за последние 3 года"""
+
+import trade_store
+from comtrade_cache import is_provisional, read_cached, write_cached
+from comtrade_fetch import FetchEngine, build_request
+from countries import SEGMENT_UNFRIENDLY, classify_frame
+
+def last_years(n: int = 3):
+    """Последние n завершённых лет, от нового к старому"""
     now = datetime.now()
-    years = [now.year - 1, now.year - 2, now.year - 3]
+    return [now.year - i for i in range(1, n + 1)]
+
+def download_by_tnved(cmd_code: str, years=None, *, use_cache: bool = True,
+                      cache_only: bool = False, use_store: bool = True,
+                      engine: FetchEngine | None = None):
+    """
+    Загружает данные по указанному коду ТН ВЭД за годы years (по умолчанию — последние 3 года)
+
+    use_cache — брать ответы из локального кэша (comtrade_cache), если они не устарели;
+    cache_only — не обращаться к API, вернуть только то, что уже есть в кэше;
+    use_store — окончательные (не пересматриваемые) годы брать из хранилища trade_store,
+                загруженные из API — сохранять в него;
+    engine — FetchEngine для загрузки недостающих лет (по умолчанию — с настройками модуля).
+    """
+    years = list(years) if years is not None else last_years(3)
+    flow_code, partner_code = 'X', '643'
 
-    df = pd.DataFrame()
+    frames = {}
+    missing = []
     for year in years:
-        data = comtradeapicall.previewFinalData(
-            typeCode='C', freqCode='A', clCode='HS', period=year,
-            reporterCode=None, cmdCode=str(cmd_code), flowCode='X',
-            partnerCode='643', format_output='JSON', includeDesc=True,
-            partner2Code=None, customsCode=None, motCode=None, maxRecords=50000
-        )
-        df = pd.concat([df, data], ignore_index=True)
-    return df
+        data = None
+        if use_cache or cache_only:
+            data = read_cached(cmd_code, year, flow_code, partner_code, ignore_ttl=cache_only)
+        if data is not None:
+            frames[year] = data
+        elif not cache_only:
+            missing.append(year)
+
+    # Окончательные годы, уже лежащие в хранилище, читаем с диска одним запросом
+    if use_store and missing:
+        final = [year for year in missing if not is_provisional(year)]
+        stored = trade_store.stored_years(cmd_code, final)
+        if stored:
+            data = trade_store.query([cmd_code], stored, flow_code=flow_code)
+            for year, part in data.groupby("refYear"):
+                frames[int(year)] = part.reset_index(drop=True)
+            missing = [year for year in missing if year not in frames]
+
+    # Все недостающие годы запрашиваем одновременно
+    fetched = []
+    if missing:
+        engine = engine or FetchEngine()
+        requests = [build_request(cmd_code, year, flow_code=flow_code, partner_code=partner_code)
+                    for year in missing]
+        for year, data in zip(missing, engine.fetch_complete(requests)):
+            if data is None:
+                continue
+            if use_cache:
+                write_cached(data, cmd_code, year, flow_code, partner_code)
+            frames[year] = data
+            fetched.append(trade_store.with_request_code(data, cmd_code))
+    if use_store and fetched:
+        trade_store.write(pd.concat(fetched, ignore_index=True))
+
+    # Склеиваем один раз, в исходном порядке лет
+    parts = [frames[year] for year in years if year in frames]
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts, ignore_index=True)
 
 def mark_friendly(df: pd.DataFrame):
-    """Добавляет колонку isFriendly: 1 — дружественная, 0 — недружественная"""
+    """
+    Добавляет колонки isFriendly (1 — дружественная, 0 — недружественная)
+    и segment (0 — Китай, 1 — прочие дружественные, 2 — недружественные).
+    Сегмент определяется по коду репортёра M49 и году (реестр countries), названия
+    стран переводятся в категории.
+    """
     if 'reporterDesc' in df.columns:
-        df['isFriendly'] = df['reporterDesc'].apply(lambda x: 0 if x in UNFRIENDLY else 1)
+        for col in ('reporterDesc', 'reporterISO', 'partnerDesc', 'partnerISO'):
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        segment = classify_frame(df)
+        df['segment'] = segment
+        df['isFriendly'] = (segment != SEGMENT_UNFRIENDLY).astype(np.int8)
     return df
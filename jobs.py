@@ -0,0 +1,204 @@
+"""
+Фоновые задачи анализа
+
+Анализ кода (pipeline.run_analysis) выполняется в пуле процессов фиксированного
+размера, а приложение только ставит задачу и опрашивает её состояние:
+- таблица задач: статус, этап, доля выполненного, ошибка, результат;
+- одинаковые задачи (тот же код и набор лет), пока они в работе, не дублируются —
+  все сессии получают один и тот же job_id;
+- отмена: задача из очереди снимается сразу, выполняющаяся прерывается
+  на ближайшей границе этапов, а на этапе загрузки — перед очередным запросом
+  к Comtrade;
+- рабочие процессы делят один ограничитель частоты запросов к Comtrade,
+  поэтому общая частота не превышает comtrade_fetch.RATE_LIMIT при любом
+  числе процессов;
+- готовый непустой результат кладётся в pipeline.ANALYSIS_CACHE, так что
+  повторная постановка той же задачи завершается сразу.
+
+Прогресс, флаги отмены и состояние ограничителя частоты передаются между
+процессами через multiprocessing.Manager.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import pipeline
+from comtrade_fetch import FetchEngine, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+JOB_TTL = 3600   # сколько хранить завершённые задачи, с
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Задача прервана по запросу отмены"""
+
+
+@dataclass
+class Job:
+    """Запись таблицы задач"""
+    id: str
+    key: tuple
+    status: str = QUEUED
+    stage: str = ""
+    progress: float = 0.0
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    error: str | None = None
+    result: pipeline.AnalysisResult | None = field(default=None, repr=False)
+    future: object = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+
+def _run_job(job_id, tnved_code, years, shared, limiter_lock, limiter_state):
+    """
+    Тело задачи в процессе пула: прогресс пишется в shared, там же проверяется отмена
+    (на границах этапов и перед каждым запросом к Comtrade)
+    """
+    def check():
+        if shared.get(("cancel", job_id)):
+            raise JobCancelled(job_id)
+
+    def progress(stage, done):
+        check()
+        shared[job_id] = (stage, done)
+
+    engine = FetchEngine(limiter=RateLimiter(lock=limiter_lock, state=limiter_state), check=check)
+    return pipeline.run_analysis(tnved_code, years, progress=progress, engine=engine)
+
+
+class JobManager:
+    """Пул процессов и таблица задач анализа"""
+
+    def __init__(self, max_workers=MAX_WORKERS, job_ttl=JOB_TTL, cache=None):
+        self.max_workers = max_workers
+        self.job_ttl = job_ttl
+        self.cache = cache if cache is not None else pipeline.ANALYSIS_CACHE
+        # spawn: рабочие процессы не наследуют потоки и состояние веб-сервера
+        self._context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(max_workers, mp_context=self._context)
+        self._manager = self._context.Manager()
+        self._shared = self._manager.dict()
+        # ограничитель частоты Comtrade, общий для всех рабочих процессов
+        self._limiter_lock = self._manager.Lock()
+        self._limiter_state = self._manager.dict()
+        self._jobs = {}      # job_id -> Job
+        self._active = {}    # ключ анализа -> job_id незавершённой задачи
+        self._lock = threading.Lock()
+
+    def submit(self, tnved_code: str, years=None) -> str:
+        """Ставит анализ в очередь и возвращает job_id (существующий, если такой уже идёт)"""
+        key = pipeline.analysis_key(tnved_code, years)
+        with self._lock:
+            self._purge()
+            if key in self._active:
+                return self._active[key]
+
+            job = Job(id=uuid.uuid4().hex[:12], key=key)
+            self._jobs[job.id] = job
+            cached = self.cache.get(key)
+            if cached is not None:
+                job.status, job.stage, job.progress = DONE, "done", 1.0
+                job.result, job.finished_at = cached, time.time()
+                return job.id
+
+            self._active[key] = job.id
+            job.future = self._executor.submit(_run_job, job.id, key[0], list(key[1]), self._shared,
+                                               self._limiter_lock, self._limiter_state)
+        job.future.add_done_callback(lambda future, job=job: self._finish(job, future))
+        return job.id
+
+    def get(self, job_id: str) -> Job | None:
+        """Задача по id с актуальным прогрессом (None — неизвестна или уже удалена)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not job.finished:
+                # под блокировкой: _finish не успеет завершить задачу между проверкой
+                # и обновлением, и устаревший прогресс не затрёт итоговый статус
+                state = self._shared.get(job_id)
+                if state is not None:
+                    job.status = RUNNING
+                    job.stage, job.progress = state
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Отменяет задачу. Задача общая для всех сессий, поставивших тот же анализ,
+        поэтому отмена действует на всех. Возвращает False, если задача уже завершена.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            # новая постановка того же анализа не должна присоединяться к отменяемой задаче
+            if self._active.get(job.key) == job_id:
+                del self._active[job.key]
+        if not job.future.cancel():
+            self._shared[("cancel", job_id)] = True
+        return True
+
+    def jobs(self) -> list:
+        """Все задачи таблицы, от новых к старым"""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.submitted_at, reverse=True)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._manager.shutdown()
+
+    def _finish(self, job, future):
+        with self._lock:
+            if self._active.get(job.key) == job.id:
+                del self._active[job.key]
+            job.finished_at = time.time()
+            error = None if future.cancelled() else future.exception()
+            if future.cancelled() or isinstance(error, JobCancelled):
+                job.status = CANCELLED
+            elif error is not None:
+                job.status, job.error = FAILED, str(error) or type(error).__name__
+                logger.warning("Задача %s (%s) завершилась ошибкой: %s", job.id, job.key, job.error)
+                if isinstance(error, BrokenProcessPool):
+                    # упавший рабочий процесс ломает весь пул — заводим новый
+                    self._executor = ProcessPoolExecutor(self.max_workers, mp_context=self._context)
+            else:
+                job.status, job.stage, job.progress = DONE, "done", 1.0
+                job.result = future.result()
+            self._shared.pop(job.id, None)
+            self._shared.pop(("cancel", job.id), None)
+
+        if job.status == DONE and not job.result.empty:
+            self.cache.put(job.key, job.result)
+
+    def _purge(self):
+        # вызывается под self._lock
+        now = time.time()
+        stale = [job_id for job_id, job in self._jobs.items()
+                 if job.finished and now - job.finished_at > self.job_ttl]
+        for job_id in stale:
+            del self._jobs[job_id]
+
+
+@lru_cache(maxsize=None)
+def get_job_manager() -> JobManager:
+    """Общий для процесса менеджер задач (создаётся при первом обращении)"""
+    return JobManager()
@@ -1,37 +1,232 @@
+"""
+Рекомендации GigaChat по метрикам
+
+- клиенты GigaChat живут всё время работы процесса и берутся из общего пула:
+  TLS-соединение и токен доступа переиспользуются между нажатиями кнопки
+  и между сессиями (токен библиотека обновляет сама, когда он истекает);
+- запрос собирается в prompt_builder (инструкции отдельно, данные один раз,
+  бюджет токенов); ответы кэшируются по SHA-256 от модели и текста запроса с TTL:
+  повторный запрос с теми же метриками возвращается сразу и не тратит токены,
+  а одновременные одинаковые запросы отправляются в GigaChat один раз;
+- потоковый режим (stream_llm_answer) отдаёт текст частями по мере генерации:
+  пользователь видит начало ответа через время до первого токена, а не после
+  генерации всего текста; зависший ответ обрывается (таймаут чтения клиента
+  между частями и общий лимит max_seconds), в кэш попадает только полный ответ;
+- адреса API и авторизации задаются переменными окружения GIGACHAT_BASE_URL
+  и GIGACHAT_AUTH_URL — так модуль проверяется на локальной заглушке GigaChat.
+"""
+
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
 from dotenv import load_dotenv
-from .prompt import PROMPT
 from gigachat import GigaChat
-import os
+
+from analysis_cache import ResultCache
+from .prompt_builder import Prompt, prompt_from_text
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 API_KEY_GIGACHAT = os.getenv("GIGACHAT_API_KEY")
+MODEL = os.getenv("GIGACHAT_MODEL", "GigaChat-2")
+SCOPE = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
+BASE_URL = os.getenv("GIGACHAT_BASE_URL") or None   # None — адрес по умолчанию библиотеки
+AUTH_URL = os.getenv("GIGACHAT_AUTH_URL") or None
+POOL_SIZE = int(os.getenv("GIGACHAT_POOL_SIZE", "4"))
+TIMEOUT = float(os.getenv("GIGACHAT_TIMEOUT", "120"))   # в потоке — предельная пауза между частями
+STREAM_MAX_SECONDS = float(os.getenv("LLM_STREAM_MAX_SECONDS", "300"))
+
+CUT_OFF_NOTE = "\n\n_Ответ прерван: превышено время ожидания._"
+
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+CACHE_MAX_ENTRIES = 256
+
+# ответы — строки; размер записи считаем по длине текста
+RESPONSE_CACHE = ResultCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                             max_bytes=64 * 1024 * 1024, sizeof=lambda text: len(text) * 4)
+
+
+def create_client(model=MODEL, **settings) -> GigaChat:
+    """Новый клиент GigaChat с настройками из окружения (settings — дополнительные параметры GigaChat)"""
+    return GigaChat(
+        credentials=API_KEY_GIGACHAT,
+        model=model,
+        base_url=BASE_URL,
+        auth_url=AUTH_URL,
+        verify_ssl_certs=False,
+        scope=SCOPE,
+        timeout=TIMEOUT,
+        **settings,
+    )
+
+
+class ClientPool:
+    """
+    Пул долгоживущих клиентов GigaChat.
+    Клиенты создаются по мере надобности (не больше size); если все заняты,
+    запрос ждёт освободившийся клиент.
+    """
+
+    def __init__(self, size=POOL_SIZE, factory=create_client):
+        self.size = size
+        self.factory = factory
+        self._idle = queue.LifoQueue()   # последний вернувшийся клиент — с самым «тёплым» соединением
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def client(self):
+        """Клиент из пула на время запроса"""
+        giga = self._take()
+        try:
+            yield giga
+        except BaseException:
+            # после ошибки или прерванного потока состояние соединения неизвестно —
+            # клиент не возвращаем
+            self._discard(giga)
+            raise
+        self._idle.put(giga)
+
+    def _take(self) -> GigaChat:
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    break
+            try:
+                # ждём возврата клиента; по таймауту проверяем, не освободилось ли место
+                # (клиент после ошибки закрывается, а не возвращается в пул)
+                return self._idle.get(timeout=1.0)
+            except queue.Empty:
+                continue
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
 
-def get_llm_answer(metrics_text):
+    def _discard(self, giga):
+        with self._lock:
+            self._created -= 1
+        try:
+            giga.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Закрывает свободные клиенты"""
+        while True:
+            try:
+                giga = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(giga)
+
+
+@lru_cache(maxsize=None)
+def get_client_pool(model=MODEL) -> ClientPool:
+    """Общий для процесса пул клиентов модели"""
+    return ClientPool(factory=lambda: create_client(model))
+
+
+def as_prompt(prompt) -> Prompt:
+    """Prompt из prompt_builder или готовый текст метрик"""
+    return prompt if isinstance(prompt, Prompt) else prompt_from_text(prompt)
+
+
+def cache_key(prompt: Prompt, model=MODEL) -> str:
+    """Ключ кэша ответов: хэш модели и текста запроса"""
+    text = f"{model}\0{prompt.system}\0{prompt.user}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _log_request(prompt: Prompt, model):
+    logger.info("Запрос к %s: ~%d токенов (инструкции %d, данные %d; категорий подробно %d из %d%s)",
+                model, prompt.tokens, prompt.system_tokens, prompt.user_tokens,
+                prompt.detailed, prompt.categories, ", данные сокращены" if prompt.truncated else "")
+
+
+def get_llm_answer(prompt, *, model=MODEL, use_cache=True, pool=None):
     """
     Получает рекомендации от LLM на основе метрик
-    
+
     Args:
-        metrics_text (str): Форматированный текст с метриками
-        
+        prompt (Prompt | str): запрос из prompt_builder или форматированный текст с метриками
+        model (str): модель GigaChat
+        use_cache (bool): брать ответ из кэша, если такой запрос уже был
+        pool (ClientPool): пул клиентов (по умолчанию — общий пул модели)
+
     Returns:
         str: Рекомендации от LLM
     """
+    prompt = as_prompt(prompt)
+    pool = pool or get_client_pool(model)
 
-        # Инициализируем GigaChat с правильными параметрами
-    giga = GigaChat(
-        credentials=API_KEY_GIGACHAT,
-        model='GigaChat-2',
-        verify_ssl_certs=False,
-        scope='GIGACHAT_API_PERS'
-    )
+    def ask():
+        _log_request(prompt, model)
+        with pool.client() as giga:
+            resp = giga.chat(prompt.payload())
+        return resp.choices[0].message.content
+
+    if not use_cache:
+        return ask()
+    return RESPONSE_CACHE.get_or_compute(cache_key(prompt, model), ask,
+                                         should_cache=lambda answer: bool(answer))
+
+
+def stream_llm_answer(prompt, *, model=MODEL, use_cache=True, pool=None,
+                      max_seconds=STREAM_MAX_SECONDS):
+    """
+    Рекомендации от LLM частями по мере генерации (генератор строк).
+
+    Ответ из кэша отдаётся одной частью. Полный ответ после завершения потока
+    кладётся в кэш; если генерация длится дольше max_seconds, поток обрывается
+    сообщением CUT_OFF_NOTE и в кэш ничего не попадает. Если потребитель закрывает
+    генератор раньше, запрос к GigaChat прерывается.
+    """
+    prompt = as_prompt(prompt)
+    key = cache_key(prompt, model)
+    if use_cache:
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            yield cached
+            return
 
-    # Формируем промпт с метриками
-    payload = PROMPT.format(metrics=metrics_text)
+    pool = pool or get_client_pool(model)
+    _log_request(prompt, model)
+    parts = []
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    try:
+        with pool.client() as giga:
+            for chunk in giga.stream(prompt.payload()):
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    parts.append(text)
+                    yield text
+                if deadline is not None and time.monotonic() > deadline:
+                    # клиент с недочитанным ответом пул закроет и не вернёт
+                    raise _CutOff
+    except _CutOff:
+        yield CUT_OFF_NOTE
+        return
 
-    # Отправляем запрос
-    resp = giga.chat(payload)
+    answer = "".join(parts)
+    if use_cache and answer:
+        RESPONSE_CACHE.put(key, answer)
 
-    return resp.choices[0].message.content
 
-   
\ No newline at end of file
+class _CutOff(Exception):
+    """Поток ответа оборван по времени"""
@@ -1,4 +1,5 @@
-PROMPT = """
+# Инструкции и пример: неизменная часть запроса (одинакова для всех кодов)
+INSTRUCTIONS = """
 Ты — эксперт по таможенно-тарифному регулированию ЕАЭС. 
 На основании предоставленных метрик оцени, какие меры ТТР целесообразно применить к товару.
 Всегда опирайся только на данные, без предположений.
@@ -123,8 +124,6 @@ PROMPT = """
  - production_growth_rate < -0.1 - Значительное снижение производства
 
 
-{metrics}
-
 Пример:
 Данные:
 Код ТН ВЭД: 841850
@@ -198,7 +197,13 @@ is_in_order_4114: False
 
 
 Ответ должен быть аргументированным и обоснованным на оснвании предоставленных данных.
-Вот теперь давай сформируем ответ на основе предоставленных данных.
- Вот данные:
- {metrics}
-"""
\ No newline at end of file
+"""
+
+# Данные по коду: переменная часть запроса
+REQUEST = """Вот теперь давай сформируем ответ на основе предоставленных данных.
+Вот данные:
+{metrics}
+"""
+
+# Запрос одним сообщением
+PROMPT = INSTRUCTIONS + REQUEST
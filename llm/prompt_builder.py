@@ -0,0 +1,193 @@
+"""
+Сборка запроса к GigaChat по метрикам кода
+
+- инструкции и пример (prompt.INSTRUCTIONS) — системное сообщение, одинаковое
+  для всех кодов: неизменный префикс, который не зависит от загруженных данных;
+- данные по коду входят в запрос один раз (сообщение пользователя);
+- бюджет токенов: блок импорта и итоги проверки критериев (rules_engine)
+  передаются всегда, подробные блоки категорий производства — по убыванию потребления, пока помещаются; остальные категории
+  сводятся в одну строку итогов, а если не помещается и она — текст обрезается.
+  Поэтому размер запроса (а с ним время и стоимость ответа) не растёт
+  с числом категорий в загруженном файле;
+- число токенов оценивается локально, без запроса к API.
+"""
+
+import math
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from .prompt import INSTRUCTIONS, REQUEST
+
+CHARS_PER_TOKEN = 3.0   # оценка с запасом для русского текста
+TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "6000"))
+TRUNCATED_MARK = "\n…(данные сокращены)\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов текста"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass(frozen=True)
+class Prompt:
+    """Запрос к модели: инструкции + данные по коду"""
+    system: str
+    user: str
+    categories: int = 0      # категорий производства в данных
+    detailed: int = 0        # из них переданы подробно
+    truncated: bool = False  # данные обрезаны по бюджету
+
+    @property
+    def system_tokens(self) -> int:
+        return estimate_tokens(self.system)
+
+    @property
+    def user_tokens(self) -> int:
+        return estimate_tokens(self.user)
+
+    @property
+    def tokens(self) -> int:
+        return self.system_tokens + self.user_tokens
+
+    def messages(self) -> list:
+        return [{"role": "system", "content": self.system},
+                {"role": "user", "content": self.user}]
+
+    def payload(self) -> dict:
+        """Аргумент для GigaChat.chat / GigaChat.stream"""
+        return {"messages": self.messages()}
+
+
+def _value(value, fmt):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "N/A"
+    return format(value, fmt)
+
+
+def _trend_label(rate):
+    if rate is None:
+        return "N/A"
+    return 'Положительный' if rate > 0.02 else 'Отрицательный' if rate < -0.02 else 'Стабильный'
+
+
+def import_block(tnved_code, year, record, trends) -> str:
+    """Метрики импорта и флаги мер за последний год"""
+    labels = trends['trends']
+    text = f"""
+Данные:
+Код ТН ВЭД: {tnved_code}
+Период: {year} год
+
+Объём импорта (import_total): {record['import_total']:,.0f}
+Тренд импорта (import_total_trend): {labels['import_total']['label']}
+
+Доля импорта из недружественных стран (share_unfriendly): {record['share_unfriendly']:.3f}
+Тренд доли НС (share_unfriendly_trend): {labels['share_unfriendly']['label']}
+
+Доля импорта из Китая (share_china): {record['share_china']:.3f}
+Тренд доли Китая (share_china_trend): {labels['share_china']['label']}
+"""
+    ratio = record['price_diff_ratio']
+    text += f"Средняя цена из Китая (price_china): {_value(record['price_china'], '.2f')}\n"
+    text += f"Средняя цена из прочих стран (price_others): {_value(record['price_others'], '.2f')}\n"
+    text += f"Отношение цен (price_diff_ratio): {_value(ratio, '.3f')}\n"
+    text += f"Флаг демпинга (dumping_flag): {'N/A' if np.isnan(ratio) else ratio < 1.0}\n"
+
+    text += "\nФлаги для мер ТТР:\n"
+    for flag_key, flag_value in trends['flags'].items():
+        text += f"{flag_key}: {flag_value}\n"
+    return text
+
+
+def category_block(category, metrics) -> str:
+    """Метрики производства и потребления категории за последний год"""
+    self_sufficiency = metrics['self_sufficiency']
+    covers = 'N/A' if self_sufficiency is None else self_sufficiency >= 1.0
+    return (
+        f"\nКатегория: {category}\n"
+        f"Производство в России (production_total): {metrics['manufacture']:,.0f} млн $\n"
+        f"Потребление в России (consumption_total): {metrics['consumption']:,.0f} млн $\n"
+        f"Производство покрывает потребление: {covers}\n"
+        f"Тренд производства (production_trend): {_trend_label(metrics['growth_rate'])}\n"
+        f"Тренд потребления (consumption_trend): {_trend_label(metrics['consumption_growth_rate'])}\n"
+        f"Самообеспеченность: {_value(self_sufficiency, '.3f')}\n"
+        f"Зависимость от импорта: {_value(metrics['import_dependency'], '.3f')}\n"
+        f"Доля производства: {_value(metrics['production_share'], '.3f')}\n"
+        f"Индекс конкурентоспособности: {_value(metrics['competitiveness_index'], '.3f')}\n"
+    )
+
+
+def categories_summary(items) -> str:
+    """Одна строка итогов по категориям, не вошедшим в запрос подробно"""
+    manufacture = sum(metrics['manufacture'] for _, metrics in items)
+    consumption = sum(metrics['consumption'] for _, metrics in items)
+    ratio = manufacture / consumption if consumption else None
+    short = sum(1 for _, metrics in items
+                if metrics['self_sufficiency'] is not None and metrics['self_sufficiency'] < 1.0)
+    return (f"\nПрочие категории ({len(items)}): производство {manufacture:,.0f} млн $, "
+            f"потребление {consumption:,.0f} млн $, самообеспеченность {_value(ratio, '.3f')}, "
+            f"категорий с самообеспеченностью < 1: {short}\n")
+
+
+def _latest(category_metrics):
+    return category_metrics[max(category_metrics)]
+
+
+def rules_block(lines) -> str:
+    """Итоги локальной проверки критериев (rules_engine.RulesResult.explain)"""
+    return "\nПроверка критериев мер по данным (формальная):\n" + "\n".join(lines) + "\n"
+
+
+def build_prompt(tnved_code, year, record, trends, production_metrics=None, *,
+                 rules=None, budget=TOKEN_BUDGET) -> Prompt:
+    """
+    Запрос по метрикам кода в пределах бюджета токенов.
+
+    Args:
+        tnved_code, year: код ТН ВЭД и последний год
+        record: запись метрик импорта за последний год
+        trends: результат summarize_trends
+        production_metrics: {категория: {год: метрики}} из calculate_man_metrics
+        rules: строки пояснений rules_engine по коду (передаются вместе с метриками импорта)
+        budget: предельное число токенов всего запроса (инструкции + данные)
+    """
+    template_tokens = estimate_tokens(INSTRUCTIONS) + estimate_tokens(REQUEST.format(metrics=""))
+    available = budget - template_tokens
+
+    metrics_text = import_block(tnved_code, year, record, trends)
+    if rules:
+        metrics_text += rules_block(rules)
+    items = [(category, _latest(m)) for category, m in (production_metrics or {}).items() if m]
+    items.sort(key=lambda item: item[1]['consumption'] or 0, reverse=True)
+
+    detailed = 0
+    if items:
+        metrics_text += "\n=== МЕТРИКИ ПРОИЗВОДСТВА И ПОТРЕБЛЕНИЯ ===\n"
+        blocks = [category_block(category, metrics) for category, metrics in items]
+        used = estimate_tokens(metrics_text)
+        for i, block in enumerate(blocks):
+            rest = items[i + 1:]
+            reserve = estimate_tokens(categories_summary(rest)) if rest else 0
+            if used + estimate_tokens(block) + reserve > available:
+                break
+            metrics_text += block
+            used += estimate_tokens(block)
+            detailed += 1
+        if detailed < len(items):
+            metrics_text += categories_summary(items[detailed:])
+
+    truncated = detailed < len(items)
+    max_chars = int(max(available, 0) * CHARS_PER_TOKEN)
+    if len(metrics_text) > max_chars:
+        metrics_text = metrics_text[:max(max_chars - len(TRUNCATED_MARK), 0)] + TRUNCATED_MARK
+        truncated = True
+
+    return Prompt(system=INSTRUCTIONS, user=REQUEST.format(metrics=metrics_text),
+                  categories=len(items), detailed=detailed, truncated=truncated)
+
+
+def prompt_from_text(metrics_text) -> Prompt:
+    """Запрос по готовому тексту метрик (без бюджета)"""
+    return Prompt(system=INSTRUCTIONS, user=REQUEST.format(metrics=metrics_text))
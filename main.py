@@ -1,27 +1,234 @@
-from import_ru import download_by_tnved, mark_friendly
-from datetime import datetime
-from calc_import_metrics import calc_import_metrics
-from draw_image import summarize_trends
+#!/usr/bin/env python3
+"""
+Пакетный расчёт метрик импорта и трендов по списку кодов ТН ВЭД без интерфейса
 
-df = download_by_tnved('8528')
-df = mark_friendly(df)
-col = ['refYear', 'reporterDesc', 'isFriendly', 'primaryValue', 'qty', 'qtyUnitCode', 'netWgt','partnerDesc']
-df_proc = df[col].copy()
-now = datetime.now()
-years = [now.year - 1, now.year - 2, now.year - 3]
+Для каждого кода выполняется конвейер pipeline.run_analysis
+(загрузка → сегменты стран → метрики по годам → тренды); коды считаются
+параллельно в пуле процессов.
 
-df_proc_year_1 = df_proc[df_proc['refYear'] == years[0]].sort_values(by='primaryValue', ascending=False).copy()
-df_proc_year_2 = df_proc[df_proc['refYear'] == years[1]].sort_values(by='primaryValue', ascending=False).copy()
-df_proc_year_3 = df_proc[df_proc['refYear'] == years[2]].sort_values(by='primaryValue', ascending=False).copy()
+Результат — таблица «код × год» с метриками импорта и ярлыками трендов кода.
+Каждый посчитанный код сразу дописывается в контрольную точку
+(<out>.checkpoint.jsonl), поэтому прерванный запуск продолжается с того же места:
+уже посчитанные коды пропускаются. В конце таблица собирается из контрольной
+точки и записывается в CSV, Parquet или JSONL (по --format или расширению --out).
+Коды без данных и коды с ошибкой в контрольную точку не попадают и считаются
+при следующем запуске заново.
 
+У каждого процесса свой ограничитель частоты запросов к Comtrade,
+поэтому общая частота — workers × comtrade_fetch.RATE_LIMIT.
 
-records = []
+Запуск:
+    python main.py codes.txt --years 5 --workers 4 --out results/metrics.parquet
+    python main.py 8528 --plot
+"""
 
-records.append(calc_import_metrics(df_proc_year_1))
-records.append(calc_import_metrics(df_proc_year_2))
-records.append(calc_import_metrics(df_proc_year_3))
-print(records)
+import argparse
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-res = summarize_trends(records, plot=True)  
-print(res["trends"])
-print(res["flags"])
\ No newline at end of file
+import pandas as pd
+
+from batch_ingest import read_codes
+from import_ru import last_years
+from pipeline import STAGES, run_analysis
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_PATH = os.path.join("data", "results", "import_metrics.csv")
+FORMATS = ("csv", "parquet", "jsonl")
+WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+
+def _plain(value):
+    # NaN/inf и numpy-скаляры → значения, которые без потерь пишутся в JSON
+    if isinstance(value, float) or hasattr(value, "item"):
+        value = float(value)
+        return value if math.isfinite(value) else None
+    return value
+
+
+def result_rows(result) -> list:
+    """Строки «код × год»: метрики записи за год и ярлыки трендов кода"""
+    trend_columns = {}
+    for metric, trend in result.trends["trends"].items():
+        trend_columns[f"{metric}_trend"] = trend["label"]
+        trend_columns[f"{metric}_delta_pct"] = _plain(trend["delta_pct"])
+    dumping = result.trends["flags"]["for_measure_3:dumping_flag(price_ratio<1)"]
+
+    rows = []
+    for record in result.records:
+        row = {"code": result.tnved_code, "year": int(record["year"])}
+        for key, value in record.items():
+            if key in ("year", "quality"):
+                continue
+            if key == "countries_no_qty":
+                value = "; ".join(value)
+            row[key] = _plain(value)
+        row.update(trend_columns)
+        row["dumping_flag"] = dumping
+        rows.append(row)
+    return rows
+
+
+def analyze_code(code, years, use_cache=True):
+    """
+    Задача процесса пула: (код, строки, время этапов).
+    Строки пустые, если данных по коду нет.
+    """
+    result = run_analysis(code, years, use_cache=use_cache)
+    rows = [] if result.empty else result_rows(result)
+    return code, rows, result.timings
+
+
+def checkpoint_path(out_path) -> str:
+    return f"{os.path.splitext(out_path)[0]}.checkpoint.jsonl"
+
+
+def read_checkpoint(path) -> dict:
+    """{код: строки} из контрольной точки; недописанная последняя строка пропускается"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Повреждённая строка контрольной точки пропущена")
+                continue
+            done[item["code"]] = item["rows"]
+    return done
+
+
+def write_output(rows, out_path, fmt):
+    """Записывает итоговую таблицу атомарно (через временный файл)"""
+    df = pd.DataFrame(rows)
+    if not df.empty:
+        df = df.sort_values(["code", "year"], ignore_index=True)
+    directory = os.path.dirname(out_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{out_path}.tmp"
+    if fmt == "csv":
+        df.to_csv(tmp_path, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_json(tmp_path, orient="records", lines=True, force_ascii=False)
+    os.replace(tmp_path, out_path)
+    return df
+
+
+def run_batch(codes, years, *, out_path=OUTPUT_PATH, fmt=None, workers=WORKERS,
+              use_cache=True, resume=True, refresh=()):
+    """
+    Считает метрики по всем кодам и пишет итоговую таблицу.
+    refresh — коды, которые нужно пересчитать, даже если они есть в контрольной точке
+    (например, после sync.py); новые строки дописываются и заменяют прежние.
+
+    Returns:
+        dict: rows (все строки), empty (коды без данных), failed (коды с ошибкой),
+              timings (суммарное время этапов по кодам, с), wall (общее время, с)
+    """
+    fmt = fmt or os.path.splitext(out_path)[1].lstrip(".").lower() or "csv"
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt}, ожидается один из {FORMATS}")
+    codes = read_codes(codes)
+    years = sorted(years)
+
+    ckpt = checkpoint_path(out_path)
+    done = read_checkpoint(ckpt) if resume else {}
+    for code in refresh:
+        done.pop(str(code), None)
+    if not resume and os.path.exists(ckpt):
+        os.remove(ckpt)
+    todo = [code for code in codes if code not in done]
+    if done:
+        logger.info("Контрольная точка %s: уже посчитано %d кодов", ckpt, len(codes) - len(todo))
+
+    started = time.perf_counter()
+    timings = dict.fromkeys(STAGES, 0.0)
+    empty, failed = [], []
+    if todo:
+        os.makedirs(os.path.dirname(ckpt) or ".", exist_ok=True)
+        with open(ckpt, "a", encoding="utf-8") as checkpoint, \
+                ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            futures = {pool.submit(analyze_code, code, years, use_cache): code for code in todo}
+            for i, future in enumerate(as_completed(futures), 1):
+                code = futures[future]
+                try:
+                    _, rows, code_timings = future.result()
+                except Exception as e:
+                    logger.warning("[%d/%d] %s: ошибка %s", i, len(todo), code, e)
+                    failed.append(code)
+                    continue
+                for stage, seconds in code_timings.items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+                if not rows:
+                    logger.info("[%d/%d] %s: нет данных", i, len(todo), code)
+                    empty.append(code)
+                    continue
+                checkpoint.write(json.dumps({"code": code, "rows": rows}, ensure_ascii=False) + "\n")
+                checkpoint.flush()
+                done[code] = rows
+                logger.info("[%d/%d] %s: готово", i, len(todo), code)
+
+    rows = [row for code in codes if code in done for row in done[code]]
+    write_output(rows, out_path, fmt)
+    return {"rows": rows, "empty": empty, "failed": failed, "timings": timings,
+            "wall": time.perf_counter() - started}
+
+
+def plot_code(code, years, use_cache=True):
+    """Один код: печать записей и графики трендов (прежнее поведение main.py)"""
+    from draw_image import trend_figures
+
+    result = run_analysis(code, years, use_cache=use_cache)
+    print(result.records)
+    print(result.trends["trends"])
+    print(result.trends["flags"])
+    if not result.empty:
+        for fig in trend_figures(result.trends).values():
+            fig.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный расчёт метрик импорта и трендов по кодам ТН ВЭД")
+    parser.add_argument("codes", help="файл со списком кодов или коды через запятую")
+    parser.add_argument("--years", type=int, default=3, help="сколько лет в окне")
+    parser.add_argument("--end-year", type=int, help="последний год окна (по умолчанию — прошлый год)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="число процессов")
+    parser.add_argument("--out", default=OUTPUT_PATH, help="файл результата")
+    parser.add_argument("--format", choices=FORMATS, help="формат результата (по умолчанию — по расширению --out)")
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш comtrade_cache")
+    parser.add_argument("--restart", action="store_true", help="не продолжать с контрольной точки")
+    parser.add_argument("--plot", action="store_true", help="один код: показать графики трендов")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    end_year = args.end_year or last_years(1)[0]
+    years = list(range(end_year - args.years + 1, end_year + 1))
+
+    if args.plot:
+        for code in read_codes(args.codes):
+            plot_code(code, years, use_cache=not args.no_cache)
+        return
+
+    report = run_batch(args.codes, years, out_path=args.out, fmt=args.format,
+                       workers=args.workers, use_cache=not args.no_cache,
+                       resume=not args.restart)
+    print(f"Строк: {len(report['rows'])} за {report['wall']:.1f} с → {args.out}")
+    print("Время этапов (сумма по кодам): " + ", ".join(
+        f"{stage} {seconds:.1f} с" for stage, seconds in report["timings"].items()))
+    if report["empty"]:
+        print(f"Нет данных по кодам: {', '.join(report['empty'])}")
+    if report["failed"]:
+        print(f"Ошибка расчёта по кодам: {', '.join(report['failed'])}")
+
+
+if __name__ == "__main__":
+    main()
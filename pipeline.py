@@ -0,0 +1,144 @@
+"""
+Конвейер анализа импорта по коду ТН ВЭД
+
+download_by_tnved → mark_friendly → calc_import_metrics_by_year → summarize_trends.
+
+Результаты хранятся в общем для процесса кэше ANALYSIS_CACHE (ключ — код и набор лет),
+поэтому разные сессии Streamlit, анализирующие один код, получают готовый результат.
+Сессии держат только ссылку на AnalysisResult, таблицы не копируются.
+Для диаграмм конвейер один раз строит маленькую таблицу segments (год × сегмент),
+поэтому перерисовка страницы не проходит по строкам исходных данных.
+"""
+
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+import trade_store
+from analysis_cache import ResultCache
+from calc_import_metrics import (calc_import_metrics_by_year, import_metrics_table, records_table,
+                                 segment_aggregates, segment_table)
+from import_ru import download_by_tnved, last_years, mark_friendly
+from trend_engine import summarize_trends
+
+PROC_COLUMNS = ['refYear', 'reporterDesc', 'isFriendly', 'segment', 'primaryValue',
+                'qty', 'qtyUnitCode', 'netWgt', 'partnerDesc']
+
+CACHE_TTL = 6 * 3600
+CACHE_MAX_ENTRIES = 64
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+@dataclass
+class AnalysisResult:
+    """Результат анализа одного кода за набор лет (годы — от старых к новым)"""
+    tnved_code: str
+    years: list
+    df_proc: pd.DataFrame
+    records: list
+    trends: dict
+    segments: pd.DataFrame = field(default_factory=pd.DataFrame)
+    timings: dict = field(default_factory=dict)
+
+    @property
+    def empty(self) -> bool:
+        return self.df_proc.empty
+
+    @property
+    def nbytes(self) -> int:
+        """Оценка занимаемой памяти (для лимита кэша)"""
+        frames = [self.df_proc, self.segments]
+        return int(sum(f.memory_usage(deep=True).sum() for f in frames)) + 64 * 1024
+
+
+STAGES = ["download", "prepare", "metrics", "trends"]
+
+
+def run_analysis(tnved_code: str, years=None, *, use_cache: bool = True,
+                 progress=None, engine=None) -> AnalysisResult:
+    """
+    Выполняет весь конвейер без кэша результатов; timings — время этапов, с.
+    progress(stage, done) — вызывается перед каждым этапом из STAGES (done — доля
+    выполненного, 0..1) и в конце с ("done", 1.0); может прервать расчёт исключением.
+    engine — FetchEngine для загрузки (download_by_tnved).
+    """
+    years = sorted(years or last_years(3))
+    timings = {}
+    report = progress or (lambda stage, done: None)
+
+    report("download", 0.0)
+    started = time.perf_counter()
+    df = download_by_tnved(tnved_code, years, use_cache=use_cache, engine=engine)
+    timings["download"] = time.perf_counter() - started
+
+    report("prepare", 0.7)
+    started = time.perf_counter()
+    df = mark_friendly(df)
+    df_proc = df[PROC_COLUMNS].copy() if not df.empty else pd.DataFrame(columns=PROC_COLUMNS)
+    timings["prepare"] = time.perf_counter() - started
+
+    # один groupby по (год, сегмент) — и для метрик, и для диаграмм
+    report("metrics", 0.8)
+    started = time.perf_counter()
+    agg = segment_aggregates(df_proc, 'refYear')
+    records = calc_import_metrics_by_year(df_proc, years, agg=agg)
+    segments = segment_table(df_proc, years, agg=agg)
+    timings["metrics"] = time.perf_counter() - started
+
+    report("trends", 0.95)
+    started = time.perf_counter()
+    trends = summarize_trends(records)
+    timings["trends"] = time.perf_counter() - started
+    report("done", 1.0)
+
+    return AnalysisResult(tnved_code=str(tnved_code), years=years, df_proc=df_proc,
+                          records=records, trends=trends, segments=segments,
+                          timings=timings)
+
+
+def stored_metrics(codes, years, *, store_dir=None) -> dict:
+    """
+    Метрики по многим кодам только из локального хранилища trade_store — без API:
+    одно чтение с отбором разделов по кодам и годам. {код: записи по годам};
+    коды, которых нет в хранилище, в результат не попадают.
+    """
+    years = sorted(int(y) for y in years)
+    df = trade_store.query([str(c) for c in codes], years, flow_code='X', store_dir=store_dir)
+    if df.empty:
+        return {}
+    df = mark_friendly(df)
+    return {code: calc_import_metrics_by_year(part, years)
+            for code, part in df.groupby("requestCode", sort=False, observed=True)}
+
+
+def stored_import_table(codes, years, *, store_dir=None) -> pd.DataFrame:
+    """
+    Метрики импорта с индексом (code, year) по многим кодам из хранилища trade_store:
+    одно чтение и один groupby, без анализа каждого кода по отдельности.
+    """
+    df = trade_store.query([str(c) for c in codes], [int(y) for y in years], flow_code='X',
+                           store_dir=store_dir)
+    if df.empty:
+        return records_table({})
+    return import_metrics_table(mark_friendly(df), code_col="requestCode")
+
+
+ANALYSIS_CACHE = ResultCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                             max_bytes=CACHE_MAX_BYTES, sizeof=lambda r: r.nbytes)
+
+
+def analysis_key(tnved_code: str, years=None):
+    return str(tnved_code), tuple(sorted(years or last_years(3)))
+
+
+def cached_analysis(tnved_code: str, years=None) -> AnalysisResult:
+    """
+    Результат анализа из общего кэша процесса; при промахе — run_analysis.
+    Пустые результаты (нет данных или API недоступен) не кэшируются.
+    """
+    key = analysis_key(tnved_code, years)
+    return ANALYSIS_CACHE.get_or_compute(
+        key, lambda: run_analysis(key[0], list(key[1])),
+        should_cache=lambda result: not result.empty,
+    )
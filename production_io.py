@@ -0,0 +1,141 @@
+"""
+Чтение CSV с данными производства и потребления
+
+Большие выгрузки Росстата читаются частями (chunksize), каждая часть сразу
+проверяется и переводится в компактные типы, поэтому в памяти не держится
+таблица из строковых объектов целиком:
+- category и code — категориальные (code — строкой, ведущие нули сохраняются);
+- year — int16, флаги presence_* — int8, числа — float64;
+- десятичная запятая («6,5») разбирается наравне с точкой.
+
+Результат кэшируется по SHA-256 содержимого файла: повторная загрузка того же
+файла (в том числе при перерисовке страницы Streamlit) не разбирает его заново.
+"""
+
+import hashlib
+import io
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from analysis_cache import ResultCache
+
+REQUIRED_COLUMNS = ['category', 'year', 'manufacture', 'consumption', 'code']
+CATEGORICAL_COLUMNS = ['category', 'code']
+FLOAT_COLUMNS = ['manufacture', 'consumption', 'actual_duty_rate', 'wto_duty_rate']
+FLAG_PREFIX = 'presence_'
+
+CHUNK_ROWS = 100_000
+CACHE_MAX_ENTRIES = 16
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+PRODUCTION_CACHE = ResultCache(max_entries=CACHE_MAX_ENTRIES, ttl=24 * 3600,
+                               max_bytes=CACHE_MAX_BYTES,
+                               sizeof=lambda df: int(df.memory_usage(deep=True).sum()))
+
+
+def _numbers(values: pd.Series, column: str, first_row: int) -> pd.Series:
+    """Строки -> числа (десятичная запятая допускается); нечисловые значения — ошибка"""
+    if pd.api.types.is_numeric_dtype(values):
+        # колонку без запятых парсер уже прочитал числами
+        return values.astype('float64')
+    text = values.astype(str).where(values.notna()).str.replace(' ', '', regex=False).str.replace(',', '.', regex=False)
+    try:
+        # быстрый путь: приведение строк без Python-цикла
+        return text.astype('float64')
+    except (ValueError, TypeError):
+        pass
+    numbers = pd.to_numeric(text, errors='coerce')
+    bad = numbers.isna() & text.fillna('').ne('')
+    if bad.any():
+        position = int(bad.to_numpy().argmax())
+        raise ValueError(f"Колонка {column}, строка {first_row + position}: "
+                         f"не число '{values.iloc[position]}'")
+    return numbers
+
+
+def _convert(chunk: pd.DataFrame, first_row: int) -> pd.DataFrame:
+    """Проверка и приведение типов одной части файла"""
+    out = {}
+    for column in chunk.columns:
+        values = chunk[column]
+        if column in CATEGORICAL_COLUMNS:
+            out[column] = values
+        elif column == 'year':
+            years = _numbers(values, column, first_row)
+            if years.isna().any():
+                position = int(years.isna().to_numpy().argmax())
+                raise ValueError(f"Колонка year, строка {first_row + position}: год не указан")
+            out[column] = years.astype('int16')
+        elif column in FLOAT_COLUMNS:
+            out[column] = _numbers(values, column, first_row)
+        elif column.startswith(FLAG_PREFIX):
+            out[column] = _numbers(values, column, first_row).fillna(0).astype('int8')
+        else:
+            out[column] = values
+    return pd.DataFrame(out, index=chunk.index)
+
+
+def _concat(parts) -> pd.DataFrame:
+    """Склейка частей; категориальные колонки объединяются без перевода в строки"""
+    if len(parts) == 1:
+        return parts[0].reset_index(drop=True)
+    columns = {}
+    for column in parts[0].columns:
+        if column in CATEGORICAL_COLUMNS:
+            columns[column] = pd.Series(
+                union_categoricals([p[column] for p in parts], sort_categories=True))
+        else:
+            columns[column] = pd.concat([p[column] for p in parts], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def read_production(source, *, chunksize=CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Читает CSV производства частями.
+
+    Args:
+        source: путь, файловый объект или bytes
+        chunksize: строк в одной части
+
+    Returns:
+        pd.DataFrame: компактная типизированная таблица
+
+    Raises:
+        ValueError: нет обязательных колонок или значения не разбираются
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        # числа парсер читает сам; колонки с десятичной запятой придут строками
+        reader = pd.read_csv(source, dtype={c: 'category' for c in CATEGORICAL_COLUMNS},
+                             chunksize=chunksize, skipinitialspace=True)
+    except pd.errors.EmptyDataError:
+        raise ValueError("Файл не содержит данных") from None
+
+    parts = []
+    first_row = 2   # номер строки файла с учётом заголовка
+    for chunk in reader:
+        if not parts:
+            missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+            if missing:
+                raise ValueError(f"Отсутствуют необходимые колонки: {missing}")
+        parts.append(_convert(chunk, first_row))
+        first_row += len(chunk)
+
+    if not parts:
+        raise ValueError("Файл не содержит данных")
+    return _concat(parts)
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_production(data: bytes, *, chunksize=CHUNK_ROWS) -> pd.DataFrame:
+    """
+    read_production с кэшем по содержимому файла.
+    Таблица общая для всех обращений — изменять её на месте нельзя.
+    """
+    return PRODUCTION_CACHE.get_or_compute(
+        file_hash(data), lambda: read_production(data, chunksize=chunksize))
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Пакетные рекомендации GigaChat по списку кодов ТН ВЭД
+
+Для каждого кода собирается запрос (llm.prompt_builder): метрики импорта из
+хранилища trade_store, тренды, метрики производства (если передан CSV) и итоги
+локальной проверки критериев (rules_engine). По умолчанию в GigaChat уходят
+только коды, по которым проверка выдала хотя бы одну меру (--all — все коды).
+
+Запросы выполняются асинхронно:
+- не больше --concurrency одновременно (asyncio.Semaphore);
+- общий ограничитель частоты: не больше --rpm запросов в минуту, включая повторы;
+- таймаут на попытку и повторы с экспоненциальной задержкой при таймауте,
+  сетевой ошибке, 429 и 5xx;
+- каждый ответ сразу дописывается в JSONL (--out), поэтому прерванный запуск
+  продолжается с того же места: коды, для которых уже есть ответ на тот же
+  запрос, пропускаются; если метрики кода изменились, запрос выполняется заново.
+
+Адрес API задаётся так же, как в приложении (GIGACHAT_BASE_URL, GIGACHAT_AUTH_URL),
+поэтому пакет проверяется на локальной заглушке GigaChat.
+
+Запуск:
+    python recommend.py codes.txt --years 3 --production data_for_metrics.csv
+    python recommend.py 842810,847290 --all --concurrency 4 --rpm 30
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+import httpx
+import pandas as pd
+from gigachat.exceptions import RateLimitError, ServerError
+
+from batch_ingest import read_codes
+from calc_import_metrics import IMPORT_METRICS, ImportYearMetrics
+from calc_man_metrics import calculate_man_metrics
+from import_ru import last_years
+from llm.llm_answer import MODEL, cache_key, create_client
+from llm.prompt_builder import build_prompt
+from pipeline import stored_import_table
+from production_io import read_production
+from rules_engine import evaluate as evaluate_rules
+from trend_engine import summarize_trends
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_PATH = os.path.join("data", "results", "recommendations.jsonl")
+CONCURRENCY = 8
+RPM = int(os.getenv("GIGACHAT_RPM", "60"))
+REQUEST_TIMEOUT = 180     # сек на одну попытку
+RETRIES = 3               # повторов после первой неудачи
+BACKOFF = 2.0             # базовая задержка между повторами, сек
+
+RETRY_ERRORS = (asyncio.TimeoutError, httpx.TransportError, RateLimitError, ServerError)
+
+
+class AsyncRateLimiter:
+    """Пропускает не более rpm запросов в минуту (общий для всех задач цикла событий)"""
+
+    def __init__(self, rpm: float = RPM):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._next_at = 0.0
+
+    async def wait(self):
+        # задачи выполняются в одном потоке, поэтому блокировка не нужна
+        now = time.monotonic()
+        start_at = max(now, self._next_at)
+        self._next_at = start_at + self.interval
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
+
+
+def _records(rows: pd.DataFrame) -> list:
+    """Записи ImportYearMetrics по строкам таблицы (year × метрики) одного кода"""
+    return [ImportYearMetrics(year=int(year), **{m: float(row[m]) for m in IMPORT_METRICS})
+            for year, row in rows.sort_index().iterrows()]
+
+
+def build_prompts(codes, years, *, production=None, import_table=None, store_dir=None,
+                  only_measures=True):
+    """
+    Запросы по кодам.
+
+    Args:
+        production: таблица производства (production_io.read_production) или None
+        import_table: метрики импорта с индексом (code, year); по умолчанию —
+                      из хранилища trade_store
+        only_measures: только коды, по которым rules_engine выдал хотя бы одну меру
+
+    Returns:
+        tuple: ({код: Prompt}, {код: причина пропуска})
+    """
+    codes = read_codes(codes)
+    years = sorted(int(y) for y in years)
+    if import_table is None:
+        import_table = stored_import_table(codes, years, store_dir=store_dir)
+    import_table = import_table[import_table.index.get_level_values(1).isin(years)]
+    rules = evaluate_rules(import_table, production, year=years[-1]) if len(import_table) else None
+    issued = set(rules.codes_with_measures()) if rules is not None else set()
+    known = set(import_table.index.get_level_values(0))
+    production_codes = (production["code"].astype(str).str.strip()
+                        if production is not None else None)
+
+    prompts, skipped = {}, {}
+    for code in codes:
+        if code not in known:
+            skipped[code] = "нет данных импорта"
+            continue
+        if only_measures and code not in issued:
+            skipped[code] = "меры не выданы"
+            continue
+        records = _records(import_table.xs(code, level=0))
+        production_metrics = None
+        if production_codes is not None and (production_codes == code).any():
+            production_metrics = calculate_man_metrics(production[(production_codes == code).to_numpy()],
+                                                       import_table=import_table)
+        prompts[code] = build_prompt(code, records[-1]["year"], records[-1], summarize_trends(records),
+                                     production_metrics, rules=rules.explain(code))
+    return prompts, skipped
+
+
+def read_results(path) -> dict:
+    """{код: запись} из файла результатов; недописанная последняя строка пропускается"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Повреждённая строка результатов пропущена")
+                continue
+            done[item["code"]] = item
+    return done
+
+
+async def _ask(client, prompt, limiter, *, timeout, retries, backoff):
+    """Ответ модели с повторами; (текст, токенов по данным API)"""
+    for attempt in range(retries + 1):
+        await limiter.wait()
+        try:
+            resp = await asyncio.wait_for(client.achat(prompt.payload()), timeout)
+            usage = getattr(resp, "usage", None)
+            return resp.choices[0].message.content, getattr(usage, "total_tokens", None)
+        except RETRY_ERRORS as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.info("Попытка %d не удалась (%s), повтор через %.1f с",
+                        attempt + 1, type(e).__name__, delay)
+            await asyncio.sleep(delay)
+
+
+async def run_prompts(prompts, *, out_path=OUTPUT_PATH, concurrency=CONCURRENCY, rpm=RPM,
+                      timeout=REQUEST_TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                      model=MODEL, resume=True, client=None):
+    """
+    Отправляет запросы {код: Prompt} и дописывает ответы в out_path (JSONL).
+
+    Returns:
+        dict: results ({код: запись} по всем кодам prompts с ответом),
+              failed ({код: ошибка}), reused (коды, взятые из прошлого запуска)
+    """
+    done = read_results(out_path) if resume else {}
+    if not resume and os.path.exists(out_path):
+        os.remove(out_path)
+    keys = {code: cache_key(prompt, model) for code, prompt in prompts.items()}
+    todo = [code for code in prompts if done.get(code, {}).get("key") != keys[code]]
+    reused = [code for code in prompts if code not in todo]
+    if reused:
+        logger.info("Файл %s: уже есть ответы по %d кодам", out_path, len(reused))
+
+    failed = {}
+    if todo:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        semaphore = asyncio.Semaphore(concurrency)
+        limiter = AsyncRateLimiter(rpm)
+        own_client = client is None
+        client = client or create_client(model, max_connections=concurrency)
+
+        async def one(i, code, out):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    answer, total_tokens = await _ask(client, prompts[code], limiter, timeout=timeout,
+                                                      retries=retries, backoff=backoff)
+                except Exception as e:
+                    failed[code] = str(e) or type(e).__name__
+                    logger.warning("[%d/%d] %s: ошибка %s", i, len(todo), code, failed[code])
+                    return
+                item = {
+                    "code": code,
+                    "key": keys[code],
+                    "answer": answer,
+                    "prompt_tokens": prompts[code].tokens,
+                    "total_tokens": total_tokens,
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                }
+                out.write(json.dumps(item, ensure_ascii=False) + "\n")
+                out.flush()
+                done[code] = item
+                logger.info("[%d/%d] %s: готово", i, len(todo), code)
+
+        try:
+            with open(out_path, "a", encoding="utf-8") as out:
+                await asyncio.gather(*(one(i, code, out) for i, code in enumerate(todo, 1)))
+        finally:
+            if own_client:
+                await client.aclose()
+
+    results = {code: done[code] for code in prompts if code in done and code not in failed}
+    return {"results": results, "failed": failed, "reused": reused}
+
+
+def run_batch(codes, years, *, production=None, import_table=None, store_dir=None,
+              only_measures=True, **options):
+    """
+    Рекомендации по списку кодов: запросы + асинхронная отправка.
+    options — параметры run_prompts (out_path, concurrency, rpm, timeout, retries, resume, ...).
+
+    Returns:
+        dict: как run_prompts, плюс skipped ({код: причина}) и wall (общее время, с)
+    """
+    started = time.perf_counter()
+    prompts, skipped = build_prompts(codes, years, production=production, import_table=import_table,
+                                     store_dir=store_dir, only_measures=only_measures)
+    report = asyncio.run(run_prompts(prompts, **options))
+    report["skipped"] = skipped
+    report["wall"] = time.perf_counter() - started
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетные рекомендации GigaChat по кодам ТН ВЭД")
+    parser.add_argument("codes", help="файл со списком кодов или коды через запятую")
+    parser.add_argument("--years", type=int, default=3, help="сколько лет в окне")
+    parser.add_argument("--end-year", type=int, help="последний год окна (по умолчанию — прошлый год)")
+    parser.add_argument("--production", help="CSV производства и потребления (data_for_metrics.csv)")
+    parser.add_argument("--store", help="каталог хранилища trade_store")
+    parser.add_argument("--out", default=OUTPUT_PATH, help="файл результатов (JSONL)")
+    parser.add_argument("--all", action="store_true", help="все коды, а не только с выданными мерами")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="одновременных запросов")
+    parser.add_argument("--rpm", type=float, default=RPM, help="запросов в минуту")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="таймаут попытки, с")
+    parser.add_argument("--retries", type=int, default=RETRIES, help="повторов после неудачи")
+    parser.add_argument("--restart", action="store_true", help="не продолжать с прошлого запуска")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)   # без строки на каждый HTTP-запрос
+    end_year = args.end_year or last_years(1)[0]
+    years = list(range(end_year - args.years + 1, end_year + 1))
+    production = read_production(args.production) if args.production else None
+
+    report = run_batch(args.codes, years, production=production, store_dir=args.store,
+                       only_measures=not args.all, out_path=args.out, concurrency=args.concurrency,
+                       rpm=args.rpm, timeout=args.timeout, retries=args.retries,
+                       resume=not args.restart)
+    print(f"Ответов: {len(report['results'])} (из прошлого запуска: {len(report['reused'])}) "
+          f"за {report['wall']:.1f} с → {args.out}")
+    if report["skipped"]:
+        reasons = pd.Series(report["skipped"]).value_counts().to_dict()
+        print(f"Пропущено кодов: {len(report['skipped'])} {reasons}")
+    if report["failed"]:
+        print(f"Ошибка по кодам: {', '.join(report['failed'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Локальная проверка критериев мер ТТП №1–6
+
+Критерии из llm/prompt.py проверяются детерминированно и сразу для всех кодов:
+метрики импорта по парам (код, год) и данные производства (data_for_metrics.csv:
+производство, потребление, ставки ЕТТ и ВТО, флаги ПП № 1875, техрегламентов
+и Приказа № 4114) сводятся в таблицу признаков «код × признак», а каждый
+критерий — векторное сравнение колонок этой таблицы.
+
+Результат критерия — True / False / NA («нет данных»); мера выдаётся, только если
+все её критерии выполнены. Мера №6 — по остаточному принципу: импорт больше
+производства, производство снижается и не выдана ни одна из мер №1–5
+(без учёта критерия роста импорта меры №5 — критерии «объёма импорта»
+в остаточном условии не учитываются).
+
+Так LLM нужна только для текста обоснования по кодам, где мера выдана.
+"""
+
+from dataclasses import dataclass
+from string import Formatter
+
+import numpy as np
+import pandas as pd
+
+from trend_engine import LABEL_NEGATIVE, LABEL_POSITIVE, trend_labels
+
+SHARE_UNFRIENDLY_THRESHOLD = 0.30
+SELF_SUFFICIENCY_THRESHOLD = 1.0
+PERIOD_YEARS = 3   # «предыдущий трёхлетний период» для мер №3
+EPS = 0.02         # порог «стабильно» для изменения год к году, как в trend_engine
+
+MEASURES = {
+    1: "Повышение ставки таможенной пошлины до уровня связывания в рамках ВТО",
+    2: "Повышение ставки таможенной пошлины до 35-50% (контрсанкционное регулирование)",
+    3: "Инициирование антидемпингового расследования в отношении экспортёров из Китая",
+    4: "Преференциальный режим в рамках государственных закупок",
+    5: "Применение сертификации соответствия к импортируемому товару",
+    6: "Иные меры защиты рынка (запрет или квотирование импорта, промышленный сбор, лицензирование)",
+}
+
+# (мера, критерий, описание, фактические значения — поля таблицы признаков)
+CRITERIA = [
+    (1, "wto_headroom", "Ставка ЕТТ ниже связанной ставки ВТО",
+     "ЕТТ {actual_duty_rate:.1f}%, ВТО {wto_duty_rate:.1f}%"),
+    (1, "share_unfriendly_low_falling", "Доля НС меньше 30% и снижается",
+     "{share_unfriendly:.1%}, годом ранее {share_unfriendly_prev:.1%}"),
+    (1, "self_sufficient", "Производство покрывает потребление", "самообеспеченность {self_sufficiency:.3f}"),
+    (2, "share_unfriendly_high_not_falling", "Доля НС больше 30%, стабильна или растёт",
+     "{share_unfriendly:.1%}, годом ранее {share_unfriendly_prev:.1%}"),
+    (2, "self_sufficient", "Производство покрывает потребление", "самообеспеченность {self_sufficiency:.3f}"),
+    (3, "share_china_rising", "Доля Китая растёт по сравнению с тремя предыдущими годами",
+     "{share_china:.1%}, в среднем за период {share_china_period:.1%}"),
+    (3, "dumping", "Цена из Китая ниже цены прочих стран", "отношение цен {price_diff_ratio:.3f}"),
+    (3, "production_falling_period", "Производство сократилось за период (год + 3 предыдущих)",
+     "{manufacture:,.0f} против {manufacture_start:,.0f} млн $"),
+    (4, "in_pp1875", "Товар в приложениях к ПП РФ № 1875", ""),
+    (4, "self_sufficient", "Производство покрывает потребление", "самообеспеченность {self_sufficiency:.3f}"),
+    (5, "requires_certification", "Сертификация требуется техрегламентами ЕАЭС / ПП РФ № 2425", ""),
+    (5, "not_in_order_4114", "Товара нет в Приказе Минпромторга № 4114", ""),
+    (5, "import_rising", "Импорт растёт", "{import_total:,.0f} против {import_total_prev:,.0f} $"),
+    (5, "production_rising", "Производство растёт", "{manufacture:,.0f} против {manufacture_prev:,.0f} млн $"),
+    (5, "self_sufficient", "Производство покрывает потребление", "самообеспеченность {self_sufficiency:.3f}"),
+    (6, "import_exceeds_production", "Импорт больше производства",
+     "{import_total:,.0f} $ против {manufacture_usd:,.0f} $"),
+    (6, "production_falling", "Производство снижается", "{manufacture:,.0f} против {manufacture_prev:,.0f} млн $"),
+    (6, "no_other_measure", "Не выдана ни одна из мер №1–5 (без учёта роста импорта)", ""),
+]
+
+FLAG_COLUMNS = {
+    "in_pp1875": "presence_in_the_RF_PP_1875",
+    "requires_certification": "presence_in_technical_regulations",
+    "in_order_4114": "presence_in_the_Order_of_MIT_Russia",
+}
+
+
+def _code_keys(codes: pd.Series) -> pd.Series:
+    # 842810.0 (после чтения CSV с пропусками) -> '842810'
+    keys = codes.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    return keys.where(codes.notna())
+
+
+def _wide(series: pd.Series, years) -> pd.DataFrame:
+    """Серия с индексом (code, year) -> таблица «код × год» по нужным годам"""
+    return series.unstack("year").reindex(columns=years)
+
+
+def rule_features(import_table: pd.DataFrame, production: pd.DataFrame | None = None,
+                  year=None) -> pd.DataFrame:
+    """
+    Таблица признаков «код × признак» за год year.
+
+    Args:
+        import_table: метрики импорта с индексом (code, year)
+                      (calc_import_metrics.import_metrics_table / records_table)
+        production: таблица производства (production_io.read_production):
+                    category, code, year, manufacture, consumption (млн $),
+                    actual_duty_rate, wto_duty_rate, presence_*
+        year: год оценки (по умолчанию — последний год import_table)
+    """
+    imports = import_table.copy()
+    imports.index = pd.MultiIndex.from_arrays(
+        [_code_keys(imports.index.get_level_values(0).to_series()).to_numpy(),
+         imports.index.get_level_values(1).astype(int)], names=["code", "year"])
+    year = int(year if year is not None else imports.index.get_level_values("year").max())
+    years = list(range(year - PERIOD_YEARS, year + 1))
+
+    share_unfriendly = _wide(imports["share_unfriendly"], years)
+    share_china = _wide(imports["share_china"], years)
+    import_total = _wide(imports["import_total"], years)
+    features = pd.DataFrame({
+        "share_unfriendly": share_unfriendly[year],
+        "share_unfriendly_prev": share_unfriendly[year - 1],
+        "share_china": share_china[year],
+        # среднее за доступные годы предыдущего трёхлетнего периода
+        "share_china_period": share_china[years[:-1]].mean(axis=1),
+        "price_diff_ratio": _wide(imports["price_diff_ratio"], [year])[year],
+        "import_total": import_total[year],
+        "import_total_prev": import_total[year - 1],
+    })
+
+    if production is not None and len(production):
+        prod = pd.DataFrame({
+            "code": _code_keys(production["code"].astype(object)).to_numpy(),
+            "year": production["year"].astype(int).to_numpy(),
+            "manufacture": pd.to_numeric(production["manufacture"], errors="coerce").to_numpy(dtype=float),
+            "consumption": pd.to_numeric(production["consumption"], errors="coerce").to_numpy(dtype=float),
+        })
+        for column in ("actual_duty_rate", "wto_duty_rate", *FLAG_COLUMNS.values()):
+            if column in production.columns:
+                prod[column] = pd.to_numeric(production[column], errors="coerce").to_numpy(dtype=float)
+        by_code_year = prod.dropna(subset=["code"]).groupby(["code", "year"])
+        # у кода может быть несколько категорий: объёмы суммируются, ставки усредняются,
+        # флаг выставлен, если он есть хотя бы у одной категории
+        agg = by_code_year.agg({column: ("sum" if column in ("manufacture", "consumption")
+                                         else "max" if column in FLAG_COLUMNS.values() else "mean")
+                                for column in prod.columns if column not in ("code", "year")})
+        manufacture = _wide(agg["manufacture"], years)
+        consumption = _wide(agg["consumption"], years)
+        current = agg.xs(year, level="year") if year in agg.index.get_level_values("year") \
+            else agg.iloc[0:0].droplevel("year")
+        production_features = pd.DataFrame({
+            "manufacture": manufacture[year],
+            "manufacture_prev": manufacture[year - 1],
+            # первый доступный год периода (год + 3 предыдущих)
+            "manufacture_start": manufacture[years[:-1]].bfill(axis=1).iloc[:, 0],
+            "consumption": consumption[year],
+        })
+        for column in ("actual_duty_rate", "wto_duty_rate"):
+            production_features[column] = current[column] if column in current.columns else np.nan
+        for name, column in FLAG_COLUMNS.items():
+            production_features[name] = current[column] if column in current.columns else np.nan
+        features = features.join(production_features, how="outer")
+    else:
+        for column in ("manufacture", "manufacture_prev", "manufacture_start", "consumption",
+                       "actual_duty_rate", "wto_duty_rate", *FLAG_COLUMNS):
+            features[column] = np.nan
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        features["self_sufficiency"] = np.where(features["consumption"] > 0,
+                                                features["manufacture"] / features["consumption"], np.nan)
+    features["manufacture_usd"] = features["manufacture"] * 1_000_000
+    features["wto_headroom"] = features["wto_duty_rate"] - features["actual_duty_rate"]
+    features.index.name = "code"
+    features.attrs["year"] = year
+    return features
+
+
+def _known(values, *columns):
+    """Результат сравнения как nullable boolean: NA, если нет хотя бы одного из значений"""
+    result = pd.Series(np.asarray(values, dtype=bool), index=columns[0].index, dtype="boolean")
+    missing = np.zeros(len(result), dtype=bool)
+    for column in columns:
+        missing |= column.isna().to_numpy()
+    result[missing] = pd.NA
+    return result
+
+
+def _change_label(current, previous):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = np.where(previous != 0, (current - previous) / previous, np.nan)
+    return trend_labels(delta, EPS)
+
+
+def evaluate_criteria(features: pd.DataFrame) -> pd.DataFrame:
+    """Все критерии: колонки (мера, критерий), значения True / False / NA"""
+    f = features
+    share_change = _change_label(f["share_unfriendly"].to_numpy(), f["share_unfriendly_prev"].to_numpy())
+    import_change = _change_label(f["import_total"].to_numpy(), f["import_total_prev"].to_numpy())
+    production_change = _change_label(f["manufacture"].to_numpy(), f["manufacture_prev"].to_numpy())
+    period_change = _change_label(f["manufacture"].to_numpy(), f["manufacture_start"].to_numpy())
+    china_change = _change_label(f["share_china"].to_numpy(), f["share_china_period"].to_numpy())
+
+    self_sufficient = _known(f["self_sufficiency"] >= SELF_SUFFICIENCY_THRESHOLD, f["self_sufficiency"])
+    values = {
+        "wto_headroom": _known(f["wto_headroom"] > 0, f["wto_headroom"]),
+        "share_unfriendly_low_falling": _known(
+            (f["share_unfriendly"] < SHARE_UNFRIENDLY_THRESHOLD) & (share_change == LABEL_NEGATIVE),
+            f["share_unfriendly"], f["share_unfriendly_prev"]),
+        "share_unfriendly_high_not_falling": _known(
+            (f["share_unfriendly"] > SHARE_UNFRIENDLY_THRESHOLD) & (share_change != LABEL_NEGATIVE),
+            f["share_unfriendly"], f["share_unfriendly_prev"]),
+        "self_sufficient": self_sufficient,
+        "share_china_rising": _known(china_change == LABEL_POSITIVE,
+                                     f["share_china"], f["share_china_period"]),
+        "dumping": _known(f["price_diff_ratio"] < 1.0, f["price_diff_ratio"]),
+        "production_falling_period": _known(period_change == LABEL_NEGATIVE,
+                                            f["manufacture"], f["manufacture_start"]),
+        "in_pp1875": _known(f["in_pp1875"] > 0, f["in_pp1875"]),
+        "requires_certification": _known(f["requires_certification"] > 0, f["requires_certification"]),
+        "not_in_order_4114": _known(f["in_order_4114"] == 0, f["in_order_4114"]),
+        "import_rising": _known(import_change == LABEL_POSITIVE, f["import_total"], f["import_total_prev"]),
+        "production_rising": _known(production_change == LABEL_POSITIVE,
+                                    f["manufacture"], f["manufacture_prev"]),
+        "import_exceeds_production": _known(f["import_total"] > f["manufacture_usd"],
+                                            f["import_total"], f["manufacture_usd"]),
+        "production_falling": _known(production_change == LABEL_NEGATIVE,
+                                     f["manufacture"], f["manufacture_prev"]),
+    }
+
+    criteria = pd.DataFrame({(measure, name): values[name]
+                             for measure, name, _, _ in CRITERIA if name in values}, index=f.index)
+    # мера №6: остальные меры без критерия «объёма импорта» (рост импорта у меры №5)
+    other = pd.Series(False, index=f.index)
+    for measure in range(1, 6):
+        columns = [c for c in criteria.columns if c[0] == measure and c[1] != "import_rising"]
+        other |= criteria[columns].fillna(False).all(axis=1).astype(bool)
+    criteria[(6, "no_other_measure")] = pd.array(~other.to_numpy(), dtype="boolean")
+    criteria.columns = pd.MultiIndex.from_tuples(criteria.columns, names=["measure", "criterion"])
+    return criteria
+
+
+def measures_from_criteria(criteria: pd.DataFrame) -> pd.DataFrame:
+    """Меры «код × мера»: True, если все критерии меры выполнены (NA — не выполнен)"""
+    passed = criteria.fillna(False).astype(bool)
+    return pd.DataFrame({measure: passed.xs(measure, axis=1, level="measure").all(axis=1)
+                         for measure in MEASURES}, index=criteria.index)
+
+
+@dataclass
+class RulesResult:
+    """Результат проверки критериев для набора кодов"""
+    year: int
+    features: pd.DataFrame   # код × признак
+    criteria: pd.DataFrame   # код × (мера, критерий): True / False / NA
+    measures: pd.DataFrame   # код × мера: bool
+
+    def codes_with_measures(self) -> list:
+        """Коды, по которым выдана хотя бы одна мера"""
+        return self.measures.index[self.measures.any(axis=1)].tolist()
+
+    def table(self) -> pd.DataFrame:
+        """Длинная таблица: code, measure, criterion, description, status (True / False / NA)"""
+        long = self.criteria.stack(["measure", "criterion"], future_stack=True).rename("status")
+        long = long.reset_index()
+        titles = pd.Series({(measure, name): title for measure, name, title, _ in CRITERIA})
+        long.insert(3, "description", titles.reindex(
+            pd.MultiIndex.from_frame(long[["measure", "criterion"]])).to_numpy())
+        return long
+
+    def explain(self, code) -> list:
+        """Пояснения по коду: строка на меру и по строке на критерий с фактическими значениями"""
+        code = str(code)
+        values = self.features.loc[code].to_dict()
+        lines = []
+        for measure, title in MEASURES.items():
+            verdict = "выдаётся" if self.measures.at[code, measure] else "не выдаётся"
+            lines.append(f"Мера №{measure} ({title}): {verdict}")
+            for m, name, description, detail in CRITERIA:
+                if m != measure:
+                    continue
+                status = self.criteria.at[code, (measure, name)]
+                mark = "нет данных" if pd.isna(status) else "выполнен" if status else "не выполнен"
+                detail = _detail(detail, values)
+                lines.append(f"  - {description}{f' ({detail})' if detail else ''}: {mark}")
+        return lines
+
+
+def _detail(template, values):
+    """Фактические значения для пояснения; пусто, если какого-то значения нет"""
+    fields = [name for _, name, _, _ in Formatter().parse(template) if name]
+    if any(pd.isna(values.get(name)) for name in fields):
+        return ""
+    return template.format(**values)
+
+
+def evaluate(import_table: pd.DataFrame, production: pd.DataFrame | None = None,
+             year=None) -> RulesResult:
+    """
+    Проверка мер №1–6 по всем кодам import_table (и кодам из production).
+
+    Returns:
+        RulesResult: признаки, критерии и меры по кодам за год оценки
+    """
+    features = rule_features(import_table, production, year)
+    criteria = evaluate_criteria(features)
+    return RulesResult(year=features.attrs["year"], features=features,
+                       criteria=criteria, measures=measures_from_criteria(criteria))
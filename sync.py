@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Инкрементальное обновление хранилища trade_store
+
+Прошлые годы в Comtrade меняются редко, поэтому вместо полной перезагрузки:
+- манифест (<хранилище>/_manifest.json) помнит по каждой паре (код, год),
+  когда она загружена и сколько в ней строк; разделы, записанные в хранилище
+  другими путями (batch_ingest, приложение), берутся из trade_store.inventory
+  со временем записи раздела — их не нужно перезагружать при первом обновлении;
+- по каждому году одним запросом читается доступность данных
+  (_getFinalDataAvailability: дата последнего выпуска по каждому репортёру);
+  пара изменилась, если после нашей загрузки данные выпустил репортёр, строки
+  которого уже есть в паре; если выпускали только другие репортёры (у них могли
+  появиться строки по коду), или доступность получить не удалось, по паре делается
+  дешёвая проба previewCountFinalData и число строк сравнивается с манифестом;
+- перезагружаются только новые и изменившиеся пары, все одновременно (FetchEngine);
+- кэш comtrade_cache обновляется теми же данными, метрики и тренды
+  пересчитываются только для затронутых кодов (main.run_batch с refresh).
+
+Запуск:
+    python sync.py codes.txt --years 3
+    python sync.py codes.txt --metrics data/results/import_metrics.parquet
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+import comtradeapicall
+import pandas as pd
+
+import trade_store
+from batch_ingest import FLOW_CODE, PARTNER_CODE, read_codes
+from comtrade_cache import evict, write_cached
+from comtrade_fetch import FetchEngine, build_request
+from import_ru import last_years
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "_manifest.json"
+
+NEW = "new"              # пары нет в хранилище
+CHANGED = "changed"      # после загрузки вышли новые данные
+UNCHANGED = "unchanged"
+UNKNOWN = "unknown"      # проверить не удалось — считаем изменившейся
+
+
+def manifest_path(store_dir=None) -> str:
+    return os.path.join(store_dir or trade_store.STORE_DIR, MANIFEST_NAME)
+
+
+def _key(code, year) -> str:
+    return f"{code}|{int(year)}"
+
+
+def read_manifest(store_dir=None) -> dict:
+    """{"код|год": {"rows", "fetched_at"}}; пустой словарь, если манифеста нет"""
+    path = manifest_path(store_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, store_dir=None):
+    path = manifest_path(store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _timestamp(value):
+    ts = pd.to_datetime(value, errors="coerce", utc=True)
+    return None if pd.isna(ts) else ts
+
+
+def last_released(years, engine=None) -> dict:
+    """
+    {год: Series «код репортёра → дата последнего выпуска данных»} по данным
+    доступности Comtrade; годы, по которым ответа нет, в словарь не попадают.
+    """
+    engine = engine or FetchEngine(fetch_fn=comtradeapicall._getFinalDataAvailability)
+    requests = [dict(typeCode='C', freqCode='A', clCode='HS', period=str(year), reporterCode=None)
+                for year in years]
+    released = {}
+    for year, data in zip(years, engine.fetch_many(requests)):
+        if data is None or data.empty or not {"reporterCode", "lastReleased"} <= set(data.columns):
+            continue
+        dates = pd.to_datetime(data["lastReleased"], errors="coerce", utc=True)
+        by_reporter = dates.groupby(data["reporterCode"].astype(int).to_numpy()).max().dropna()
+        if not by_reporter.empty:
+            released[int(year)] = by_reporter
+    return released
+
+
+def stored_reporters(pairs, store_dir=None) -> dict:
+    """{(код, год): множество репортёров в хранилище} — одно чтение колонки reporterCode"""
+    codes = sorted({code for code, _ in pairs})
+    years = sorted({year for _, year in pairs})
+    df = trade_store.query(codes, years, columns=["requestCode", "refYear", "reporterCode"],
+                           store_dir=store_dir)
+    if df.empty:
+        return {}
+    df = df.drop_duplicates()
+    return {(code, int(year)): set(part["reporterCode"].astype(int))
+            for (code, year), part in df.groupby(["requestCode", "refYear"])}
+
+
+def probe_counts(pairs, engine=None) -> dict:
+    """{(код, год): число строк в Comtrade} по пробам previewCountFinalData"""
+    engine = engine or FetchEngine(fetch_fn=comtradeapicall.previewCountFinalData)
+    requests = []
+    for code, year in pairs:
+        params = build_request(code, year, flow_code=FLOW_CODE, partner_code=PARTNER_CODE)
+        for name in ("format_output", "includeDesc", "maxRecords"):
+            params.pop(name)
+        requests.append(params)
+    counts = {}
+    for pair, data in zip(pairs, engine.fetch_many(requests)):
+        if data is not None and not data.empty:
+            column = "count" if "count" in data.columns else data.columns[0]
+            counts[pair] = int(data[column].iloc[0])
+    return counts
+
+
+def stored_entries(codes, years, store_dir=None) -> dict:
+    """
+    Записи манифеста по парам, дополненные разделами хранилища: если раздел
+    записан позже, чем отмечено в манифесте, или в манифесте пары нет
+    (раздел записал batch_ingest или приложение), берутся его число строк
+    и время записи. stored — раздел есть на диске.
+    """
+    entries = {key: dict(entry, stored=False) for key, entry in read_manifest(store_dir).items()}
+    stored = trade_store.inventory(store_dir, codes, years)
+    for code, year, rows, updated in stored.itertuples(index=False):
+        key = _key(code, year)
+        written_at = pd.Timestamp(updated, unit="s", tz="UTC")
+        entry = entries.get(key)
+        fetched_at = _timestamp(entry["fetched_at"]) if entry else None
+        if fetched_at is None or written_at > fetched_at:
+            entry = {"rows": int(rows), "fetched_at": written_at.isoformat(timespec="seconds")}
+        entries[key] = dict(entry, stored=True)
+    return entries
+
+
+def plan(codes, years, *, store_dir=None, availability_engine=None, probe_engine=None) -> dict:
+    """
+    Что нужно перезагрузить: {(код, год): NEW / CHANGED / UNCHANGED / UNKNOWN}.
+    Пары из манифеста, которых уже нет на диске, считаются новыми.
+    """
+    entries = stored_entries(codes, years, store_dir)
+    status, known = {}, []
+    for code in codes:
+        for year in years:
+            entry = entries.get(_key(code, year))
+            if entry is None or (entry.get("rows", 0) > 0 and not entry.get("stored")):
+                status[(code, year)] = NEW
+            else:
+                known.append((code, year))
+    if not known:
+        return status
+
+    released = last_released(sorted({year for _, year in known}), availability_engine)
+    reporters = stored_reporters(known, store_dir)
+    to_probe = []
+    for code, year in known:
+        fetched_at = _timestamp(entries[_key(code, year)]["fetched_at"])
+        if year not in released or fetched_at is None:
+            to_probe.append((code, year))
+            continue
+        newer = set(released[year].index[released[year] > fetched_at])
+        if newer & reporters.get((code, year), set()):
+            status[(code, year)] = CHANGED
+        elif newer:
+            to_probe.append((code, year))
+        else:
+            status[(code, year)] = UNCHANGED
+
+    # доступность не получена или выпускали другие репортёры — сверяем число строк
+    if to_probe:
+        counts = probe_counts(to_probe, probe_engine)
+        for pair in to_probe:
+            if pair not in counts:
+                status[pair] = UNKNOWN
+            elif counts[pair] != entries[_key(*pair)]["rows"]:
+                status[pair] = CHANGED
+            else:
+                status[pair] = UNCHANGED
+    return status
+
+
+def sync(codes, years=None, *, store_dir=None, engine=None, force=False,
+         availability_engine=None, probe_engine=None) -> dict:
+    """
+    Загружает только новые и изменившиеся пары (код, год).
+
+    Returns:
+        dict: status (план по парам), fetched (загруженные пары),
+              failed (пары, которые не удалось загрузить), affected (коды с изменениями)
+    """
+    codes = read_codes(codes)
+    years = sorted(int(y) for y in (years or last_years(3)))
+    if force:
+        status = {(code, year): NEW for code in codes for year in years}
+    else:
+        status = plan(codes, years, store_dir=store_dir,
+                      availability_engine=availability_engine, probe_engine=probe_engine)
+    stale = [pair for pair, state in status.items() if state != UNCHANGED]
+    logger.info("Пар (код, год): %d, к загрузке: %d", len(status), len(stale))
+
+    engine = engine or FetchEngine()
+    requests = [build_request(code, year, flow_code=FLOW_CODE, partner_code=PARTNER_CODE)
+                for code, year in stale]
+    manifest = read_manifest(store_dir)
+    fetched, failed, frames = [], [], []
+    for pair, data in zip(stale, engine.fetch_complete(requests)):
+        if data is None:
+            failed.append(pair)
+            continue
+        code, year = pair
+        write_cached(data, code, year, FLOW_CODE, PARTNER_CODE, auto_evict=False)
+        if not data.empty:
+            frames.append(trade_store.with_request_code(data, code))
+        manifest[_key(code, year)] = {"rows": len(data), "fetched_at": _now()}
+        fetched.append(pair)
+
+    if fetched:
+        evict()
+    if frames:
+        trade_store.write(pd.concat(frames, ignore_index=True), store_dir)
+    write_manifest(manifest, store_dir)
+
+    affected = sorted({code for code, _ in fetched})
+    return {"status": status, "fetched": fetched, "failed": failed, "affected": affected}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Инкрементальное обновление хранилища Comtrade")
+    parser.add_argument("codes", help="файл со списком кодов или коды через запятую")
+    parser.add_argument("--years", type=int, default=3, help="сколько последних лет проверять")
+    parser.add_argument("--store", default=trade_store.STORE_DIR, help="каталог хранилища")
+    parser.add_argument("--force", action="store_true", help="перезагрузить всё без проверки")
+    parser.add_argument("--metrics", help="файл результатов main.py: пересчитать затронутые коды")
+    parser.add_argument("--workers", type=int, help="процессов для пересчёта метрик")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    started = time.perf_counter()
+    years = last_years(args.years)
+    report = sync(args.codes, years, store_dir=args.store, force=args.force)
+    counts = pd.Series(report["status"]).value_counts().to_dict() if report["status"] else {}
+    print(f"Проверено пар: {len(report['status'])} {counts}, загружено: {len(report['fetched'])} "
+          f"за {time.perf_counter() - started:.1f} с")
+    if report["failed"]:
+        print("Не удалось загрузить: " + ", ".join(f"{c}/{y}" for c, y in report["failed"]))
+
+    if args.metrics and report["affected"]:
+        from main import WORKERS, run_batch
+        batch = run_batch(args.codes, years, out_path=args.metrics,
+                          workers=args.workers or WORKERS, refresh=report["affected"])
+        print(f"Метрики пересчитаны по кодам: {', '.join(report['affected'])} → {args.metrics} "
+              f"({batch['wall']:.1f} с)")
+
+
+if __name__ == "__main__":
+    main()
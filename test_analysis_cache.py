@@ -0,0 +1,76 @@
+"""
+Проверки ResultCache: LRU/TTL и single-flight
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from analysis_cache import ResultCache
+
+
+class SlowCompute:
+    def __init__(self, value, delay=0.2, error=None):
+        self.value = value
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _ask_concurrently(cache, compute, n=2, should_cache=None):
+    with ThreadPoolExecutor(n) as executor:
+        futures = [executor.submit(cache.get_or_compute, "8528", compute, should_cache) for _ in range(n)]
+        return [future.result() for future in futures]
+
+
+def test_concurrent_requests_compute_once():
+    cache = ResultCache()
+    compute = SlowCompute("result")
+    assert _ask_concurrently(cache, compute, n=5) == ["result"] * 5
+    assert compute.calls == 1
+    assert cache.get("8528") == "result"
+
+
+def test_uncached_result_is_shared_with_waiters():
+    # пустой анализ не кэшируется, но ждавшие его сессии не пересчитывают
+    cache = ResultCache()
+    compute = SlowCompute("")
+    assert _ask_concurrently(cache, compute, should_cache=bool) == ["", ""]
+    assert compute.calls == 1
+    assert cache.get("8528") is None
+    # следующий запрос после завершения считает заново
+    assert cache.get_or_compute("8528", compute, should_cache=bool) == ""
+    assert compute.calls == 2
+
+
+def test_error_is_shared_with_waiters():
+    cache = ResultCache()
+    compute = SlowCompute(None, error=ConnectionError("Comtrade недоступен"))
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(cache.get_or_compute, "8528", compute) for _ in range(3)]
+        for future in futures:
+            with pytest.raises(ConnectionError):
+                future.result()
+    assert compute.calls == 1
+
+
+def test_lru_and_ttl():
+    cache = ResultCache(max_entries=2, ttl=0.1)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+    time.sleep(0.15)
+    assert cache.get("a") is None
@@ -0,0 +1,42 @@
+"""
+Проверки соединения производства с импортом по кодам ТН ВЭД разной длины
+"""
+
+import logging
+
+import pandas as pd
+
+from calc_man_metrics import calculate_man_metrics
+
+
+def _production(codes):
+    return pd.DataFrame({"category": [f"cat{code}" for code in codes], "year": 2023,
+                         "manufacture": 1.0, "consumption": 2.0, "code": codes})
+
+
+def _imports(totals):
+    index = pd.MultiIndex.from_tuples([(code, 2023) for code in totals], names=["code", "year"])
+    return pd.DataFrame({"import_total": list(totals.values())}, index=index)
+
+
+def test_subheading_gets_import_of_its_heading():
+    metrics = calculate_man_metrics(_production(["842810"]),
+                                    import_table=_imports({"8428": 5e6, "84": 9e6}))
+    assert metrics["cat842810"][2023]["import_total"] == 5e6
+    assert metrics["cat842810"][2023]["import_matched"]
+
+
+def test_heading_sums_its_subheadings():
+    metrics = calculate_man_metrics(_production(["8428"]),
+                                    import_table=_imports({"842810": 2e6, "842820": 3e6}))
+    assert metrics["cat8428"][2023]["import_total"] == 5e6
+
+
+def test_unmatched_code_is_marked_and_logged(caplog):
+    with caplog.at_level(logging.WARNING, logger="calc_man_metrics"):
+        metrics = calculate_man_metrics(_production(["8428", "8517"]),
+                                        import_table=_imports({"8428": 5e6}))
+    assert metrics["cat8517"][2023]["import_total"] == 0
+    assert not metrics["cat8517"][2023]["import_matched"]
+    assert metrics["cat8428"][2023]["import_matched"]
+    assert "8517" in caplog.text
@@ -0,0 +1,42 @@
+"""
+Проверки дискового кэша Comtrade: запись, вытеснение и уборка временных файлов
+"""
+
+import os
+import time
+
+import pandas as pd
+
+import comtrade_cache
+
+
+def _frame():
+    return pd.DataFrame({"refYear": [2020], "primaryValue": [1.0]})
+
+
+def test_eviction_is_throttled_between_writes(tmp_path, monkeypatch):
+    scans = []
+    original = comtrade_cache.evict
+    monkeypatch.setattr(comtrade_cache, "evict", lambda **kw: scans.append(kw) or original(**kw))
+    comtrade_cache._last_evict.pop(str(tmp_path), None)
+    for code in range(20):
+        comtrade_cache.write_cached(_frame(), code, 2020, "X", "643", cache_dir=str(tmp_path))
+    assert len(scans) == 1
+    comtrade_cache.write_cached(_frame(), 99, 2020, "X", "643", cache_dir=str(tmp_path), auto_evict=False)
+    assert len(scans) == 1
+
+
+def test_evict_removes_stale_temporary_files(tmp_path):
+    stale = tmp_path / "tmpabc.tmp"
+    fresh = tmp_path / "tmpdef.tmp"
+    stale.write_bytes(b"partial")
+    fresh.write_bytes(b"partial")
+    old = time.time() - comtrade_cache.TMP_MAX_AGE - 60
+    os.utime(stale, (old, old))
+    comtrade_cache.write_cached(_frame(), "8528", 2020, "X", "643", cache_dir=str(tmp_path),
+                                auto_evict=False)
+
+    assert comtrade_cache.evict(cache_dir=str(tmp_path)) == 1
+    assert not stale.exists()
+    assert fresh.exists()
+    assert comtrade_cache.read_cached("8528", 2020, "X", "643", cache_dir=str(tmp_path)) is not None
@@ -0,0 +1,124 @@
+"""
+Проверки FetchEngine на локальной заглушке previewFinalData (без обращения к API)
+"""
+
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from comtrade_fetch import FetchEngine, RateLimiter, build_request
+
+
+def _engine(fetch_fn, **options):
+    options = {"timeout": 1.0, "retries": 2, "backoff": 0.0, "limiter": RateLimiter(0), **options}
+    return FetchEngine(fetch_fn, **options)
+
+
+def _frame(params, rows=1):
+    return pd.DataFrame({"refYear": [int(params["period"])] * rows, "cmdCode": params["cmdCode"],
+                         "reporterCode": range(rows)})
+
+
+class FakePreview:
+    """Заглушка previewFinalData: сначала fail_first ошибок, затем ответы"""
+
+    def __init__(self, fail_first=0, delay=0.0, result=None):
+        self.fail_first = fail_first
+        self.delay = delay
+        self.result = result
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, **params):
+        with self._lock:
+            self.calls.append(params)
+            attempt = len(self.calls)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if attempt <= self.fail_first:
+                raise ConnectionError("fake 503")
+            return self.result(params) if self.result else _frame(params)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_fetch_one_retries_until_success():
+    fake = FakePreview(fail_first=2)
+    data = _engine(fake).fetch_one(build_request("8528", 2023))
+    assert len(fake.calls) == 3
+    assert data["refYear"].tolist() == [2023]
+
+
+def test_fetch_one_gives_up_after_retries():
+    fake = FakePreview(fail_first=10)
+    assert _engine(fake, retries=1).fetch_one(build_request("8528", 2023)) is None
+    assert len(fake.calls) == 2
+
+
+def test_empty_api_response_is_retried():
+    # previewFinalData при ошибке HTTP возвращает None
+    fake = FakePreview(result=lambda params: None if len(fake.calls) < 3 else _frame(params))
+    assert _engine(fake).fetch_one(build_request("8528", 2023)) is not None
+    assert len(fake.calls) == 3
+
+
+def test_hanging_request_times_out():
+    fake = FakePreview(delay=0.5)
+    started = time.perf_counter()
+    assert _engine(fake, timeout=0.05, retries=1).fetch_one(build_request("8528", 2023)) is None
+    assert time.perf_counter() - started < 0.4
+
+
+def test_fetch_many_keeps_order_and_bounds_workers():
+    fake = FakePreview(delay=0.05)
+    requests = [build_request("8528", year) for year in range(2015, 2025)]
+    results = _engine(fake, max_workers=3).fetch_many(requests)
+    assert [int(df["refYear"].iloc[0]) for df in results] == list(range(2015, 2025))
+    assert fake.max_active <= 3
+
+
+def test_rate_limiter_spaces_requests():
+    fake = FakePreview()
+    requests = [build_request("8528", year) for year in range(2019, 2025)]
+    started = time.perf_counter()
+    _engine(fake, max_workers=4, limiter=RateLimiter(20)).fetch_many(requests)
+    # 6 запросов при 20 в секунду — не быстрее 5 интервалов по 0.05 с
+    assert time.perf_counter() - started >= 0.24
+
+
+def test_check_hook_stops_download():
+    class Stop(Exception):
+        pass
+
+    fake = FakePreview()
+
+    def check():
+        if len(fake.calls) >= 2:
+            raise Stop
+
+    requests = [build_request("8528", year) for year in range(2015, 2025)]
+    with pytest.raises(Stop):
+        _engine(fake, max_workers=1, check=check).fetch_complete(requests)
+    assert len(fake.calls) == 2
+
+
+def test_truncated_response_is_split_by_period():
+    def result(params):
+        periods = params["period"].split(",")
+        rows = 4 if len(periods) > 1 else 2
+        return pd.concat([_frame({**params, "period": p}, rows // len(periods)) for p in periods],
+                         ignore_index=True)
+
+    fake = FakePreview(result=result)
+    request = build_request("8528", "2022,2023", max_records=4)
+    [data] = _engine(fake).fetch_complete([request])
+    assert len(fake.calls) == 3
+    assert sorted(data["refYear"].unique()) == [2022, 2023]
+    assert len(data) == 4
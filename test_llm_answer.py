@@ -0,0 +1,161 @@
+"""
+Проверки пула клиентов и кэша ответов GigaChat на локальной заглушке клиента
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from llm.llm_answer import (CUT_OFF_NOTE, RESPONSE_CACHE, ClientPool, cache_key, get_llm_answer,
+                            stream_llm_answer)
+from llm.prompt_builder import prompt_from_text
+
+
+def _response(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeGigaChat:
+    """Заглушка клиента GigaChat: chat / stream / close"""
+
+    def __init__(self, answer="Мера №1", delay=0.0, fail=False, chunk_delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.fail = fail
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self.closed = False
+
+    def chat(self, payload):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("fake 502")
+        return _response(self.answer)
+
+    def stream(self, payload):
+        self.calls += 1
+        for word in self.answer.split(" "):
+            time.sleep(self.chunk_delay)
+            yield _chunk(word + " ")
+
+    def close(self):
+        self.closed = True
+
+
+class Factory:
+    def __init__(self, **options):
+        self.options = options
+        self.clients = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        client = FakeGigaChat(**self.options)
+        with self._lock:
+            self.clients.append(client)
+        return client
+
+    @property
+    def calls(self):
+        return sum(client.calls for client in self.clients)
+
+
+def _prompt():
+    # уникальный текст — тесты не делят записи общего кэша ответов
+    return prompt_from_text(f"Код ТН ВЭД: {uuid.uuid4().hex}")
+
+
+def test_pool_reuses_returned_client():
+    factory = Factory()
+    pool = ClientPool(size=2, factory=factory)
+    with pool.client() as first:
+        pass
+    with pool.client() as second:
+        pass
+    assert first is second
+    assert len(factory.clients) == 1
+
+
+def test_pool_discards_client_after_error():
+    factory = Factory()
+    pool = ClientPool(size=1, factory=factory)
+    with pytest.raises(ConnectionError):
+        with pool.client() as broken:
+            raise ConnectionError("reset")
+    assert broken.closed
+    with pool.client() as fresh:
+        pass
+    assert fresh is not broken
+
+
+def test_pool_waits_for_free_client():
+    factory = Factory(delay=0.1)
+    pool = ClientPool(size=2, factory=factory)
+
+    def ask(_):
+        with pool.client() as giga:
+            return giga.chat({})
+
+    with ThreadPoolExecutor(6) as executor:
+        list(executor.map(ask, range(6)))
+    assert len(factory.clients) == 2
+    assert factory.calls == 6
+
+
+def test_answer_is_cached():
+    factory = Factory()
+    pool = ClientPool(factory=factory)
+    prompt = _prompt()
+    assert get_llm_answer(prompt, pool=pool) == "Мера №1"
+    assert get_llm_answer(prompt, pool=pool) == "Мера №1"
+    assert factory.calls == 1
+    assert RESPONSE_CACHE.get(cache_key(prompt)) == "Мера №1"
+
+
+def test_concurrent_same_prompt_is_sent_once():
+    factory = Factory(delay=0.2)
+    pool = ClientPool(size=4, factory=factory)
+    prompt = _prompt()
+    with ThreadPoolExecutor(5) as executor:
+        answers = list(executor.map(lambda _: get_llm_answer(prompt, pool=pool), range(5)))
+    assert answers == ["Мера №1"] * 5
+    assert factory.calls == 1
+
+
+def test_failed_answer_is_not_cached():
+    factory = Factory(fail=True)
+    pool = ClientPool(factory=factory)
+    prompt = _prompt()
+    with pytest.raises(ConnectionError):
+        get_llm_answer(prompt, pool=pool)
+    assert RESPONSE_CACHE.get(cache_key(prompt)) is None
+    assert factory.clients[0].closed
+
+
+def test_stream_caches_complete_answer():
+    factory = Factory(answer="Мера №2 применима")
+    pool = ClientPool(factory=factory)
+    prompt = _prompt()
+    parts = list(stream_llm_answer(prompt, pool=pool))
+    assert "".join(parts) == "Мера №2 применима "
+    assert list(stream_llm_answer(prompt, pool=pool)) == ["Мера №2 применима "]
+    assert factory.calls == 1
+
+
+def test_stream_cut_off_is_not_cached():
+    factory = Factory(answer="очень долгий ответ модели", chunk_delay=0.05)
+    pool = ClientPool(factory=factory)
+    prompt = _prompt()
+    parts = list(stream_llm_answer(prompt, pool=pool, max_seconds=0.08))
+    assert parts[-1] == CUT_OFF_NOTE
+    assert RESPONSE_CACHE.get(cache_key(prompt)) is None
+    # клиент с недочитанным ответом закрыт и в пул не возвращён
+    assert factory.clients[0].closed
@@ -0,0 +1,138 @@
+"""
+Проверки пакетных рекомендаций (recommend.run_prompts) на локальной заглушке GigaChat
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from llm.prompt_builder import prompt_from_text
+from recommend import AsyncRateLimiter, read_results, run_prompts
+
+
+class FakeAsyncGigaChat:
+    """Заглушка асинхронного клиента GigaChat: achat / aclose"""
+
+    def __init__(self, fail_first=None, hang_first=None, delay=0.01, always_fail=()):
+        self.fail_first = dict(fail_first or {})    # код -> сколько первых попыток падает
+        self.hang_first = dict(hang_first or {})    # код -> сколько первых попыток зависает
+        self.always_fail = set(always_fail)
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.closed = False
+
+    async def achat(self, payload):
+        code = payload["messages"][1]["content"].split("Код: ", 1)[1].split("\n", 1)[0]
+        self.calls.append(code)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if self.hang_first.get(code, 0) > 0:
+                self.hang_first[code] -= 1
+                await asyncio.sleep(3600)
+            await asyncio.sleep(self.delay)
+            if code in self.always_fail or self.fail_first.get(code, 0) > 0:
+                self.fail_first[code] = self.fail_first.get(code, 0) - 1
+                raise httpx.ConnectError("fake connection reset")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"ответ {code}"))],
+                                   usage=SimpleNamespace(total_tokens=100))
+        finally:
+            self.active -= 1
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _prompts(codes, note=""):
+    return {code: prompt_from_text(f"Код: {code}\n{note}") for code in codes}
+
+
+def _run(prompts, client, out_path, **options):
+    options = {"concurrency": 4, "rpm": 0, "timeout": 1.0, "retries": 2, "backoff": 0.0, **options}
+    return asyncio.run(run_prompts(prompts, out_path=str(out_path), client=client, **options))
+
+
+def test_all_codes_answered_with_bounded_concurrency(tmp_path):
+    client = FakeAsyncGigaChat()
+    codes = [f"84{i:04d}" for i in range(20)]
+    report = _run(_prompts(codes), client, tmp_path / "out.jsonl", concurrency=3)
+    assert sorted(report["results"]) == codes
+    assert report["results"]["840007"]["answer"] == "ответ 840007"
+    assert client.max_active <= 3
+    # переданный клиент закрывает вызывающий код
+    assert not client.closed
+
+
+def test_errors_and_hangs_are_retried(tmp_path):
+    client = FakeAsyncGigaChat(fail_first={"8428": 2}, hang_first={"8517": 1})
+    report = _run(_prompts(["8428", "8517", "8471"]), client, tmp_path / "out.jsonl", timeout=0.1)
+    assert sorted(report["results"]) == ["8428", "8471", "8517"]
+    assert client.calls.count("8428") == 3
+    assert client.calls.count("8517") == 2
+    assert report["failed"] == {}
+
+
+def test_failed_code_is_reported_and_not_written(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    client = FakeAsyncGigaChat(always_fail={"8428"})
+    report = _run(_prompts(["8428", "8517"]), client, out_path, retries=1)
+    assert list(report["failed"]) == ["8428"]
+    assert list(report["results"]) == ["8517"]
+    assert client.calls.count("8428") == 2
+    assert list(read_results(out_path)) == ["8517"]
+
+
+def test_resume_skips_answered_codes(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    codes = ["8428", "8517", "8471"]
+    _run(_prompts(codes[:2]), FakeAsyncGigaChat(), out_path)
+
+    client = FakeAsyncGigaChat()
+    report = _run(_prompts(codes), client, out_path)
+    assert sorted(report["reused"]) == ["8428", "8517"]
+    assert client.calls == ["8471"]
+    assert sorted(report["results"]) == sorted(codes)
+
+
+def test_changed_prompt_is_asked_again(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    _run(_prompts(["8428", "8517"]), FakeAsyncGigaChat(), out_path)
+
+    client = FakeAsyncGigaChat()
+    prompts = {**_prompts(["8517"]), **_prompts(["8428"], note="новые метрики")}
+    report = _run(prompts, client, out_path)
+    assert client.calls == ["8428"]
+    assert report["reused"] == ["8517"]
+
+
+def test_restart_ignores_previous_results(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    _run(_prompts(["8428"]), FakeAsyncGigaChat(), out_path)
+    client = FakeAsyncGigaChat()
+    report = _run(_prompts(["8428"]), client, out_path, resume=False)
+    assert client.calls == ["8428"]
+    assert report["reused"] == []
+    assert len(out_path.read_text(encoding="utf-8").splitlines()) == 1
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    out_path.write_text(json.dumps({"code": "8428", "key": "k", "answer": "a"}) + "\n{\"code\": \"85",
+                        encoding="utf-8")
+    assert list(read_results(out_path)) == ["8428"]
+
+
+def test_rate_limiter_spaces_requests():
+    async def run():
+        limiter = AsyncRateLimiter(rpm=1200)    # интервал 0.05 с
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(limiter.wait() for _ in range(5)))
+        return loop.time() - started
+
+    assert asyncio.run(run()) == pytest.approx(0.2, abs=0.05)
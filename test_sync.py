@@ -0,0 +1,97 @@
+"""
+Проверки плана инкрементального обновления (sync.plan) на заглушках Comtrade
+"""
+
+import os
+import time
+
+import pandas as pd
+
+import sync
+import trade_store
+from comtrade_fetch import FetchEngine, RateLimiter
+
+FETCHED_AT = "2024-01-01T00:00:00+00:00"
+
+
+def _rows(code, year, reporters):
+    return trade_store.with_request_code(
+        pd.DataFrame({"cmdCode": code, "refYear": year, "reporterCode": reporters,
+                      "flowCode": "X", "primaryValue": 1.0}), code)
+
+
+def _engine(fn):
+    return FetchEngine(fn, retries=0, limiter=RateLimiter(0))
+
+
+def _availability(released):
+    data = pd.DataFrame({"reporterCode": list(released), "lastReleased": list(released.values())})
+    return _engine(lambda **params: data)
+
+
+class FakeCount:
+    def __init__(self, counts):
+        self.counts = counts
+        self.calls = []
+
+    def __call__(self, **params):
+        self.calls.append(params["cmdCode"])
+        return pd.DataFrame({"count": [self.counts[params["cmdCode"]]]})
+
+
+def _set_written_at(store_dir, code, year, written_at):
+    path = os.path.join(store_dir, f"refYear={year}", f"cmdCode={code}")
+    for name in os.listdir(path):
+        os.utime(os.path.join(path, name), (written_at, written_at))
+
+
+def test_changed_only_when_stored_reporter_released(tmp_path):
+    store_dir = str(tmp_path)
+    trade_store.write(pd.concat([_rows("8428", 2023, [156, 276]), _rows("8517", 2023, [392]),
+                                 _rows("8471", 2023, [156])]), store_dir)
+    sync.write_manifest({f"{code}|2023": {"rows": rows, "fetched_at": FETCHED_AT}
+                         for code, rows in (("8428", 2), ("8517", 1), ("8471", 1))}, store_dir)
+    for code in ("8428", "8517", "8471"):
+        _set_written_at(store_dir, code, 2023, pd.Timestamp(FETCHED_AT).timestamp())
+    probe = FakeCount({"8517": 1, "8471": 2})
+
+    status = sync.plan(["8428", "8517", "8471"], [2023], store_dir=store_dir,
+                       availability_engine=_availability({156: "2023-06-01", 276: "2024-05-01",
+                                                          392: "2023-01-01", 999: "2024-06-01"}),
+                       probe_engine=_engine(probe))
+
+    assert status == {("8428", 2023): sync.CHANGED,      # перевыпустил репортёр 276 из хранилища
+                      ("8517", 2023): sync.UNCHANGED,    # выпускал только 999, строк столько же
+                      ("8471", 2023): sync.CHANGED}      # выпускал 999, строк стало больше
+    assert sorted(probe.calls) == ["8471", "8517"]
+
+
+def test_store_written_without_manifest_is_not_new(tmp_path):
+    # раздел записал batch_ingest / приложение: манифеста нет
+    store_dir = str(tmp_path)
+    trade_store.write(_rows("8428", 2023, [156, 276]), store_dir)
+    written_at = time.time()
+    probe = FakeCount({"8428": 2})
+
+    status = sync.plan(["8428", "8517"], [2023], store_dir=store_dir,
+                       availability_engine=_availability({156: "2023-06-01"}),
+                       probe_engine=_engine(probe))
+
+    assert status == {("8428", 2023): sync.UNCHANGED, ("8517", 2023): sync.NEW}
+    assert probe.calls == []
+    entry = sync.stored_entries(["8428"], [2023], store_dir)["8428|2023"]
+    assert entry["rows"] == 2
+    assert pd.Timestamp(entry["fetched_at"]).timestamp() >= written_at - 2
+
+
+def test_partition_rewritten_after_sync_uses_its_write_time(tmp_path):
+    store_dir = str(tmp_path)
+    trade_store.write(_rows("8428", 2023, [156, 276, 392]), store_dir)
+    sync.write_manifest({"8428|2023": {"rows": 2, "fetched_at": FETCHED_AT}}, store_dir)
+
+    status = sync.plan(["8428"], [2023], store_dir=store_dir,
+                       availability_engine=_availability({276: "2024-05-01"}),
+                       probe_engine=_engine(FakeCount({"8428": 3})))
+
+    # приложение перезаписало раздел после выпуска 2024-05-01 — перезагрузка не нужна
+    assert status == {("8428", 2023): sync.UNCHANGED}
@@ -0,0 +1,235 @@
+"""
+Локальное хранилище строк Comtrade (Parquet с разбиением refYear/cmdCode)
+
+Загруженные данные сохраняются между запусками, а вопросы «несколько кодов ×
+несколько лет» решаются чтением с диска, без новых запросов к API:
+- разделы refYear=<год>/cmdCode=<код>: фильтр по году и коду отбрасывает
+  лишние каталоги ещё до чтения (partition pruning);
+- внутри раздела строки отсортированы по reporterCode, фильтр по репортёрам
+  проверяется по статистике групп строк Parquet (predicate pushdown);
+- раздел называется по запрошенному коду: после деления обрезанного ответа
+  по подсубпозициям строки 8428 приходят с кодами 842810, 842820, ... и всё
+  равно лежат в разделе cmdCode=8428, поэтому stored_years("8428") их находит.
+  Собственный код строки хранится в колонке cmdSubCode; query возвращает его
+  в cmdCode, а запрошенный код — в requestCode;
+- запись раздела заменяет его целиком, поэтому повторная загрузка года
+  не создаёт дубликатов; записи из разных процессов (приложение, фоновые
+  задачи, CLI) выполняются по очереди под файловой блокировкой.
+
+Формат совпадает с тем, что раньше писал batch_ingest.write_dataset,
+так что существующий каталог data/trade читается без миграции.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+STORE_DIR = os.getenv("TRADE_STORE_DIR", os.path.join("data", "trade"))
+ROW_GROUP_SIZE = 64 * 1024
+LOCK_NAME = "_write.lock"
+LOCK_TIMEOUT = 120    # сколько ждать блокировку записи, с
+LOCK_STALE = 600      # блокировка старше этого считается брошенной (процесс упал), с
+
+# cmdCode — строка: у кодов вроде 0101 значим ведущий ноль
+PARTITIONING = ds.partitioning(
+    pa.schema([("refYear", pa.int32()), ("cmdCode", pa.string())]), flavor="hive")
+
+
+def _normalize(df: pd.DataFrame) -> pa.Table:
+    """Таблица для записи: разделы по запрошенным кодам, ключи нужных типов, пустые колонки — строковые"""
+    df = df.copy()
+    df["cmdSubCode"] = df["cmdCode"].astype(str)
+    request = df.pop("requestCode") if "requestCode" in df.columns else None
+    df["cmdCode"] = df["cmdSubCode"] if request is None else request.astype(str)
+    df["refYear"] = df["refYear"].astype("int32")
+    if "reporterCode" in df.columns:
+        df = df.sort_values("reporterCode", kind="stable")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # колонка без значений получает тип null и конфликтует с тем же полем в других разделах
+    fields = [pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+              for f in table.schema]
+    return table.cast(pa.schema(fields))
+
+
+@contextmanager
+def _write_lock(store_dir):
+    """Межпроцессная блокировка записи в хранилище (файл создаётся атомарно)"""
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, LOCK_NAME)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > LOCK_STALE:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Хранилище {store_dir} занято другой записью")
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def with_request_code(df: pd.DataFrame, code) -> pd.DataFrame:
+    """Ответ на запрос кода code с отметкой запрошенного кода — раздела для write"""
+    return df.assign(requestCode=str(code))
+
+
+def write(df: pd.DataFrame, store_dir=None):
+    """
+    Записывает строки; разделы (год, код), присутствующие в df, перезаписываются.
+
+    Раздел строки — её requestCode (см. with_request_code), а если такой колонки
+    нет — её собственный cmdCode.
+    """
+    if df is None or df.empty:
+        return
+    store_dir = store_dir or STORE_DIR
+    table = _normalize(df)
+    # delete_matching удаляет файлы раздела перед записью — параллельные записи
+    # одного раздела удалили бы файлы друг друга
+    with _write_lock(store_dir):
+        ds.write_dataset(
+            table, store_dir, format="parquet",
+            partitioning=PARTITIONING,
+            existing_data_behavior="delete_matching",
+            basename_template="part-{i}.parquet",
+            max_rows_per_group=ROW_GROUP_SIZE,
+        )
+
+
+def _partitions(store_dir, codes=None, years=None):
+    """Каталоги разделов (год, код, путь), отобранные по именам — без чтения файлов"""
+    if not os.path.isdir(store_dir):
+        return []
+    codes = None if codes is None else {str(c) for c in codes}
+    years = None if years is None else {int(y) for y in years}
+    partitions = []
+    for year_dir in os.listdir(store_dir):
+        if not year_dir.startswith("refYear="):
+            continue
+        year = int(year_dir.split("=", 1)[1])
+        if years is not None and year not in years:
+            continue
+        year_path = os.path.join(store_dir, year_dir)
+        for code_dir in os.listdir(year_path):
+            code = code_dir.split("=", 1)[1] if code_dir.startswith("cmdCode=") else None
+            if code is None or (codes is not None and code not in codes):
+                continue
+            partitions.append((year, code, os.path.join(year_path, code_dir)))
+    return partitions
+
+
+def _files(path):
+    return [os.path.join(path, name) for name in os.listdir(path) if name.endswith(".parquet")]
+
+
+def _dataset(store_dir, codes=None, years=None):
+    paths = [f for _, _, path in _partitions(store_dir, codes, years) for f in _files(path)]
+    if not paths:
+        return None
+    # поля в разных разделах могут отличаться типом (int/float) — общая схема по отобранным файлам
+    schema = pa.unify_schemas([pq.read_schema(path) for path in paths] + [PARTITIONING.schema],
+                              promote_options="permissive")
+    return ds.dataset(paths, schema=schema, format="parquet",
+                      partitioning=PARTITIONING, partition_base_dir=store_dir)
+
+
+def _isin(name, values, cast):
+    return ds.field(name).isin([cast(v) for v in values])
+
+
+def query(codes=None, years=None, *, reporters=None, flow_code=None, columns=None,
+          store_dir=None) -> pd.DataFrame:
+    """
+    Строки хранилища по фильтрам; None — без ограничения.
+
+    Args:
+        codes: запрошенные коды ТН ВЭД (разделы хранилища, точное совпадение)
+        years: годы refYear
+        reporters: коды стран-репортёров M49 (reporterCode)
+        flow_code: направление потока ('X', 'M')
+        columns: какие колонки читать (по умолчанию — все)
+
+    Returns:
+        pd.DataFrame: cmdCode — код строки, requestCode — запрошенный код (раздел);
+                      пустая таблица, если хранилище пусто или ничего не найдено
+    """
+    dataset = _dataset(store_dir or STORE_DIR, codes, years)
+    if dataset is None:
+        return pd.DataFrame(columns=columns or [])
+    if columns is not None:
+        names = [c for c in columns if c != "requestCode"]
+        if "cmdCode" not in names and "requestCode" in columns:
+            names.append("cmdCode")
+        if "cmdCode" in names and "cmdSubCode" in dataset.schema.names:
+            names.append("cmdSubCode")
+        requested, columns = columns, names
+
+    conditions = []
+    if codes is not None:
+        conditions.append(_isin("cmdCode", codes, str))
+    if years is not None:
+        conditions.append(_isin("refYear", years, int))
+    if reporters is not None:
+        conditions.append(_isin("reporterCode", reporters, int))
+    if flow_code is not None:
+        conditions.append(ds.field("flowCode") == flow_code)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    table = dataset.to_table(columns=columns, filter=expression)
+    df = table.to_pandas()
+    if "refYear" in df.columns:
+        df["refYear"] = df["refYear"].astype("int64")
+    if "cmdCode" in df.columns:
+        df["requestCode"] = df["cmdCode"].astype(str)
+        if "cmdSubCode" in df.columns:
+            # разделы, записанные до появления cmdSubCode, его не содержат
+            df["cmdCode"] = df.pop("cmdSubCode").fillna(df["requestCode"])
+    if columns is not None:
+        df = df[requested]
+    return df
+
+
+def inventory(store_dir=None, codes=None, years=None) -> pd.DataFrame:
+    """
+    Что есть в хранилище: cmdCode, refYear, rows, updated (время записи раздела).
+    Читаются только каталоги и метаданные файлов, не сами данные.
+    codes, years — отбор разделов (None — все).
+    """
+    records = []
+    for year, code, path in _partitions(store_dir or STORE_DIR, codes, years):
+        files = _files(path)
+        if files:
+            records.append({
+                "cmdCode": code,
+                "refYear": year,
+                "rows": sum(pq.read_metadata(f).num_rows for f in files),
+                "updated": max(os.path.getmtime(f) for f in files),
+            })
+    return pd.DataFrame(records, columns=["cmdCode", "refYear", "rows", "updated"])
+
+
+def stored_years(code, years=None, store_dir=None) -> list:
+    """Годы, по которым запрошенный код уже есть в хранилище (без чтения данных)"""
+    return sorted(year for year, _, path in _partitions(store_dir or STORE_DIR, [code], years)
+                  if _files(path))
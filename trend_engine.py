@@ -0,0 +1,214 @@
+"""
+Векторный расчёт трендов по метрикам импорта
+
+Данные раскладываются в куб NumPy формы (коды × годы × метрики), и все показатели
+считаются сразу для всех кодов и метрик:
+- first / last, delta_abs, delta_pct, cagr — как раньше в summarize_trends;
+- slope — наклон линии МНК (единиц в год), пропуски не учитываются;
+- label — «Положительный» / «Отрицательный» / «Стабильный» по delta_pct и порогу eps;
+- rolling_mean / rolling_delta_pct — показатели по скользящим окнам лет
+  (в screen_trends — по последнему окну из window лет).
+
+Число лет не ограничено тремя: те же функции работают на окнах в 5 и 10 лет.
+Модуль не зависит от Plotly — графики строит draw_image.
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+TREND_METRICS = ["import_total", "share_unfriendly", "share_china", "price_diff_ratio"]
+
+LABEL_POSITIVE = "Положительный"
+LABEL_NEGATIVE = "Отрицательный"
+LABEL_STABLE = "Стабильный"
+
+# Метрики, по которым summarize_trends строит тренды: (ключ, заголовок, в процентах)
+TREND_TITLES = [
+    ("import_total", "Импорт, всего", False),
+    ("share_unfriendly", "Доля НС", True),
+    ("share_china", "Доля Китая", True),
+]
+
+
+def norm_year(y):
+    # год может прийти как int, [2024], np.array([2024]) — приведём к int
+    if isinstance(y, (list, tuple, np.ndarray)) and len(y) > 0:
+        return int(y[0])
+    if y is None or isinstance(y, (list, tuple, np.ndarray)):
+        raise ValueError("В записи метрик нет года (таблица без строк?)")
+    return int(y)
+
+
+def records_to_cube(records_by_code, metrics=TREND_METRICS, years=None):
+    """
+    Раскладывает записи calc_import_metrics в куб.
+
+    Args:
+        records_by_code: {код: [записи за годы]} (порядок записей не важен)
+        metrics: какие метрики брать
+        years: ось лет; по умолчанию — все встреченные годы по возрастанию
+
+    Returns:
+        tuple: (cube float64 формы (коды, годы, метрики), список кодов, список лет);
+               отсутствующие значения — NaN
+    """
+    codes = list(records_by_code)
+    by_code = {code: {norm_year(r["year"]): r for r in records}
+               for code, records in records_by_code.items()}
+    if years is None:
+        years = sorted({y for rows in by_code.values() for y in rows})
+    years = [int(y) for y in years]
+
+    cube = np.full((len(codes), len(years), len(metrics)), np.nan)
+    for i, code in enumerate(codes):
+        rows = by_code[code]
+        for j, year in enumerate(years):
+            record = rows.get(year)
+            if record is None:
+                continue
+            cube[i, j] = [record.get(m, np.nan) for m in metrics]
+    return cube, codes, years
+
+
+def trend_labels(delta_pct, eps=0.02):
+    """Ярлык тренда по относительному изменению (NaN → «Стабильный»)"""
+    delta_pct = np.asarray(delta_pct, dtype=float)
+    return np.select([delta_pct > eps, delta_pct < -eps],
+                     [LABEL_POSITIVE, LABEL_NEGATIVE], LABEL_STABLE).astype(object)
+
+
+def ls_slope(values, years, axis=1):
+    """Наклон МНК вдоль оси лет (пропуски не учитываются; меньше двух точек — NaN)"""
+    y = np.moveaxis(np.asarray(values, dtype=float), axis, -1)
+    x = np.asarray(years, dtype=float)
+    mask = np.isfinite(y)
+    count = mask.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_mean = (x * mask).sum(axis=-1) / count
+        y_mean = np.where(mask, y, 0).sum(axis=-1) / count
+        dx = np.where(mask, x - x_mean[..., None], 0)
+        dy = np.where(mask, y - y_mean[..., None], 0)
+        slope = (dx * dy).sum(axis=-1) / (dx * dx).sum(axis=-1)
+    return np.where(count >= 2, slope, np.nan)
+
+
+def trend_stats(cube, years, eps=0.02):
+    """
+    Показатели трендов для куба (коды × годы × метрики).
+
+    Returns:
+        dict: массивы формы (коды, метрики): first, last, delta_abs, delta_pct,
+              cagr, slope, label
+    """
+    cube = np.asarray(cube, dtype=float)
+    first = cube[:, 0, :]
+    last = cube[:, -1, :]
+    delta_abs = last - first
+    # CAGR на (число лет - 1) интервалов
+    n = cube.shape[1] - 1
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta_pct = np.where(first != 0, delta_abs / first, np.nan)
+        cagr = np.where((first > 0) & (last > 0) & (n > 0),
+                        (last / first) ** (1 / max(n, 1)) - 1, np.nan)
+
+    return {
+        "first": first,
+        "last": last,
+        "delta_abs": delta_abs,
+        "delta_pct": delta_pct,
+        "cagr": cagr,
+        "slope": ls_slope(cube, years),
+        "label": trend_labels(delta_pct, eps),
+    }
+
+
+def _check_window(cube, window):
+    n_years = cube.shape[1]
+    if not 1 <= window <= n_years:
+        raise ValueError(f"Окно {window} лет не помещается в {n_years} лет данных")
+
+
+def rolling_mean(cube, window):
+    """Скользящее среднее по годам: форма (коды, годы - window + 1, метрики)"""
+    cube = np.asarray(cube, dtype=float)
+    _check_window(cube, window)
+    return sliding_window_view(cube, window, axis=1).mean(axis=-1)
+
+
+def rolling_delta_pct(cube, window):
+    """Относительное изменение внутри каждого окна из window лет (та же форма, что у rolling_mean)"""
+    cube = np.asarray(cube, dtype=float)
+    _check_window(cube, window)
+    start = cube[:, :cube.shape[1] - window + 1, :]
+    end = cube[:, window - 1:, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(start != 0, (end - start) / start, np.nan)
+
+
+def screen_trends(records_by_code, metrics=TREND_METRICS, years=None, eps=0.02, window=None):
+    """
+    Тренды по многим кодам одним вызовом.
+
+    window — число лет скользящего окна: добавляет колонки rolling_mean
+    и rolling_delta_pct по последнему окну; ValueError, если окно длиннее периода.
+
+    Returns:
+        pd.DataFrame: строка на пару (код, метрика) с колонками
+                      first, last, delta_abs, delta_pct, cagr, slope, label
+                      (и rolling_mean, rolling_delta_pct, если задано window)
+    """
+    cube, codes, years = records_to_cube(records_by_code, metrics, years)
+    stats = trend_stats(cube, years, eps) if codes and years else {}
+    if window is not None and codes:
+        stats["rolling_mean"] = rolling_mean(cube, window)[:, -1, :]
+        stats["rolling_delta_pct"] = rolling_delta_pct(cube, window)[:, -1, :]
+    index = pd.MultiIndex.from_product([codes, metrics], names=["code", "metric"])
+    return pd.DataFrame({key: np.asarray(values).reshape(-1) for key, values in stats.items()},
+                        index=index)
+
+
+def summarize_trends(records, eps=0.02):
+    """
+    records: список записей calc_import_metrics за любое число лет.
+    Возвращает:
+      - yearly (отсортированный список по году)
+      - trends (словарь по метрикам, включая наклон МНК slope)
+      - flags (булевы/текстовые флаги под меры)
+    """
+    # 1) нормализуем и сортируем по году
+    items = sorted(((norm_year(r.get("year")), r) for r in records), key=lambda t: t[0])
+    years = [t[0] for t in items]
+    data = [t[1] for t in items]
+
+    # 2) куб 1 × годы × метрики и все тренды одним векторным расчётом
+    cube, _, _ = records_to_cube({0: data}, TREND_METRICS, years)
+    stats = trend_stats(cube, years, eps)
+
+    # 3) тренды (только для трёх метрик)
+    trends = {}
+    for key, title, _ in TREND_TITLES:
+        k = TREND_METRICS.index(key)
+        trends[key] = {
+            "title": title,
+            "first": float(stats["first"][0, k]),
+            "last": float(stats["last"][0, k]),
+            "delta_abs": float(stats["delta_abs"][0, k]),
+            "delta_pct": float(stats["delta_pct"][0, k]),
+            "cagr": float(stats["cagr"][0, k]),
+            "slope": float(stats["slope"][0, k]),
+            "label": stats["label"][0, k],
+        }
+
+    # 4) флаги для мер
+    last_ratio = cube[0, -1, TREND_METRICS.index("price_diff_ratio")]
+    dumping_flag = bool(np.isfinite(last_ratio) and last_ratio < 1.0)
+    flags = {
+        "for_measure_1_2:share_unfriendly_trend": trends["share_unfriendly"]["label"],
+        "for_measure_3:share_china_trend": trends["share_china"]["label"],
+        "for_measure_3:dumping_flag(price_ratio<1)": dumping_flag,
+        "for_measure_5:import_total_trend": trends["import_total"]["label"],
+    }
+
+    return {"years": years, "yearly": data, "trends": trends, "flags": flags}